@@ -0,0 +1,459 @@
+import asyncio
+import json
+import logging
+import random
+import re
+import time
+import uuid
+from email.utils import formatdate
+from typing import Any, Callable, Dict, List, Optional
+from xml.etree import ElementTree
+import aiohttp
+from aiohttp import web
+import grpc
+from google.protobuf import empty_pb2
+from dapr.proto.runtime.v1 import dapr_pb2, dapr_pb2_grpc
+
+# local stand-ins for the external services of the pipeline, used by run.py
+#  FakeBlobStorage: the part of the Azure Blob REST API used by the apps (Azurite-style, path-style URLs)
+#  FakeTika: the Tika server endpoint used by tika-python
+#  FakeLLM: Azure OpenAI, Groq and Ollama chat endpoints with configurable latency, streamed on request
+#  FakeDaprSidecar: Dapr HTTP and gRPC APIs with an in-memory state store and pub/sub
+
+class Latency:
+    def __init__(self, mean_ms: float = 0, jitter_ms: float = 0):
+        self.mean_ms = mean_ms
+        self.jitter_ms = jitter_ms
+
+    def sample_ms(self) -> float:
+        return max(self.mean_ms + random.uniform(-self.jitter_ms, self.jitter_ms), 0)
+
+    async def wait(self):
+        delay = self.sample_ms()
+        if delay > 0:
+            await asyncio.sleep(delay / 1000)
+
+class FakeBlobStorage:
+    def __init__(self, latency: Latency):
+        self.latency = latency
+        self.blobs: Dict[str, bytes] = {}
+        self.blocks: Dict[str, Dict[str, bytes]] = {}
+
+    def routes(self) -> List[web.RouteDef]:
+        return [
+            web.put('/{account}/{container}/{blob:.+}', self.put),
+            web.get('/{account}/{container}/{blob:.+}', self.get),
+        ]
+
+    async def put(self, request: web.Request) -> web.Response:
+        await self.latency.wait()
+        path = f"{request.match_info['container']}/{request.match_info['blob']}"
+        body = await request.read()
+        comp = request.query.get('comp')
+
+        if comp == 'block':
+            self.blocks.setdefault(path, {})[request.query['blockid']] = body
+        elif comp == 'blocklist':
+            staged = self.blocks.pop(path, {})
+            block_ids = [element.text for element in ElementTree.fromstring(body)]
+            self.blobs[path] = b''.join(staged[block_id] for block_id in block_ids)
+        else:
+            self.blobs[path] = body
+        return web.Response(status=201, headers=self._headers())
+
+    async def get(self, request: web.Request) -> web.Response:
+        await self.latency.wait()
+        path = f"{request.match_info['container']}/{request.match_info['blob']}"
+        content = self.blobs.get(path)
+        if content is None:
+            return web.Response(status=404, headers={'x-ms-error-code': 'BlobNotFound'})
+
+        headers = self._headers()
+        headers['x-ms-blob-type'] = 'BlockBlob'
+        byte_range = request.headers.get('x-ms-range') or request.headers.get('Range')
+        if not byte_range:
+            return web.Response(status=200, body=content, headers=headers)
+
+        start, end = [int(value) for value in byte_range.split('=')[1].split('-')]
+        end = min(end, len(content) - 1)
+        headers['Content-Range'] = f"bytes {start}-{end}/{len(content)}"
+        return web.Response(status=206, body=content[start:end + 1], headers=headers)
+
+    def _headers(self) -> Dict[str, str]:
+        return {
+            'ETag': f'"0x{uuid.uuid4().hex[:16].upper()}"',
+            'Last-Modified': formatdate(usegmt=True),
+            'x-ms-request-id': str(uuid.uuid4()),
+            'x-ms-version': '2021-08-06',
+        }
+
+class FakeTika:
+    def __init__(self, latency: Latency):
+        self.latency = latency
+
+    def routes(self) -> List[web.RouteDef]:
+        return [web.put('/rmeta/text', self.rmeta), web.put('/tika', self.tika)]
+
+    async def rmeta(self, request: web.Request) -> web.Response:
+        text = await self._extract(request)
+        return web.json_response([{'Content-Type': 'application/pdf', 'xmpTPg:NPages': '1', 'X-TIKA:content': text}])
+
+    async def tika(self, request: web.Request) -> web.Response:
+        return web.Response(text=await self._extract(request))
+
+    async def _extract(self, request: web.Request) -> str:
+        body = await request.read()
+        await self.latency.wait()
+        # printable runs of the document stand in for its text layer
+        runs = re.findall(rb'[\x20-\x7e]{4,}', body)
+        return '\n'.join(run.decode('ascii') for run in runs[:2000])
+
+# characters per streamed piece of a response, about four tokens
+STREAM_PIECE_CHARS = 16
+
+class FakeLLM:
+    def __init__(self, latency: Latency):
+        self.latency = latency
+        self.requests = 0
+
+    def routes(self) -> List[web.RouteDef]:
+        return [
+            web.post('/openai/deployments/{deployment}/chat/completions', self.openai),  # Azure OpenAI
+            web.post('/openai/v1/chat/completions', self.openai),  # Groq
+            web.post('/api/chat', self.ollama),
+        ]
+
+    async def openai(self, request: web.Request) -> web.StreamResponse:
+        body = await request.json()
+        if body.get('stream'):
+            return await self._stream_openai(request, body)
+        content = await self._complete(body)
+        prompt_tokens = sum(len(str(message.get('content', ''))) for message in body.get('messages', [])) // 4
+        completion_tokens = len(content) // 4
+        return web.json_response({
+            'id': f"chatcmpl-{uuid.uuid4().hex}",
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': body.get('model', 'bench'),
+            'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': content}, 'finish_reason': 'stop'}],
+            'usage': {'prompt_tokens': prompt_tokens, 'completion_tokens': completion_tokens, 'total_tokens': prompt_tokens + completion_tokens},
+        })
+
+    async def ollama(self, request: web.Request) -> web.StreamResponse:
+        body = await request.json()
+        # Ollama streams unless stream is false
+        if body.get('stream', True):
+            return await self._stream_ollama(request, body)
+        content = await self._complete(body)
+        return web.json_response({
+            'model': body.get('model', 'bench'),
+            'created_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            'message': {'role': 'assistant', 'content': content},
+            'done': True,
+        })
+
+    async def _complete(self, body: Dict[str, Any]) -> str:
+        self.requests += 1
+        await self.latency.wait()
+        return self._content(body)
+
+    async def _stream(self, body: Dict[str, Any]):
+        # the latency is spread over the pieces of the response, like tokens being generated
+        self.requests += 1
+        content = self._content(body)
+        pieces = [content[i:i + STREAM_PIECE_CHARS] for i in range(0, len(content), STREAM_PIECE_CHARS)] or ['']
+        delay = self.latency.sample_ms() / len(pieces) / 1000
+        for piece in pieces:
+            await asyncio.sleep(delay)
+            yield piece
+
+    async def _stream_openai(self, request: web.Request, body: Dict[str, Any]) -> web.StreamResponse:
+        response = web.StreamResponse(headers={'Content-Type': 'text/event-stream'})
+        await response.prepare(request)
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        chunk = {'id': completion_id, 'object': 'chat.completion.chunk', 'created': int(time.time()), 'model': body.get('model', 'bench')}
+        completion_tokens = 0
+        async for piece in self._stream(body):
+            completion_tokens += len(piece) // 4
+            await response.write(f"data: {json.dumps({**chunk, 'choices': [{'index': 0, 'delta': {'content': piece}, 'finish_reason': None}]})}\n\n".encode())
+
+        prompt_tokens = sum(len(str(message.get('content', ''))) for message in body.get('messages', [])) // 4
+        usage = {'prompt_tokens': prompt_tokens, 'completion_tokens': completion_tokens, 'total_tokens': prompt_tokens + completion_tokens}
+        # Groq puts the usage in x_groq of the last chunk, OpenAI sends it in a chunk of its own
+        await response.write(f"data: {json.dumps({**chunk, 'choices': [{'index': 0, 'delta': {}, 'finish_reason': 'stop'}], 'x_groq': {'id': completion_id, 'usage': usage}})}\n\n".encode())
+        if (body.get('stream_options') or {}).get('include_usage'):
+            await response.write(f"data: {json.dumps({**chunk, 'choices': [], 'usage': usage})}\n\n".encode())
+        await response.write(b"data: [DONE]\n\n")
+        await response.write_eof()
+        return response
+
+    async def _stream_ollama(self, request: web.Request, body: Dict[str, Any]) -> web.StreamResponse:
+        response = web.StreamResponse(headers={'Content-Type': 'application/x-ndjson'})
+        await response.prepare(request)
+        part = {'model': body.get('model', 'bench'), 'created_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())}
+        eval_count = 0
+        async for piece in self._stream(body):
+            eval_count += len(piece) // 4
+            await response.write((json.dumps({**part, 'message': {'role': 'assistant', 'content': piece}, 'done': False}) + "\n").encode())
+        prompt_eval_count = sum(len(str(message.get('content', ''))) for message in body.get('messages', [])) // 4
+        await response.write((json.dumps({**part, 'message': {'role': 'assistant', 'content': ''}, 'done': True,
+                                          'prompt_eval_count': prompt_eval_count, 'eval_count': eval_count}) + "\n").encode())
+        await response.write_eof()
+        return response
+
+    def _content(self, body: Dict[str, Any]) -> str:
+        messages = body.get('messages', [])
+        system = next((str(message.get('content', '')) for message in messages if message.get('role') == 'system'), '')
+        user = next((str(message.get('content', '')) for message in messages if message.get('role') == 'user'), '')
+        documents = max(1, user.count('<document index='))
+
+        response_format = body.get('response_format') or {}
+        if response_format.get('type') == 'json_schema':
+            schema = response_format['json_schema']['schema']
+            return json.dumps(_sample_from_schema(schema, schema, documents))
+
+        # Groq lists the fields as "- name (type)", Ollama passes a JSON example
+        fields = dict(re.findall(r'^- (\w+) \((.+)\)$', system, re.MULTILINE))
+        if not fields and '{' in system:
+            try:
+                fields = json.loads(system[system.index('{'):system.rindex('}') + 1])
+            except ValueError:
+                fields = {}
+        result = {key: _sample_from_type(value) for key, value in fields.items()}
+        if documents > 1:
+            return json.dumps({'documents': [result] * documents})
+        return json.dumps(result)
+
+def _sample_from_schema(schema: Dict[str, Any], root: Dict[str, Any], documents: int = 1) -> Any:
+    if '$ref' in schema:
+        schema = root['$defs'][schema['$ref'].split('/')[-1]]
+    schema_type = schema.get('type')
+    if schema_type == 'object':
+        properties = schema.get('properties', {})
+        if list(properties) == ['documents']:
+            return {'documents': [_sample_from_schema(properties['documents']['items'], root) for _ in range(documents)]}
+        return {key: _sample_from_schema(value, root) for key, value in properties.items()}
+    if schema_type == 'array':
+        return [_sample_from_schema(schema.get('items', {}), root)]
+    if schema_type == 'number':
+        return 1.0
+    if schema_type == 'integer':
+        return 1
+    if schema_type == 'boolean':
+        return True
+    if 'date and time' in schema.get('description', ''):
+        return '2024-01-01T00:00:00'
+    if 'date' in schema.get('description', ''):
+        return '2024-01-01'
+    return 'sample'
+
+def _sample_from_type(value: Any) -> Any:
+    if isinstance(value, dict):
+        return {key: _sample_from_type(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_sample_from_type(item) for item in value]
+    value = str(value)
+    if 'float' in value:
+        return 1.0
+    if 'int' in value:
+        return 1
+    if 'bool' in value:
+        return True
+    return 'sample'
+
+class FakeDaprSidecar:
+    """
+    One sidecar shared by both apps.
+
+    The upload app uses the gRPC API (template state and template events) and the HTTP API
+    (publish, bulk publish and job state), the process app the HTTP API (service invocation and state). State has ETags. Published events are delivered to the
+    subscriptions the process app returns from /dapr/subscribe, with at most
+    delivery_concurrency deliveries in flight, like Dapr's app-max-concurrency.
+    """
+    def __init__(self, app_ports: Dict[str, int], subscriber_app_id: str, delivery_concurrency: int,
+                 on_published: Callable[[Dict[str, Any]], None] = None, on_delivered: Callable[[Dict[str, Any], bool], None] = None,
+                 max_attempts: int = 3):
+        self.app_ports = app_ports
+        self.subscriber_app_id = subscriber_app_id
+        self.delivery_concurrency = delivery_concurrency
+        self.on_published = on_published or (lambda data: None)
+        self.on_delivered = on_delivered or (lambda data, ok: None)
+        self.max_attempts = max_attempts
+        self.state: Dict[str, Dict[str, bytes]] = {}
+        self.etags: Dict[str, Dict[str, int]] = {}
+        self.subscriptions: Dict[str, Dict[str, Any]] = {}
+        self.queues: Dict[str, asyncio.Queue] = {}
+        self.workers: List[asyncio.Task] = []
+        self.session: Optional[aiohttp.ClientSession] = None
+
+    def routes(self) -> List[web.RouteDef]:
+        return [
+            web.get('/v1.0/healthz', self.healthz),
+            web.get('/v1.0/state/{store}/{key}', self.get_state),
+            web.post('/v1.0/state/{store}', self.save_state),
+            web.post('/v1.0/state/{store}/bulk', self.get_bulk_state),
+            web.post('/v1.0/publish/{pubsub}/{topic}', self.publish),
+            web.post('/v1.0-alpha1/publish/bulk/{pubsub}/{topic}', self.bulk_publish),
+            web.route('*', '/{path:.*}', self.invoke),
+        ]
+
+    async def start(self):
+        self.session = aiohttp.ClientSession()
+
+    async def stop(self):
+        for worker in self.workers:
+            worker.cancel()
+        if self.session:
+            await self.session.close()
+
+    async def load_subscriptions(self):
+        port = self.app_ports[self.subscriber_app_id]
+        async with self.session.get(f"http://127.0.0.1:{port}/dapr/subscribe") as response:
+            subscriptions = await response.json()
+        for subscription in subscriptions:
+            topic = subscription['topic']
+            self.subscriptions[topic] = subscription
+            self.queues.setdefault(topic, asyncio.Queue())
+            for _ in range(self.delivery_concurrency):
+                self.workers.append(asyncio.create_task(self._deliver(topic)))
+        logging.info(f"Subscriptions loaded: {list(self.subscriptions)}")
+
+    # HTTP API
+
+    async def healthz(self, request: web.Request) -> web.Response:
+        return web.Response(status=204)
+
+    async def get_state(self, request: web.Request) -> web.Response:
+        store, key = request.match_info['store'], request.match_info['key']
+        value = self.state.get(store, {}).get(key)
+        if value is None:
+            return web.Response(status=204)
+        return web.Response(status=200, body=value, content_type='application/json', headers={'ETag': str(self.etags[store][key])})
+
+    async def get_bulk_state(self, request: web.Request) -> web.Response:
+        store = request.match_info['store']
+        items = []
+        for key in (await request.json())['keys']:
+            value = self.state.get(store, {}).get(key)
+            item = {'key': key}
+            if value is not None:
+                item.update({'data': json.loads(value), 'etag': str(self.etags[store][key])})
+            items.append(item)
+        return web.json_response(items)
+
+    async def save_state(self, request: web.Request) -> web.Response:
+        store = request.match_info['store']
+        items = await request.json()
+        # first-write concurrency: the ETag must match the current version of the key, and an
+        # empty or missing ETag means the key must not exist yet
+        for item in items:
+            current = self.etags.get(store, {}).get(item['key'])
+            if item.get('etag'):
+                conflict = str(current) != item['etag']
+            else:
+                conflict = item.get('options', {}).get('concurrency') == 'first-write' and current is not None
+            if conflict:
+                return web.json_response({'errorCode': 'ERR_STATE_SAVE', 'message': 'possible etag mismatch'}, status=409)
+        for item in items:
+            self._set_state(store, item['key'], json.dumps(item['value']).encode('utf-8'))
+        return web.Response(status=204)
+
+    def _set_state(self, store: str, key: str, value: bytes):
+        self.state.setdefault(store, {})[key] = value
+        etags = self.etags.setdefault(store, {})
+        etags[key] = etags.get(key, 0) + 1
+
+    async def publish(self, request: web.Request) -> web.Response:
+        self._enqueue(request.match_info['pubsub'], request.match_info['topic'], await request.json())
+        return web.Response(status=204)
+
+    async def bulk_publish(self, request: web.Request) -> web.Response:
+        for entry in await request.json():
+            self._enqueue(request.match_info['pubsub'], request.match_info['topic'], entry['event'])
+        return web.Response(status=204)
+
+    async def invoke(self, request: web.Request) -> web.Response:
+        app_id = request.headers.get('dapr-app-id')
+        if app_id not in self.app_ports:
+            return web.Response(status=404, text=f"Unknown app id: {app_id}")
+        url = f"http://127.0.0.1:{self.app_ports[app_id]}/{request.match_info['path']}"
+        async with self.session.request(request.method, url, data=await request.read(), headers={'content-type': request.headers.get('content-type', 'application/json')}) as response:
+            return web.Response(status=response.status, body=await response.read(), content_type=response.content_type)
+
+    # gRPC API
+
+    def grpc_servicer(self) -> dapr_pb2_grpc.DaprServicer:
+        sidecar = self
+
+        class Servicer(dapr_pb2_grpc.DaprServicer):
+            async def PublishEvent(self, request, context):
+                sidecar._enqueue(request.pubsub_name, request.topic, json.loads(request.data))
+                return empty_pb2.Empty()
+
+            async def SaveState(self, request, context):
+                for item in request.states:
+                    sidecar._set_state(request.store_name, item.key, item.value)
+                return empty_pb2.Empty()
+
+            async def GetState(self, request, context):
+                value = sidecar.state.get(request.store_name, {}).get(request.key, b'')
+                return dapr_pb2.GetStateResponse(data=value)
+
+        return Servicer()
+
+    # pub/sub
+
+    def _enqueue(self, pubsub_name: str, topic: str, data: Any):
+        if isinstance(data, str):
+            data = json.loads(data)
+        event = {
+            'id': str(uuid.uuid4()),
+            'source': 'bench',
+            'type': 'com.dapr.event.sent',
+            'specversion': '1.0',
+            'datacontenttype': 'application/json',
+            'data': data,
+            'topic': topic,
+            'pubsubname': pubsub_name,
+            'traceid': f"00-{uuid.uuid4().hex}-{uuid.uuid4().hex[:16]}-01",
+            'tracestate': '',
+        }
+        self.on_published(event)
+        if topic in self.queues:
+            self.queues[topic].put_nowait((event, 1))
+
+    async def _deliver(self, topic: str):
+        queue = self.queues[topic]
+        subscription = self.subscriptions[topic]
+        bulk = subscription.get('bulkSubscribe', {})
+        url = f"http://127.0.0.1:{self.app_ports[self.subscriber_app_id]}{subscription['route']}"
+
+        while True:
+            batch = [await queue.get()]
+            if bulk.get('enabled'):
+                deadline = time.monotonic() + bulk.get('maxAwaitDurationMs', 1000) / 1000
+                while len(batch) < bulk.get('maxMessagesCount', 100):
+                    try:
+                        batch.append(await asyncio.wait_for(queue.get(), max(0, deadline - time.monotonic())))
+                    except asyncio.TimeoutError:
+                        break
+
+            try:
+                if bulk.get('enabled'):
+                    entries = [{'entryId': event['id'], 'event': event, 'contentType': 'application/cloudevents+json'} for event, _ in batch]
+                    async with self.session.post(url, json={'entries': entries, 'id': str(uuid.uuid4()), 'topic': topic}) as response:
+                        statuses = {status['entryId']: status['status'] for status in (await response.json()).get('statuses', [])} if response.status == 200 else {}
+                    results = [statuses.get(event['id'], 'RETRY') for event, _ in batch]
+                else:
+                    event, _ = batch[0]
+                    async with self.session.post(url, json=event) as response:
+                        results = ['SUCCESS' if response.status == 200 else 'RETRY']
+            except Exception as e:
+                logging.error(f"Delivery to {url} failed: {str(e)}")
+                results = ['RETRY'] * len(batch)
+
+            for (event, attempt), result in zip(batch, results):
+                if result == 'RETRY' and attempt < self.max_attempts:
+                    queue.put_nowait((event, attempt + 1))
+                else:
+                    self.on_delivered(event, result == 'SUCCESS')
@@ -0,0 +1,304 @@
+"""
+End-to-end benchmark for the upload and process services.
+
+Starts local fakes for Blob Storage, Tika, the LLM providers and the Dapr sidecar (see fakes.py),
+launches both apps against them, drives concurrent uploads and reports throughput and
+per-stage latency percentiles from the STAGE_TIMINGS_FILE records of both apps.
+
+    python bench/run.py --documents 200 --concurrency 16 --file upload/invoice.pdf
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List, Tuple
+import aiohttp
+from aiohttp import web
+import grpc
+from dapr.proto.runtime.v1 import dapr_pb2_grpc
+from fakes import FakeBlobStorage, FakeDaprSidecar, FakeLLM, FakeTika, Latency
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# the well-known Azurite development account
+ACCOUNT_NAME = 'devstoreaccount1'
+ACCOUNT_KEY = 'Eby8vdM02xNOcqFlqUwJPLlmEtlCDXJ1OUzFT50uSRZ6IFsuFq2UVErCz4I6tq/K1SZFPTOtr/KBHBeksoGMGw=='
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--documents', type=int, default=100, help='number of documents to upload')
+    parser.add_argument('--concurrency', type=int, default=8, help='concurrent upload requests')
+    parser.add_argument('--file', action='append', default=[], help='document to upload as path[:weight], can be repeated')
+    parser.add_argument('--batch-size', type=int, default=1, help='documents per request, more than 1 uses /upload/batch')
+    parser.add_argument('--template', default='{"customer_name": "str", "invoice_total": "float", "invoice_date": "date"}', help='template fields as JSON')
+    parser.add_argument('--extractor', default='openai', choices=['openai', 'groq', 'ollama'])
+    parser.add_argument('--llm-latency-ms', type=float, default=500)
+    parser.add_argument('--llm-jitter-ms', type=float, default=100)
+    parser.add_argument('--tika-latency-ms', type=float, default=50)
+    parser.add_argument('--blob-latency-ms', type=float, default=5)
+    parser.add_argument('--delivery-concurrency', type=int, default=32, help='pub/sub deliveries in flight, like Dapr app-max-concurrency')
+    parser.add_argument('--bulk-subscribe', action='store_true', help='enable bulk subscriptions in the process service')
+    parser.add_argument('--timeout', type=float, default=600, help='seconds to wait for all documents to be processed')
+    parser.add_argument('--output', help='write the report as JSON to this file')
+    parser.add_argument('--env', action='append', default=[], help='extra KEY=VALUE for both apps, can be repeated')
+    parser.add_argument('--no-launch', action='store_true', help='only start the fakes and print the environment for the apps')
+    parser.add_argument('--upload-port', type=int, default=8000)
+    parser.add_argument('--process-port', type=int, default=8001)
+    parser.add_argument('--fakes-port', type=int, default=10000)
+    parser.add_argument('--dapr-http-port', type=int, default=3500)
+    parser.add_argument('--dapr-grpc-port', type=int, default=50001)
+    return parser.parse_args()
+
+def parse_files(specs: List[str]) -> List[Tuple[str, bytes, float]]:
+    files = []
+    for spec in specs or [os.path.join(ROOT, 'upload', 'invoice.pdf')]:
+        path, _, weight = spec.partition(':')
+        with open(path, 'rb') as f:
+            files.append((os.path.basename(path), f.read(), float(weight or 1)))
+    return files
+
+def app_environment(args: argparse.Namespace) -> Dict[str, str]:
+    fakes = f"http://127.0.0.1:{args.fakes_port}"
+    env = {
+        'STORAGE_ACCOUNT_NAME': ACCOUNT_NAME,
+        'STORAGE_ACCOUNT_KEY': ACCOUNT_KEY,
+        'BLOB_ACCOUNT_URL': f"{fakes}/{ACCOUNT_NAME}",
+        'CONTAINER_NAME': 'files',
+        'PUBSUB_NAME': 'pubsub',
+        'KVSTORE_NAME': 'kvstore',
+        'DAPR_HTTP_PORT': str(args.dapr_http_port),
+        'DAPR_GRPC_PORT': str(args.dapr_grpc_port),
+        'DAPR_RUNTIME_HOST': '127.0.0.1',
+        'TIKA_SERVER_ENDPOINT': fakes,
+        'TIKA_CLIENT_ONLY': 'true',
+        'CRACKER_TYPE': 'tika',
+        'INVOICE_EXTRACTOR_TYPE': args.extractor,
+        'AZURE_OPENAI_ENDPOINT': fakes,
+        'AZURE_OPENAI_KEY': 'bench',
+        'AZURE_OPENAI_MODEL': 'bench',
+        'AZURE_OPENAI_API_VERSION': '2024-08-01-preview',
+        'GROQ_API_KEY': 'bench',
+        'GROQ_BASE_URL': fakes,
+        'OLLAMA_HOST': fakes,
+        'INVOICE_OUTPUT_HANDLER': 'json',
+        'RESULT_CACHE_TYPE': 'none',
+        'BULK_SUBSCRIBE_ENABLED': 'true' if args.bulk_subscribe else 'false',
+    }
+    for item in args.env:
+        key, _, value = item.partition('=')
+        env[key] = value
+    return env
+
+async def start_fakes(args: argparse.Namespace, sidecar: FakeDaprSidecar, llm: FakeLLM) -> List:
+    fakes_app = web.Application(client_max_size=1024 ** 3)
+    fakes_app.add_routes(llm.routes())
+    fakes_app.add_routes(FakeTika(Latency(args.tika_latency_ms, args.tika_latency_ms / 2)).routes())
+    fakes_app.add_routes(FakeBlobStorage(Latency(args.blob_latency_ms)).routes())
+
+    sidecar_app = web.Application(client_max_size=1024 ** 3)
+    sidecar_app.add_routes(sidecar.routes())
+    await sidecar.start()
+
+    runners = []
+    for application, port in [(fakes_app, args.fakes_port), (sidecar_app, args.dapr_http_port)]:
+        runner = web.AppRunner(application, access_log=None)
+        await runner.setup()
+        await web.TCPSite(runner, '127.0.0.1', port).start()
+        runners.append(runner)
+
+    grpc_server = grpc.aio.server()
+    dapr_pb2_grpc.add_DaprServicer_to_server(sidecar.grpc_servicer(), grpc_server)
+    grpc_server.add_insecure_port(f"127.0.0.1:{args.dapr_grpc_port}")
+    await grpc_server.start()
+    return runners + [grpc_server]
+
+def launch_app(name: str, port: int, env: Dict[str, str], log_dir: str) -> subprocess.Popen:
+    # the apps run in the work directory so that file outputs do not end up in the repository,
+    # the process app serves its static files from a relative path
+    app_dir = os.path.join(ROOT, name)
+    if os.path.isdir(os.path.join(app_dir, 'static')) and not os.path.exists(os.path.join(log_dir, 'static')):
+        os.symlink(os.path.join(app_dir, 'static'), os.path.join(log_dir, 'static'))
+    log = open(os.path.join(log_dir, f"{name}.log"), 'w')
+    return subprocess.Popen(
+        [sys.executable, '-m', 'uvicorn', 'app:app', '--app-dir', app_dir, '--host', '127.0.0.1', '--port', str(port), '--log-level', 'warning'],
+        cwd=log_dir, env={**os.environ, **env, 'APP_PORT': str(port), 'STAGE_TIMINGS_FILE': os.path.join(log_dir, f"{name}_timings.jsonl"),
+                          # the modules shared by both services (common/)
+                          'PYTHONPATH': os.pathsep.join(filter(None, [ROOT, os.environ.get('PYTHONPATH')]))},
+        stdout=log, stderr=subprocess.STDOUT
+    )
+
+async def wait_until_ready(session: aiohttp.ClientSession, url: str, timeout: float = 60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            async with session.get(url) as response:
+                if response.status < 500:
+                    return
+        except aiohttp.ClientError:
+            pass
+        await asyncio.sleep(0.25)
+    raise TimeoutError(f"{url} did not become ready in {timeout} seconds")
+
+async def drive_uploads(args: argparse.Namespace, session: aiohttp.ClientSession, files: List[Tuple[str, bytes, float]], template_name: str) -> Dict[str, int]:
+    semaphore = asyncio.Semaphore(args.concurrency)
+    results = {'requests': 0, 'failed_requests': 0}
+    weights = [weight for _, _, weight in files]
+
+    async def upload(request_index: int, count: int):
+        form = aiohttp.FormData()
+        for i in range(count):
+            name, content, _ = random.choices(files, weights)[0]
+            form.add_field('files' if args.batch_size > 1 else 'file', content, filename=f"{request_index}-{i}-{name}", content_type='application/pdf')
+        form.add_field('template_name', template_name)
+        url = f"http://127.0.0.1:{args.upload_port}/upload/{'batch' if args.batch_size > 1 else ''}"
+
+        async with semaphore:
+            async with session.post(url, data=form) as response:
+                results['requests'] += 1
+                if response.status not in (200, 207):
+                    results['failed_requests'] += 1
+                    logging.error(f"Upload failed with {response.status}: {await response.text()}")
+
+    counts = [min(args.batch_size, args.documents - start) for start in range(0, args.documents, args.batch_size)]
+    await asyncio.gather(*(upload(i, count) for i, count in enumerate(counts)))
+    return results
+
+def percentile(values: List[float], p: float) -> float:
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(p / 100 * len(ordered))) - 1))
+    return ordered[index]
+
+def report(work_dir: str, elapsed: float, documents: Dict[str, int]) -> Dict:
+    # one record per request in upload_timings.jsonl and per document in process_timings.jsonl
+    stages: Dict[str, List[float]] = {}
+    records = 0
+    failures = 0
+    for name in ['upload', 'process']:
+        timings_file = os.path.join(work_dir, f"{name}_timings.jsonl")
+        if not os.path.exists(timings_file):
+            continue
+        with open(timings_file) as f:
+            for line in f:
+                record = json.loads(line)
+                records += 1
+                failures += 0 if record['success'] else 1
+                for stage, seconds in record['stages'].items():
+                    stages.setdefault(f"{name}.{stage}", []).append(seconds * 1000)
+
+    return {
+        **documents,
+        'elapsed_seconds': round(elapsed, 3),
+        'documents_per_second': round(documents['processed'] / elapsed, 2) if elapsed else 0,
+        'timing_records': records,
+        'failed_records': failures,
+        'stages_ms': {
+            stage: {'count': len(values), 'p50': round(percentile(values, 50), 1), 'p95': round(percentile(values, 95), 1), 'p99': round(percentile(values, 99), 1)}
+            for stage, values in sorted(stages.items())
+        },
+    }
+
+def print_report(result: Dict):
+    print(f"documents: {result['processed']}/{result['published']} processed, {result['failed']} failed, "
+          f"{result['documents_per_second']} docs/s in {result['elapsed_seconds']}s")
+    print(f"{'stage':<28}{'count':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for stage, values in result['stages_ms'].items():
+        print(f"{stage:<28}{values['count']:>8}{values['p50']:>10}{values['p95']:>10}{values['p99']:>10}")
+
+async def main():
+    args = parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+    files = parse_files(args.file)
+    work_dir = tempfile.mkdtemp(prefix='docproc-bench-')
+    env = app_environment(args)
+
+    documents = {'published': 0, 'processed': 0, 'failed': 0}
+    expected = {'documents': args.documents}
+    done = asyncio.Event()
+
+    def on_published(event):
+        if event['topic'] == 'invoices':
+            documents['published'] += 1
+
+    def on_delivered(event, ok):
+        if event['topic'] != 'invoices':
+            return
+        documents['processed' if ok else 'failed'] += 1
+        if documents['processed'] + documents['failed'] >= expected['documents']:
+            done.set()
+
+    sidecar = FakeDaprSidecar(
+        app_ports={'upload': args.upload_port, 'process': args.process_port}, subscriber_app_id='process',
+        delivery_concurrency=1 if args.bulk_subscribe else args.delivery_concurrency,
+        on_published=on_published, on_delivered=on_delivered
+    )
+    llm = FakeLLM(Latency(args.llm_latency_ms, args.llm_jitter_ms))
+    servers = await start_fakes(args, sidecar, llm)
+
+    if args.no_launch:
+        print('\n'.join(f"export {key}='{value}'" for key, value in env.items()))
+        print(f"Fakes are running, start the apps with the environment above and STAGE_TIMINGS_FILE set "
+              f"to {work_dir}/<app>_timings.jsonl, press Ctrl+C to stop.")
+        await asyncio.Event().wait()
+
+    processes = [launch_app('upload', args.upload_port, env, work_dir), launch_app('process', args.process_port, env, work_dir)]
+    session = aiohttp.ClientSession()
+    try:
+        await wait_until_ready(session, f"http://127.0.0.1:{args.upload_port}/")
+        await wait_until_ready(session, f"http://127.0.0.1:{args.process_port}/dapr/subscribe")
+        await sidecar.load_subscriptions()
+
+        template_name = 'bench'
+        async with session.post(f"http://127.0.0.1:{args.upload_port}/template/", json={**json.loads(args.template), 'template_name': template_name}) as response:
+            response.raise_for_status()
+
+        start = time.perf_counter()
+        uploads = await drive_uploads(args, session, files, template_name)
+        # documents that failed to upload or publish are never delivered
+        expected['documents'] = documents['published']
+        if documents['processed'] + documents['failed'] >= expected['documents']:
+            done.set()
+        try:
+            await asyncio.wait_for(done.wait(), args.timeout)
+        except asyncio.TimeoutError:
+            logging.error(f"Timed out after {args.timeout} seconds waiting for documents to be processed")
+        elapsed = time.perf_counter() - start
+
+        # keep the Prometheus metrics of both apps next to the stage timings
+        for name, port in [('upload', args.upload_port), ('process', args.process_port)]:
+            async with session.get(f"http://127.0.0.1:{port}/metrics") as response:
+                with open(os.path.join(work_dir, f"{name}_metrics.prom"), 'w') as f:
+                    f.write(await response.text())
+
+        result = report(work_dir, elapsed, documents)
+        result.update(uploads)
+        result['llm_requests'] = llm.requests
+        print_report(result)
+        if args.output:
+            with open(args.output, 'w') as f:
+                json.dump(result, f, indent=2)
+        print(f"App logs and stage timings: {work_dir}")
+    finally:
+        await session.close()
+        for process in processes:
+            process.send_signal(signal.SIGINT)
+        for process in processes:
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        await sidecar.stop()
+        for server in servers:
+            if isinstance(server, web.AppRunner):
+                await server.cleanup()
+            else:
+                await server.stop(None)
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,167 @@
+import asyncio
+import random
+import time
+import zlib
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import aiohttp
+
+# job records of the documents in the pipeline, kept in a Dapr state store
+# the upload service creates a record when it queues a document and serves GET /jobs; the process
+# service updates it at every stage. Both use this store and its keys:
+#  job-<blob name>: the record of a document
+#  jobs-<status>-<shard>: the index of the jobs in a status, {job id: time the job got the status},
+#                         split over shards so concurrent updates seldom touch the same key
+
+JOB_STATUSES = ("queued", "publish_failed", "processing", "succeeded", "failed")
+
+# attempts to update an index shard that other requests or workers update at the same time
+INDEX_MAX_ATTEMPTS = 10
+
+def job_key(job_id: str) -> str:
+    return f"job-{job_id}"
+
+def index_key(status: str, shard: int) -> str:
+    return f"jobs-{status}-{shard}"
+
+class JobStore:
+    """
+    Reads and writes job records and their status index through the Dapr state API.
+
+    Index shards are updated with first-write concurrency: a shard is read with its ETag and
+    written back only when nobody changed it in between, and a shard that does not exist yet is
+    only created when nobody created it in between (an empty ETag); otherwise the update is
+    retried. Entries older than ttl_seconds are dropped, and a shard keeps at most its share of
+    max_index_entries (the newest), so the index of finished jobs does not grow without limit.
+
+    Listing the jobs in a status reads the index shards of that status in one bulk request and
+    the records of the page in another, instead of scanning the store.
+
+    Every service passes its own HTTP session, Dapr URL and headers (with its API token and
+    trace context).
+    """
+    def __init__(self, get_session: Callable[[], aiohttp.ClientSession], url: Callable[[str], str],
+                 headers: Callable[[], Dict[str, str]], store_name: str, ttl_seconds: int, index_shards: int,
+                 max_index_entries: int):
+        self.get_session = get_session
+        self.url = url
+        self.headers = headers
+        self.store_name = store_name
+        self.ttl_seconds = ttl_seconds
+        self.index_shards = index_shards
+        self.max_shard_entries = max(max_index_entries // index_shards, 1)
+
+    async def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        record, _ = await self._get(job_key(job_id))
+        return record
+
+    async def save(self, record: Dict[str, Any]):
+        await self._save([self._record_item(record)])
+
+    async def create(self, records: List[Dict[str, Any]]):
+        """
+        Saves new job records and adds them to the index of their status, one update per shard.
+        """
+        if not records:
+            return
+        await self._save([self._record_item(record) for record in records])
+
+        shards: Dict[Tuple[str, int], Dict[str, float]] = {}
+        for record in records:
+            shards.setdefault((record["status"], self._shard(record["id"])), {})[record["id"]] = record["updated_at"]
+        await asyncio.gather(*[self._update_index(index_key(status, shard), add=entries) for (status, shard), entries in shards.items()])
+
+    async def set_status(self, record: Dict[str, Any], status: str, error: Optional[str] = None):
+        previous_status = record["status"]
+        record.update({"status": status, "error": error, "updated_at": time.time()})
+        await self.save(record)
+        await self.move(record["id"], previous_status, status, record["updated_at"])
+
+    async def move(self, job_id: str, from_status: Optional[str], to_status: str, at: float):
+        """
+        Moves a job from the index of from_status to the one of to_status.
+        """
+        shard = self._shard(job_id)
+        if from_status and from_status != to_status:
+            await self._update_index(index_key(from_status, shard), remove=[job_id])
+        await self._update_index(index_key(to_status, shard), add={job_id: at})
+
+    async def list(self, status: str, limit: int, cursor: Optional[str] = None) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """
+        Returns the jobs in a status, the longest in that status first, and the cursor of the next
+        page (None on the last page). The cursor is the position of the last job of the page, so
+        jobs that leave the status between pages do not shift the next page.
+        """
+        shards = await self._get_bulk([index_key(status, shard) for shard in range(self.index_shards)])
+        entries = sorted((at, job_id) for index in shards.values() for job_id, at in index.items())
+        if cursor:
+            at, _, job_id = cursor.partition("|")
+            entries = [entry for entry in entries if entry > (float(at), job_id)]
+
+        page = entries[:limit]
+        records = await self._get_bulk([job_key(job_id) for _, job_id in page])
+        # the index is updated after the record, so a job that just changed status can still be listed
+        jobs = [records[job_key(job_id)] for _, job_id in page if records.get(job_key(job_id), {}).get("status") == status]
+        next_cursor = f"{page[-1][0]!r}|{page[-1][1]}" if len(entries) > limit else None
+        return jobs, next_cursor
+
+    def _shard(self, job_id: str) -> int:
+        return zlib.crc32(job_id.encode("utf-8")) % self.index_shards
+
+    def _record_item(self, record: Dict[str, Any]) -> Dict[str, Any]:
+        item = {"key": job_key(record["id"]), "value": record}
+        if self.ttl_seconds > 0:
+            item["metadata"] = {"ttlInSeconds": str(self.ttl_seconds)}
+        return item
+
+    async def _update_index(self, key: str, add: Dict[str, float] = None, remove: List[str] = None):
+        for attempt in range(INDEX_MAX_ATTEMPTS):
+            entries, etag = await self._get(key)
+            entries = entries or {}
+            for job_id in remove or []:
+                entries.pop(job_id, None)
+            entries.update(add or {})
+
+            oldest = time.time() - self.ttl_seconds if self.ttl_seconds > 0 else 0
+            newest = sorted(((at, job_id) for job_id, at in entries.items() if at >= oldest), reverse=True)
+            # an empty ETag with first-write only creates the shard when it still does not exist,
+            # so writers that both found it missing do not overwrite each other
+            item = {
+                "key": key,
+                "value": {job_id: at for at, job_id in newest[:self.max_shard_entries]},
+                "etag": etag or "",
+                "options": {"concurrency": "first-write"}
+            }
+            if await self._save([item], conflict_ok=True):
+                return
+            # another writer changed the shard; try again after a short, random wait
+            await asyncio.sleep(random.uniform(0, 0.01 * 2 ** attempt))
+        raise RuntimeError(f"Failed to update job index {key} after {INDEX_MAX_ATTEMPTS} attempts")
+
+    async def _get(self, key: str) -> Tuple[Optional[Any], Optional[str]]:
+        async with self.get_session().get(self.url(f"/v1.0/state/{self.store_name}/{key}"), headers=self.headers(),
+                                          timeout=aiohttp.ClientTimeout(total=10)) as result:
+            if result.status == 200:
+                return await result.json(content_type=None), result.headers.get("ETag")
+            if result.status != 204:
+                raise IOError(f"Dapr state store returned status {result.status} for key {key}")
+            return None, None
+
+    async def _get_bulk(self, keys: List[str]) -> Dict[str, Any]:
+        if not keys:
+            return {}
+        async with self.get_session().post(self.url(f"/v1.0/state/{self.store_name}/bulk"), headers=self.headers(),
+                                           json={"keys": keys, "parallelism": 10}, timeout=aiohttp.ClientTimeout(total=10)) as result:
+            if not result.ok:
+                raise IOError(f"Dapr state store returned status {result.status} for a bulk get of {len(keys)} keys")
+            items = await result.json(content_type=None)
+        return {item["key"]: item["data"] for item in items if item.get("data") is not None}
+
+    async def _save(self, items: List[Dict[str, Any]], conflict_ok: bool = False) -> bool:
+        async with self.get_session().post(self.url(f"/v1.0/state/{self.store_name}"), headers=self.headers(),
+                                           json=items, timeout=aiohttp.ClientTimeout(total=10)) as result:
+            if result.ok:
+                return True
+            # an ETag mismatch
+            if conflict_ok and result.status == 409:
+                return False
+            raise IOError(f"Dapr state store returned status {result.status} while saving {items[0]['key']}")
@@ -0,0 +1,112 @@
+import atexit
+import contextvars
+import json
+import logging
+import queue
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional
+
+class StageTimer:
+    """
+    Per-document stage timings and trace context, shared by the upload and process services.
+
+    stage() adds the duration of a block to the document that is being handled in the current
+    task and to the stage_seconds histogram; document() counts the outcome in outcomes and, when
+    timings_file is set, hands the timings to a writer thread that appends every waiting record
+    with one write, so the event loop never waits for the file. on_stage is called when a stage
+    of the document starts and finishes.
+    """
+    def __init__(self, stage_seconds, outcomes, timings_file: str = '', trace_propagation_enabled: bool = False):
+        self.stage_seconds = stage_seconds
+        self.outcomes = outcomes
+        self.timings_file = timings_file
+        self.trace_propagation_enabled = trace_propagation_enabled
+        self._current_timings: contextvars.ContextVar[Optional[Dict[str, float]]] = contextvars.ContextVar("timings", default=None)
+        self._current_traceparent: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("traceparent", default=None)
+        self._current_on_stage: contextvars.ContextVar[Optional[Callable[[str, bool], None]]] = contextvars.ContextVar("on_stage", default=None)
+        self._queue: queue.SimpleQueue = queue.SimpleQueue()
+        self._thread: Optional[threading.Thread] = None
+        if timings_file:
+            self._thread = threading.Thread(target=self._run, name="stage-timings", daemon=True)
+            self._thread.start()
+            # records that are still waiting are written when the worker exits
+            atexit.register(self.close)
+
+    @contextmanager
+    def document(self, document_id: str, traceparent: str = None, on_stage: Callable[[str, bool], None] = None):
+        timings: Dict[str, float] = {}
+        token = self._current_timings.set(timings)
+        trace_token = self._current_traceparent.set(traceparent)
+        on_stage_token = self._current_on_stage.set(on_stage)
+        start = time.perf_counter()
+        success = False
+        try:
+            yield timings
+            success = True
+        finally:
+            timings["total"] = time.perf_counter() - start
+            self._current_timings.reset(token)
+            self._current_traceparent.reset(trace_token)
+            self._current_on_stage.reset(on_stage_token)
+            self.stage_seconds.labels("total").observe(timings["total"])
+            self.outcomes.labels("success" if success else "failure").inc()
+            if self._thread is not None:
+                self._queue.put(json.dumps({"id": document_id, "time": time.time(), "success": success, "stages": timings}) + "\n")
+
+    @contextmanager
+    def stage(self, name: str):
+        on_stage = self._current_on_stage.get()
+        if on_stage is not None:
+            on_stage(name, False)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            if on_stage is not None:
+                on_stage(name, True)
+            self.stage_seconds.labels(name).observe(elapsed)
+            timings = self._current_timings.get()
+            if timings is not None:
+                timings[name] = timings.get(name, 0.0) + elapsed
+
+    def trace_headers(self) -> Dict[str, str]:
+        """
+        Returns the traceparent header of the document in the current task, so calls through the
+        Dapr sidecar join the trace of the caller (TRACE_PROPAGATION_ENABLED).
+        """
+        traceparent = self._current_traceparent.get()
+        if not self.trace_propagation_enabled or not traceparent:
+            return {}
+        return {"traceparent": traceparent}
+
+    def close(self):
+        """
+        Writes the records that are still waiting and stops the writer thread.
+        """
+        if self._thread is not None and self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            lines: List[str] = [self._queue.get()]
+            # group commit: everything that arrived while the previous write was in progress
+            while True:
+                try:
+                    lines.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            if None in lines:
+                stopping = True
+                lines = [line for line in lines if line is not None]
+            if not lines:
+                continue
+            try:
+                with open(self.timings_file, "a") as f:
+                    f.write("".join(lines))
+            except Exception as e:
+                logging.error(f"An error occurred while writing stage timings: {str(e)}")
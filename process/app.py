@@ -1,21 +1,90 @@
+import asyncio
+import functools
+import hashlib
+import json
 import logging
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.responses import JSONResponse, FileResponse
 from fastapi.staticfiles import StaticFiles
 from pydantic import BaseModel
-from typing import Any, Dict
-from azure.storage.blob import BlobServiceClient
-import requests
+from typing import Any, Callable, Dict, List, Optional
+import aiohttp
+import clients
+import metrics
+import timing
 from output_handlers.handler_factory import OutputHandlerFactory
+from output_handlers.base_handler import OutputItem
+from output_handlers.dispatcher import OutputDispatcher
 from extractors.extractor_factory import ExtractorFactory
 from extractors.openai_extractor import OpenAIExtractor
+from extractors.template_compiler import compile_template
 from config import settings  # gets settings from environment variables
 from crackers.cracker_factory import CrackerFactory
-
-app = FastAPI()
+from preprocessors.pipeline import preprocess
+from template_cache import TemplateCache
+from extraction_batcher import ExtractionBatcher
+from common.jobs import JobStore
+from jobs import JobTracker
+from result_caches.cache_factory import ResultCacheFactory
+from result_caches.base_cache import make_cache_key, template_version
+from result_caches.near_duplicate_cache import NearDuplicateCache
 
 logging.basicConfig(level=logging.INFO)
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # create long-lived clients once, before the first document arrives
+    await clients.startup()
+    CrackerFactory.get_cracker(settings.cracker_type)
+    ExtractorFactory.get_extractor(settings.extractor_type)
+    output_dispatcher.start(settings.output_handler_types, OutputHandlerFactory.get_handlers(settings.output_handler_types))
+    yield
+    await output_dispatcher.stop(settings.graceful_shutdown_seconds)
+    await clients.shutdown()
+    executor.shutdown(wait=True)
+
+app = FastAPI(lifespan=lifespan)
+
+# crackers, extractors and output handlers use blocking SDKs; they run on this bounded
+# executor so the event loop stays free to accept and download other documents
+executor = ThreadPoolExecutor(max_workers=settings.executor_workers, thread_name_prefix="process")
+
+# limits the number of documents this worker processes at the same time
+document_semaphore = asyncio.Semaphore(settings.max_concurrent_documents)
+
+# templates retrieved from the KV store; invalidated by the template-changed event published by upload
+template_cache = TemplateCache(settings.template_cache_size, settings.template_cache_ttl_seconds)
+
+# cracked text and extracted details of documents seen before, keyed on the file hash
+result_cache = ResultCacheFactory.get_cache(settings.result_cache_type)
+
+# extractions in progress, keyed like the result cache; identical documents arriving together wait for them
+inflight_results: Dict[str, asyncio.Future] = {}
+
+# progress of every document, kept in the Dapr state store and served by the upload service at /jobs
+job_store = None
+if settings.job_tracking_enabled:
+    job_store = JobStore(clients.get_aiohttp_session, clients.dapr_url, clients.dapr_headers, settings.job_store_name,
+                         settings.job_ttl_seconds, settings.job_index_shards, settings.job_index_max_entries)
+
+# results of documents with nearly the same cracked text, like re-scans of the same invoice
+near_duplicate_cache = None
+if settings.near_duplicate_cache_size > 0:
+    near_duplicate_cache = NearDuplicateCache(
+        settings.near_duplicate_cache_size,
+        settings.near_duplicate_threshold,
+        permutations=settings.near_duplicate_permutations,
+        bands=settings.near_duplicate_bands,
+        shingle_words=settings.near_duplicate_shingle_words,
+        match_numbers=settings.near_duplicate_match_numbers
+    )
+
+async def run_blocking(func: Callable, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor, functools.partial(func, *args, **kwargs))
+
 # Mount the static directory
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
@@ -43,93 +112,273 @@ class CloudEvent(BaseModel):
     type: str
     traceid: str
 
-def extract_invoice_details(template_content: Dict[str, str], input_string: str, template_name: str):
+# bulk pub/sub delivers a batch of entries; every entry holds a CloudEvent
+class BulkSubscribeEntry(BaseModel):
+    entryId: str
+    event: Any
+    contentType: Optional[str] = None
+    metadata: Optional[Dict[str, str]] = None
+
+class BulkSubscribeMessage(BaseModel):
+    entries: List[BulkSubscribeEntry]
+    id: Optional[str] = None
+    pubsubname: Optional[str] = None
+    topic: Optional[str] = None
+    type: Optional[str] = None
+    metadata: Optional[Dict[str, str]] = None
+
+# output handlers run concurrently; network sinks are batched behind bounded queues
+output_dispatcher = OutputDispatcher(
+    run_blocking,
+    queue_size=settings.output_queue_size,
+    batch_size=settings.output_batch_size,
+    flush_ms=settings.output_flush_ms,
+    max_attempts=settings.output_max_attempts,
+    retry_backoff_seconds=settings.output_retry_backoff_seconds,
+    dead_letter_file=settings.output_dead_letter_file
+)
+
+# small documents that share a template are sent to the extractor together when batching is enabled
+extraction_batcher = None
+if settings.extraction_batch_size > 1:
+    extraction_batcher = ExtractionBatcher(run_blocking, settings.extraction_batch_size, settings.extraction_batch_window_ms)
+
+async def extract_invoice_details(template_content: Dict[str, str], input_string: str, template_name: str,
+                                  on_field: Callable[[str, Any], None] = None):
     extractor = ExtractorFactory.get_extractor(settings.extractor_type)
-    return extractor.extract(template_content, input_string, template_name)
+    # a batched request has no fields to stream per document, so streamed documents are not batched
+    if on_field is not None:
+        return await run_blocking(extractor.extract_stream, template_content, input_string, template_name, on_field)
+    if extraction_batcher is not None and len(input_string) <= settings.extraction_batch_max_chars:
+        return await extraction_batcher.extract(extractor, template_content, input_string, template_name)
+    return await run_blocking(extractor.extract, template_content, input_string, template_name)
 
-def retrieve_file_from_azure(storage_account_name: str, container_name: str, storage_account_key: str, blob_name: str) -> bytes:
+async def retrieve_file_from_azure(container_name: str, blob_name: str) -> bytes:
     try:
-        blob_service_client = BlobServiceClient(account_url=f"https://{storage_account_name}.blob.core.windows.net", credential=storage_account_key)
-        blob_client = blob_service_client.get_blob_client(container=container_name, blob=blob_name)
-        
-        download_stream = blob_client.download_blob()
-        file_content = download_stream.readall()
-        
+        blob_client = clients.get_blob_service_client().get_blob_client(container=container_name, blob=blob_name)
+
+        download_stream = await blob_client.download_blob()
+        file_content = await download_stream.readall()
+        metrics.BYTES.labels("download").inc(len(file_content))
+
         logging.info(f"File {blob_name} retrieved from Azure Blob Storage successfully.")
         return file_content
     except Exception as e:
         logging.error(f"An error occurred while retrieving from Azure Blob Storage: {str(e)}")
         return None
     
-def retrieve_template_from_kvstore(template_name: str):
-    headers = {'dapr-app-id': settings.invoke_target_appid, 'content-type': 'application/json'}
-    if settings.dapr_api_token:
-        headers['dapr-api-token'] = settings.dapr_api_token
-
+async def retrieve_template_from_kvstore(template_name: str):
     try:
-        result = requests.get(
-            url=f'{settings.dapr_http_endpoint}{":" + settings.dapr_http_port if not settings.dapr_api_token else ""}/template/{template_name}',
-            headers=headers,
-            timeout=60
-        )
-
-        if result.ok:
-            logging.info('Invocation successful with status code: %s' % result.status_code)
-            logging.info(f"Template retrieved: {result.json()}")
-            return result.json()
+        async with clients.get_aiohttp_session().get(
+            url=clients.dapr_url(f'/template/{template_name}'),
+            headers=clients.dapr_headers(settings.invoke_target_appid),
+            timeout=aiohttp.ClientTimeout(total=60)
+        ) as result:
+            if result.ok:
+                template = await result.json()
+                logging.info('Invocation successful with status code: %s' % result.status)
+                logging.debug(f"Template retrieved: {template}")
+                return template
 
     except Exception as e:
         logging.error(f"An error occurred while retrieving template from Dapr KV store: {str(e)}")
         return None
 
+async def get_template(template_name: str):
+    template_content = template_cache.get(template_name)
+    metrics.record_cache("template", template_content is not None)
+    if template_content is not None:
+        logging.info(f"Template retrieved from cache: {template_name}")
+        return template_content
+
+    template_content = await retrieve_template_from_kvstore(template_name)
+    if template_content is not None:
+        template_cache.put(template_name, template_content)
+    return template_content
+
+async def get_cached_result(key: str):
+    if result_cache is None:
+        return None
+    try:
+        return await result_cache.get(key)
+    except Exception as e:
+        logging.error(f"An error occurred while reading from the result cache: {str(e)}")
+        return None
+
+async def set_cached_result(key: str, lines_str: str, invoice_details: Any):
+    if result_cache is None:
+        return
+    if isinstance(invoice_details, BaseModel):
+        invoice_details = invoice_details.model_dump(mode='json')
+    try:
+        await result_cache.set(key, {'text': lines_str, 'invoice_details': invoice_details})
+    except Exception as e:
+        logging.error(f"An error occurred while writing to the result cache: {str(e)}")
+
+def as_template_model(invoice_details: Dict[str, Any], template_content: Optional[Dict[str, Any]], template_name: str):
+    try:
+        return compile_template(template_content, template_name).model.model_validate(invoice_details)
+    except Exception as e:
+        logging.warning(f"Invoice details do not match the model of template {template_name}, sending them as they are: {str(e)}")
+        return invoice_details
+
 @app.get("/")
 async def root_status():
     return JSONResponse(content={"status": "ok"}, status_code=200)
 
-@app.post('/process')  # called by pub/sub when a new invoice is uploaded
-async def consume_orders(event: CloudEvent):
-    blob_name = event.data['path']
-    template_name = event.data['template_name']
-    logging.info(f'Invoice received: {blob_name}, Template name: {template_name}')
+@app.get("/metrics")
+async def get_metrics():
+    return metrics.metrics_response()
 
+async def process_invoice(blob_name: str, template_name: str, traceparent: str = None):
+    """
+    Runs the pipeline for one invoice: download, crack, extract and output.
+    Raises an exception when the invoice could not be processed.
+    """
+    async with document_semaphore:
+        job = None
+        if job_store is not None:
+            job = JobTracker(job_store, blob_name)
+            await job.start(template_name)
+
+        try:
+            with timing.document(blob_name, traceparent, job.stage if job else None):
+                await run_pipeline(blob_name, template_name)
+        except Exception as e:
+            if job is not None:
+                await job.finish(str(e) or type(e).__name__)
+            raise
+        if job is not None:
+            await job.finish()
+
+async def run_pipeline(blob_name: str, template_name: str):
     # retrieve the file from the blob storage
-    file_content = retrieve_file_from_azure(settings.storage_account_name, settings.container_name, settings.storage_account_key, blob_name)
-    
+    with timing.stage("download"):
+        file_content = await retrieve_file_from_azure(settings.container_name, blob_name)
+
     if file_content is None:
         logging.error(f"Failed to retrieve file from Azure Blob Storage: {blob_name}")
         raise FileNotFoundError(f"Failed to retrieve file from Azure Blob Storage: {blob_name}")
-    
+
+    # retrieve the template from the kvstore
+    template_content = None
+    if template_name not in OpenAIExtractor.MODEL_REGISTRY:
+        logging.info(f"Using model from KV store: {template_name}")
+        with timing.stage("template"):
+            template_content = await get_template(template_name)
+        logging.debug(f"Template retrieved: {template_content}")
+        if template_content is None:
+            raise IOError(f"Failed to retrieve template from Dapr KV store: {template_name}")
+    else:
+        logging.info(f"Using static model: {template_name}")
+
+    with timing.stage("result_cache"):
+        file_hash = await run_blocking(lambda: hashlib.sha256(file_content).hexdigest())
+        cache_key = make_cache_key(file_hash, template_name, template_content, settings.cracker_type, settings.extractor_type)
+
+    # identical documents that arrive together wait for the one that is already being extracted
+    invoice_details = None
+    pending = inflight_results.get(cache_key) if result_cache is not None else None
+    if pending is not None:
+        logging.info(f"Waiting for the extraction of an identical document for {blob_name}: {cache_key}")
+        with timing.stage("result_cache"):
+            invoice_details = await asyncio.shield(pending)
+        metrics.record_cache("result", invoice_details is not None)
+
+    if invoice_details is None:
+        invoice_details = await get_invoice_details_once(blob_name, template_name, template_content, file_content, cache_key)
+
+    if not invoice_details:
+        raise ValueError("No invoice details extracted from the document.")
+    else:
+        # cached and near-duplicate results are plain dicts; handlers get the template model like a fresh result
+        if not isinstance(invoice_details, BaseModel):
+            invoice_details = await run_blocking(as_template_model, invoice_details, template_content, template_name)
+        logging.debug(f"Extracted invoice details: {invoice_details}")
+
+        # hand the details to all output handlers; failed deliveries are retried and dead-lettered
+        await output_dispatcher.dispatch(OutputItem(blob_name, template_name, invoice_details))
+
+async def get_invoice_details_once(blob_name: str, template_name: str, template_content: Optional[Dict[str, Any]],
+                                   file_content: bytes, cache_key: str):
+    if result_cache is None or cache_key in inflight_results:
+        return await get_invoice_details(blob_name, template_name, template_content, file_content, cache_key)
+
+    # documents waiting for this one get None when it fails, and then extract on their own
+    future = asyncio.get_running_loop().create_future()
+    inflight_results[cache_key] = future
+    invoice_details = None
     try:
-        # use the appropriate cracker to extract the text from the file
-        logging.info(f"Using cracker: {settings.cracker_type}")
-        cracker = CrackerFactory.get_cracker(settings.cracker_type)
-        lines_str = cracker.crack(file_content)
-
-        logging.info(f"{settings.cracker_type.capitalize()} processing completed successfully.")
-
-        # retrieve the template from the kvstore
-        template_content = None
-        if template_name not in OpenAIExtractor.MODEL_REGISTRY:
-            logging.info(f"Using model from KV store: {template_name}")
-            template_content = retrieve_template_from_kvstore(template_name)
-            logging.info(f"Template retrieved from KV store: {template_content}")
-            if template_content is None:
-                raise IOError(f"Failed to retrieve template from Dapr KV store: {template_name}")
-        else:
-            logging.info(f"Using static model: {template_name}")
-            
+        invoice_details = await get_invoice_details(blob_name, template_name, template_content, file_content, cache_key)
+        return invoice_details
+    finally:
+        del inflight_results[cache_key]
+        future.set_result(invoice_details or None)
+
+async def get_invoice_details(blob_name: str, template_name: str, template_content: Optional[Dict[str, Any]],
+                              file_content: bytes, cache_key: str):
+    # identical documents skip cracking and extraction
+    with timing.stage("result_cache"):
+        cached_result = await get_cached_result(cache_key)
+    if result_cache is not None:
+        metrics.record_cache("result", cached_result is not None)
+
+    if cached_result is not None:
+        logging.info(f"Result cache hit for {blob_name}: {cache_key}")
+        return cached_result['invoice_details']
+
+    # use the appropriate cracker to extract the text from the file
+    logging.info(f"Using cracker: {settings.cracker_type}")
+    cracker = CrackerFactory.get_cracker(settings.cracker_type)
+    with timing.stage("crack"):
+        lines_str = await run_blocking(cracker.crack, file_content)
+
+    logging.info(f"{settings.cracker_type.capitalize()} processing completed successfully.")
+
+    # re-scans and re-exports of a document seen before have other bytes, but nearly the same text
+    invoice_details = None
+    sketch = None
+    near_duplicate_scope = f"{template_name}-{template_version(template_content)}-{settings.extractor_type}"
+    if near_duplicate_cache is not None:
+        with timing.stage("near_duplicate_cache"):
+            sketch = await run_blocking(near_duplicate_cache.sketch, lines_str)
+            match = near_duplicate_cache.get(near_duplicate_scope, sketch)
+        metrics.record_cache("near_duplicate", match is not None)
+        if match is not None:
+            invoice_details, similarity = match
+            logging.info(f"Near-duplicate cache hit for {blob_name} with similarity {similarity:.2f}")
+
+    if invoice_details is None:
+        # drop what the extractor does not need, like blank lines and repeated page headers
+        with timing.stage("preprocess"):
+            input_string = await run_blocking(preprocess, lines_str, template_content, template_name, settings.extractor_type)
+
+        # with streaming, handlers like Pusher get the fields of the response as they arrive
+        partial_sender = None
+        if settings.streaming_extraction_enabled:
+            partial_sender = output_dispatcher.partial_sender(blob_name, template_name)
+
         # extract invoice details with specified extractor
-        invoice_details = extract_invoice_details(template_content, lines_str, template_name)
+        with timing.stage("extract"):
+            invoice_details = await extract_invoice_details(template_content, input_string, template_name, partial_sender)
+        if partial_sender is not None:
+            await partial_sender.drain()
+
+        if invoice_details and near_duplicate_cache is not None:
+            near_duplicate_cache.set(near_duplicate_scope, sketch, invoice_details)
 
-        if not invoice_details:
-            raise ValueError("No invoice details extracted from the document.")
-        else:
-            logging.info(f"Extracted invoice details: {invoice_details}")
+    if invoice_details:
+        await set_cached_result(cache_key, lines_str, invoice_details)
+    return invoice_details
+
+@app.post('/process')  # called by pub/sub when a new invoice is uploaded
+async def consume_orders(event: CloudEvent):
+    blob_name = event.data['path']
+    template_name = event.data['template_name']
+    logging.info(f'Invoice received: {blob_name}, Template name: {template_name}')
 
-            # Use the appropriate output handlers
-            output_handlers = OutputHandlerFactory.get_handlers(settings.output_handler_types)
-            for handler in output_handlers:
-                handler.handle_output(blob_name, invoice_details)
+    try:
+        await process_invoice(blob_name, template_name, event.traceid)
     except Exception as e:
         logging.error(f"An error occurred during document processing: {str(e)}")
         # Return a 500 Internal Server Error response
@@ -141,15 +390,65 @@ async def consume_orders(event: CloudEvent):
     # return 200 ok to indicate successful processing of message
     return {'success': True}
 
+@app.post('/process/bulk')  # called by pub/sub with a batch of invoices when bulk subscribe is enabled
+async def consume_orders_bulk(message: BulkSubscribeMessage):
+    logging.info(f'Bulk message received with {len(message.entries)} invoices')
+
+    async def process_entry(entry: BulkSubscribeEntry) -> Dict[str, str]:
+        # entries that can never be processed are dropped, failed ones are redelivered
+        try:
+            event = entry.event
+            data = event.get('data', event) if isinstance(event, dict) else json.loads(event)
+            if isinstance(data, str):
+                data = json.loads(data)
+            blob_name = data['path']
+            template_name = data['template_name']
+            traceparent = event.get('traceid') if isinstance(event, dict) else None
+        except Exception as e:
+            logging.error(f"Dropping malformed entry {entry.entryId}: {str(e)}")
+            return {'entryId': entry.entryId, 'status': 'DROP'}
+
+        logging.info(f'Invoice received: {blob_name}, Template name: {template_name}')
+        try:
+            await process_invoice(blob_name, template_name, traceparent)
+            return {'entryId': entry.entryId, 'status': 'SUCCESS'}
+        except Exception as e:
+            logging.error(f"An error occurred during document processing: {str(e)}")
+            return {'entryId': entry.entryId, 'status': 'RETRY'}
+
+    statuses = await asyncio.gather(*[process_entry(entry) for entry in message.entries])
+    return {'statuses': statuses}
+
+@app.post('/template-changed')  # called by pub/sub when a template is saved in the upload app
+async def template_changed(event: CloudEvent):
+    template_name = event.data.get('template_name')
+    template_cache.invalidate(template_name)
+    return {'success': True}
+
 # this is used when you use Dapr directly instead of catalyst
 @app.get("/dapr/subscribe")
 async def subscribe():
-    logging.info(f"Subscribing to topic 'invoices' with pubsub name '{settings.pubsub_name}' and route '/process'")
+    invoice_subscription = {
+        'pubsubname': settings.pubsub_name,
+        'topic': 'invoices',
+        'route': '/process'
+    }
+    if settings.bulk_subscribe_enabled:
+        invoice_subscription['route'] = '/process/bulk'
+        invoice_subscription['bulkSubscribe'] = {
+            'enabled': True,
+            'maxMessagesCount': settings.bulk_subscribe_max_messages,
+            'maxAwaitDurationMs': settings.bulk_subscribe_max_await_ms
+        }
+
+    logging.info(f"Subscribing to topic 'invoices' with pubsub name '{settings.pubsub_name}' and route '{invoice_subscription['route']}'")
+    logging.info(f"Subscribing to topic '{settings.template_topic_name}' with pubsub name '{settings.pubsub_name}' and route '/template-changed'")
     subscriptions = [
+        invoice_subscription,
         {
             'pubsubname': settings.pubsub_name,
-            'topic': 'invoices',
-            'route': '/process'
+            'topic': settings.template_topic_name,
+            'route': '/template-changed'
         }
     ]
     return JSONResponse(content=subscriptions)
@@ -160,9 +459,10 @@ async def read_index():
 
 @app.post("/extract")
 async def extract_invoice(template_content: Dict[str, str], input_string: str, model_name: str = None):
-    result = extract_invoice_details(template_content, input_string)
+    result = await extract_invoice_details(template_content, input_string, model_name)
     return result
 
 if __name__ == "__main__":
+    # python app.py still works; server.py is the launcher with worker processes
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8001)
\ No newline at end of file
+    uvicorn.run(app, host=settings.host, port=settings.port, timeout_graceful_shutdown=settings.graceful_shutdown_seconds)
\ No newline at end of file
@@ -0,0 +1,170 @@
+import asyncio
+import hashlib
+import logging
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable, Dict
+import aiohttp
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+from azure.core.credentials import AzureKeyCredential
+from azure.core.pipeline.transport import AioHttpTransport, RequestsTransport
+from config import settings
+import timing
+
+# process-wide registry of long-lived clients
+# every SDK client is created once and reused by all documents; the shared HTTP sessions
+# below keep connections alive so a document does not pay for TCP+TLS setup
+
+_clients: Dict[str, Any] = {}
+_lock = threading.RLock()
+
+def get_client(name: str, factory: Callable[[], Any]) -> Any:
+    """
+    Returns the client registered under name, creating it with factory on first use.
+    """
+    client = _clients.get(name)
+    if client is None:
+        with _lock:
+            client = _clients.get(name)
+            if client is None:
+                client = factory()
+                _clients[name] = client
+                logging.info(f"Client created: {name}")
+    return client
+
+def get_requests_session() -> requests.Session:
+    def create():
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=settings.http_pool_connections, pool_maxsize=settings.http_pool_maxsize)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        return session
+    return get_client("requests_session", create)
+
+def get_httpx_client() -> httpx.Client:
+    return get_client("httpx_client", lambda: httpx.Client(limits=_httpx_limits()))
+
+def get_aiohttp_session() -> aiohttp.ClientSession:
+    # must be called from the event loop; startup() creates it before the first request
+    def create():
+        connector = aiohttp.TCPConnector(limit=settings.http_pool_maxsize, keepalive_timeout=settings.http_keepalive_seconds)
+        return aiohttp.ClientSession(connector=connector)
+    return get_client("aiohttp_session", create)
+
+def get_blob_service_client():
+    from azure.storage.blob.aio import BlobServiceClient
+    return get_client("blob_service", lambda: BlobServiceClient(
+        account_url=settings.blob_account_url,
+        credential=settings.storage_account_key,
+        transport=AioHttpTransport(session=get_aiohttp_session(), session_owner=False)
+    ))
+
+def get_process_pool() -> ProcessPoolExecutor:
+    # CPU-bound work such as PDF parsing; spawned workers do not inherit the event loop,
+    # threads and open connections of the service
+    return get_client("process_pool", lambda: ProcessPoolExecutor(
+        max_workers=settings.process_pool_workers,
+        mp_context=multiprocessing.get_context("spawn")
+    ))
+
+def get_docint_client():
+    from azure.ai.documentintelligence import DocumentIntelligenceClient
+    return get_client("document_intelligence", lambda: DocumentIntelligenceClient(
+        endpoint=settings.docint_url,
+        credential=AzureKeyCredential(settings.docint_key),
+        transport=_requests_transport()
+    ))
+
+def get_openai_client():
+    from openai import AzureOpenAI
+    return get_client("azure_openai", lambda: AzureOpenAI(
+        azure_endpoint=settings.azure_openai_endpoint,
+        azure_deployment=settings.azure_openai_model,
+        api_version=settings.azure_openai_api_version,
+        api_key=settings.azure_openai_key,
+        http_client=get_httpx_client(),
+        # throttled and failed requests are retried by the shared rate limiter (extractors/rate_limiter.py)
+        max_retries=0
+    ))
+
+def get_groq_client():
+    from groq import Groq
+    return get_client("groq", lambda: Groq(api_key=settings.groq_api_key, http_client=get_httpx_client(), max_retries=0))
+
+def get_ollama_client():
+    import ollama
+    return get_client("ollama", lambda: ollama.Client(limits=_httpx_limits()))
+
+def get_event_grid_client(endpoint: str, key: str, topic_name: str):
+    from azure.eventgrid import EventGridPublisherClient
+    return get_client(f"event_grid:{endpoint}:{topic_name}:{_secret_id(key)}", lambda: EventGridPublisherClient(
+        endpoint=endpoint,
+        credential=AzureKeyCredential(key),
+        namespace_topic=topic_name,
+        transport=_requests_transport()
+    ))
+
+def get_pusher_client(app_id: str, key: str, secret: str, cluster: str):
+    # the Pusher SDK keeps its own requests session, so reusing the client is enough to keep connections alive
+    from pusher import Pusher
+    return get_client(f"pusher:{app_id}:{cluster}:{key}:{_secret_id(secret)}", lambda: Pusher(app_id=app_id, key=key, secret=secret, cluster=cluster, ssl=True))
+
+def _secret_id(secret: str) -> str:
+    # clients created with other credentials are other clients; the registry name is logged, so not the secret itself
+    return hashlib.sha256(secret.encode("utf-8")).hexdigest()[:12]
+
+def dapr_url(path: str) -> str:
+    # catalyst endpoints (used when an API token is set) do not take a port
+    return f'{settings.dapr_http_endpoint}{":" + settings.dapr_http_port if not settings.dapr_api_token else ""}{path}'
+
+def dapr_headers(app_id: str = None) -> Dict[str, str]:
+    headers = {'content-type': 'application/json'}
+    if app_id:
+        headers['dapr-app-id'] = app_id
+    if settings.dapr_api_token:
+        headers['dapr-api-token'] = settings.dapr_api_token
+    headers.update(timing.trace_headers())
+    return headers
+
+async def startup():
+    """
+    Creates the shared HTTP sessions and the blob client; called from the FastAPI lifespan.
+    """
+    get_aiohttp_session()
+    get_blob_service_client()
+
+async def shutdown():
+    """
+    Closes every registered client, SDK clients first and the shared sessions last.
+    """
+    with _lock:
+        clients = list(_clients.items())
+        _clients.clear()
+
+    sessions = ("aiohttp_session", "httpx_client", "requests_session")
+    ordered = [item for item in clients if item[0] not in sessions] + [item for item in clients if item[0] in sessions]
+    for name, client in ordered:
+        # executors have shutdown() instead of close()
+        close = getattr(client, "close", None) or getattr(client, "shutdown", None)
+        if close is None:
+            continue
+        try:
+            result = close()
+            if asyncio.iscoroutine(result):
+                await result
+            logging.info(f"Client closed: {name}")
+        except Exception as e:
+            logging.error(f"An error occurred while closing client {name}: {str(e)}")
+
+def _httpx_limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=settings.http_pool_maxsize,
+        max_keepalive_connections=settings.http_pool_maxsize,
+        keepalive_expiry=settings.http_keepalive_seconds
+    )
+
+def _requests_transport() -> RequestsTransport:
+    return RequestsTransport(session=get_requests_session(), session_owner=False)
@@ -31,6 +31,92 @@ class Settings(BaseModel):
     event_grid_topic_key: str = Field(default_factory=lambda: os.getenv('EVENT_GRID_TOPIC_KEY', ''))
     cracker_type: str = Field(default_factory=lambda: os.getenv('CRACKER_TYPE', 'tika'))
     ollama_model: str = Field(default_factory=lambda: os.getenv('OLLAMA_MODEL', 'phi3'))
+    max_concurrent_documents: int = Field(default_factory=lambda: int(os.getenv('MAX_CONCURRENT_DOCUMENTS', '32')))
+    executor_workers: int = Field(default_factory=lambda: int(os.getenv('EXECUTOR_WORKERS', '32')))
+    groq_api_key: str = Field(default_factory=lambda: os.getenv('GROQ_API_KEY', ''))
+    http_pool_connections: int = Field(default_factory=lambda: int(os.getenv('HTTP_POOL_CONNECTIONS', '10')))
+    http_pool_maxsize: int = Field(default_factory=lambda: int(os.getenv('HTTP_POOL_MAXSIZE', '64')))
+    http_keepalive_seconds: float = Field(default_factory=lambda: float(os.getenv('HTTP_KEEPALIVE_SECONDS', '30')))
+    template_cache_size: int = Field(default_factory=lambda: int(os.getenv('TEMPLATE_CACHE_SIZE', '256')))
+    template_cache_ttl_seconds: float = Field(default_factory=lambda: float(os.getenv('TEMPLATE_CACHE_TTL_SECONDS', '300')))
+    template_topic_name: str = Field(default_factory=lambda: os.getenv('TEMPLATE_TOPIC_NAME', 'templates'))
+    result_cache_type: str = Field(default_factory=lambda: os.getenv('RESULT_CACHE_TYPE', 'memory'))
+    result_cache_size: int = Field(default_factory=lambda: int(os.getenv('RESULT_CACHE_SIZE', '1024')))
+    result_cache_dir: str = Field(default_factory=lambda: os.getenv('RESULT_CACHE_DIR', '.result_cache'))
+    result_cache_store: str = Field(default_factory=lambda: os.getenv('RESULT_CACHE_STORE', os.getenv('KVSTORE_NAME', 'kvstore')))
+    result_cache_ttl_seconds: int = Field(default_factory=lambda: int(os.getenv('RESULT_CACHE_TTL_SECONDS', '86400')))
+    job_tracking_enabled: bool = Field(default_factory=lambda: os.getenv('JOB_TRACKING_ENABLED', 'false').lower() == 'true')
+    job_store_name: str = Field(default_factory=lambda: os.getenv('JOB_STORE_NAME', os.getenv('KVSTORE_NAME', 'kvstore')))
+    job_ttl_seconds: int = Field(default_factory=lambda: int(os.getenv('JOB_TTL_SECONDS', '604800')))
+    job_index_shards: int = Field(default_factory=lambda: int(os.getenv('JOB_INDEX_SHARDS', '16')))
+    job_index_max_entries: int = Field(default_factory=lambda: int(os.getenv('JOB_INDEX_MAX_ENTRIES', '10000')))
+    near_duplicate_cache_size: int = Field(default_factory=lambda: int(os.getenv('NEAR_DUPLICATE_CACHE_SIZE', '0')))
+    near_duplicate_threshold: float = Field(default_factory=lambda: float(os.getenv('NEAR_DUPLICATE_THRESHOLD', '0.9')))
+    near_duplicate_permutations: int = Field(default_factory=lambda: int(os.getenv('NEAR_DUPLICATE_PERMUTATIONS', '64')))
+    near_duplicate_bands: int = Field(default_factory=lambda: int(os.getenv('NEAR_DUPLICATE_BANDS', '16')))
+    near_duplicate_shingle_words: int = Field(default_factory=lambda: int(os.getenv('NEAR_DUPLICATE_SHINGLE_WORDS', '5')))
+    near_duplicate_match_numbers: bool = Field(default_factory=lambda: os.getenv('NEAR_DUPLICATE_MATCH_NUMBERS', 'true').lower() == 'true')
+    bulk_subscribe_enabled: bool = Field(default_factory=lambda: os.getenv('BULK_SUBSCRIBE_ENABLED', 'false').lower() == 'true')
+    bulk_subscribe_max_messages: int = Field(default_factory=lambda: int(os.getenv('BULK_SUBSCRIBE_MAX_MESSAGES', '100')))
+    bulk_subscribe_max_await_ms: int = Field(default_factory=lambda: int(os.getenv('BULK_SUBSCRIBE_MAX_AWAIT_MS', '1000')))
+    streaming_extraction_enabled: bool = Field(default_factory=lambda: os.getenv('STREAMING_EXTRACTION_ENABLED', 'false').lower() == 'true')
+    extraction_batch_size: int = Field(default_factory=lambda: int(os.getenv('EXTRACTION_BATCH_SIZE', '1')))
+    extraction_batch_window_ms: int = Field(default_factory=lambda: int(os.getenv('EXTRACTION_BATCH_WINDOW_MS', '200')))
+    extraction_batch_max_chars: int = Field(default_factory=lambda: int(os.getenv('EXTRACTION_BATCH_MAX_CHARS', '8000')))
+    template_compile_cache_size: int = Field(default_factory=lambda: int(os.getenv('TEMPLATE_COMPILE_CACHE_SIZE', '128')))
+    blob_account_url: str = Field(default_factory=lambda: os.getenv('BLOB_ACCOUNT_URL', f"https://{os.getenv('STORAGE_ACCOUNT_NAME', '')}.blob.core.windows.net"))
+    stage_timings_file: str = Field(default_factory=lambda: os.getenv('STAGE_TIMINGS_FILE', ''))
+    docint_pages_per_range: int = Field(default_factory=lambda: int(os.getenv('DOCINT_PAGES_PER_RANGE', '0')))
+    docint_max_concurrent_ranges: int = Field(default_factory=lambda: int(os.getenv('DOCINT_MAX_CONCURRENT_RANGES', '4')))
+    docint_poll_initial_seconds: float = Field(default_factory=lambda: float(os.getenv('DOCINT_POLL_INITIAL_SECONDS', '0.25')))
+    docint_poll_max_seconds: float = Field(default_factory=lambda: float(os.getenv('DOCINT_POLL_MAX_SECONDS', '5')))
+    docint_timeout_seconds: float = Field(default_factory=lambda: float(os.getenv('DOCINT_TIMEOUT_SECONDS', '300')))
+    docint_range_cache_size: int = Field(default_factory=lambda: int(os.getenv('DOCINT_RANGE_CACHE_SIZE', '256')))
+    native_fallback_cracker: str = Field(default_factory=lambda: os.getenv('NATIVE_FALLBACK_CRACKER', 'tika'))
+    native_min_chars_per_page: int = Field(default_factory=lambda: int(os.getenv('NATIVE_MIN_CHARS_PER_PAGE', '32')))
+    process_pool_workers: int = Field(default_factory=lambda: int(os.getenv('PROCESS_POOL_WORKERS', str(max(1, (os.cpu_count() or 1) // int(os.getenv('WORKERS', '1')))))))
+    output_queue_size: int = Field(default_factory=lambda: int(os.getenv('OUTPUT_QUEUE_SIZE', '1000')))
+    output_batch_size: int = Field(default_factory=lambda: int(os.getenv('OUTPUT_BATCH_SIZE', '100')))
+    output_flush_ms: int = Field(default_factory=lambda: int(os.getenv('OUTPUT_FLUSH_MS', '200')))
+    output_max_attempts: int = Field(default_factory=lambda: int(os.getenv('OUTPUT_MAX_ATTEMPTS', '3')))
+    output_retry_backoff_seconds: float = Field(default_factory=lambda: float(os.getenv('OUTPUT_RETRY_BACKOFF_SECONDS', '1')))
+    output_dead_letter_file: str = Field(default_factory=lambda: os.getenv('OUTPUT_DEAD_LETTER_FILE', 'output_dead_letter.jsonl'))
+    output_file_flush_records: int = Field(default_factory=lambda: int(os.getenv('OUTPUT_FILE_FLUSH_RECORDS', '100')))
+    output_file_flush_ms: int = Field(default_factory=lambda: int(os.getenv('OUTPUT_FILE_FLUSH_MS', '50')))
+    output_file_fsync: bool = Field(default_factory=lambda: os.getenv('OUTPUT_FILE_FSYNC', 'false').lower() == 'true')
+    output_file_rotate_bytes: int = Field(default_factory=lambda: int(float(os.getenv('OUTPUT_FILE_ROTATE_MB', '0')) * 1024 * 1024))
+    output_file_rotate_seconds: int = Field(default_factory=lambda: int(os.getenv('OUTPUT_FILE_ROTATE_SECONDS', '0')))
+    parquet_output_dir: str = Field(default_factory=lambda: os.getenv('PARQUET_OUTPUT_DIR', 'invoice_details_parquet'))
+    parquet_row_group_size: int = Field(default_factory=lambda: int(os.getenv('PARQUET_ROW_GROUP_SIZE', '10000')))
+    parquet_flush_seconds: float = Field(default_factory=lambda: float(os.getenv('PARQUET_FLUSH_SECONDS', '60')))
+    parquet_file_max_rows: int = Field(default_factory=lambda: int(os.getenv('PARQUET_FILE_MAX_ROWS', '1000000')))
+    parquet_file_max_seconds: float = Field(default_factory=lambda: float(os.getenv('PARQUET_FILE_MAX_SECONDS', '600')))
+    parquet_compression: str = Field(default_factory=lambda: os.getenv('PARQUET_COMPRESSION', 'zstd'))
+    preprocessors: list[str] = Field(default_factory=lambda: [p.strip() for p in os.getenv('PREPROCESSORS', '').split(',') if p.strip()])
+    preprocess_header_lines: int = Field(default_factory=lambda: int(os.getenv('PREPROCESS_HEADER_LINES', '3')))
+    preprocess_region_max_line_chars: int = Field(default_factory=lambda: int(os.getenv('PREPROCESS_REGION_MAX_LINE_CHARS', '80')))
+    token_budgets: dict[str, int] = Field(default_factory=lambda: {k.strip().lower(): int(v) for k, v in (item.split('=') for item in os.getenv('TOKEN_BUDGETS', '').split(',') if item.strip())})
+    extraction_chunk_tokens: int = Field(default_factory=lambda: int(os.getenv('EXTRACTION_CHUNK_TOKENS', '0')))
+    extraction_chunk_overlap_tokens: int = Field(default_factory=lambda: int(os.getenv('EXTRACTION_CHUNK_OVERLAP_TOKENS', '200')))
+    extraction_max_concurrent_chunks: int = Field(default_factory=lambda: int(os.getenv('EXTRACTION_MAX_CONCURRENT_CHUNKS', '4')))
+    rules_fallback_extractor: str = Field(default_factory=lambda: os.getenv('RULES_FALLBACK_EXTRACTOR', 'openai'))
+    rules_dir: str = Field(default_factory=lambda: os.getenv('RULES_DIR', '.rules'))
+    rules_min_hits: int = Field(default_factory=lambda: int(os.getenv('RULES_MIN_HITS', '2')))
+    router_extractors: list[str] = Field(default_factory=lambda: os.getenv('ROUTER_EXTRACTORS', 'openai,groq').split(','))
+    router_hedge_enabled: bool = Field(default_factory=lambda: os.getenv('ROUTER_HEDGE_ENABLED', 'false').lower() == 'true')
+    router_hedge_quantile: float = Field(default_factory=lambda: float(os.getenv('ROUTER_HEDGE_QUANTILE', '0.95')))
+    router_hedge_min_ms: int = Field(default_factory=lambda: int(os.getenv('ROUTER_HEDGE_MIN_MS', '500')))
+    router_window: int = Field(default_factory=lambda: int(os.getenv('ROUTER_WINDOW', '100')))
+    router_error_threshold: float = Field(default_factory=lambda: float(os.getenv('ROUTER_ERROR_THRESHOLD', '0.5')))
+    router_cooldown_seconds: float = Field(default_factory=lambda: float(os.getenv('ROUTER_COOLDOWN_SECONDS', '30')))
+    rate_limits: dict[str, tuple[int, int]] = Field(default_factory=lambda: {k.strip().lower(): tuple(int(n) for n in v.split('/')) for k, v in (item.split('=') for item in os.getenv('RATE_LIMITS', '').split(',') if item.strip())})
+    rate_limit_utilization: float = Field(default_factory=lambda: float(os.getenv('RATE_LIMIT_UTILIZATION', '0.95')))
+    rate_limit_max_retries: int = Field(default_factory=lambda: int(os.getenv('RATE_LIMIT_MAX_RETRIES', '5')))
+    host: str = Field(default_factory=lambda: os.getenv('HOST', '0.0.0.0'))
+    port: int = Field(default_factory=lambda: int(os.getenv('PORT', '8001')))
+    workers: int = Field(default_factory=lambda: int(os.getenv('WORKERS', '1')))
+    graceful_shutdown_seconds: int = Field(default_factory=lambda: int(os.getenv('GRACEFUL_SHUTDOWN_SECONDS', '30')))
+    trace_propagation_enabled: bool = Field(default_factory=lambda: os.getenv('TRACE_PROPAGATION_ENABLED', 'false').lower() == 'true')
 
     
 
@@ -1,6 +1,9 @@
 from abc import ABC, abstractmethod
 from typing import Any
 
+# separates pages in the cracked text, for crackers that know the page boundaries
+PAGE_BREAK = "\f"
+
 class BaseCracker(ABC):
     @abstractmethod
     def crack(self, file_content: bytes) -> str:
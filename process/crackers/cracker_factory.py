@@ -1,18 +1,36 @@
 from .base_cracker import BaseCracker
 from .document_intelligence_cracker import DocumentIntelligenceCracker
 from .tika_cracker import TikaCracker  # Import the new TikaCracker
+from .native_cracker import NativeCracker
+from config import settings
 import os
 
 class CrackerFactory:
+    # crackers are created once per type and reused for every document
+    _instances = {}
+
     @staticmethod
     def get_cracker(cracker_type: str = None) -> BaseCracker:
         if cracker_type is None:
             cracker_type = os.getenv('CRACKER_TYPE', 'document_intelligence')
 
-        if cracker_type.lower() == 'document_intelligence':
+        cracker_type = cracker_type.lower()
+        if cracker_type not in CrackerFactory._instances:
+            CrackerFactory._instances[cracker_type] = CrackerFactory._create_cracker(cracker_type)
+        return CrackerFactory._instances[cracker_type]
+
+    @staticmethod
+    def _create_cracker(cracker_type: str) -> BaseCracker:
+        if cracker_type == 'document_intelligence':
             return DocumentIntelligenceCracker()
-        elif cracker_type.lower() == 'tika':
+        elif cracker_type == 'tika':
             return TikaCracker()
+        elif cracker_type == 'native':
+            # scanned documents have no text layer and go to the fallback cracker
+            fallback_type = settings.native_fallback_cracker.lower()
+            if fallback_type in ('', 'none', 'native'):
+                return NativeCracker()
+            return NativeCracker(fallback=CrackerFactory.get_cracker(fallback_type))
         # Add more crackers here as needed
         else:
             raise ValueError(f"Unsupported cracker type: {cracker_type}")
\ No newline at end of file
@@ -1,26 +1,128 @@
-from .base_cracker import BaseCracker
-from azure.ai.documentintelligence import DocumentIntelligenceClient
+from .base_cracker import BaseCracker, PAGE_BREAK
+from .pdf_text import split_pages
 from azure.ai.documentintelligence.models import AnalyzeResult, AnalyzeDocumentRequest
-from azure.core.credentials import AzureKeyCredential
+from azure.core.exceptions import HttpResponseError
+from azure.core.polling.base_polling import BadResponse, BadStatus, LROBasePolling
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
+import hashlib
 import logging
+import threading
+import time
+import clients
+import metrics
 from config import settings
 
+class RangeCache:
+    """
+    Bounded LRU of analyzed page ranges keyed on the hash of the document and the range index,
+    so a retried document only sends the ranges that failed before. Shared by the cracker threads.
+    """
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._entries: OrderedDict[str, List[str]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[List[str]]:
+        with self._lock:
+            pages = self._entries.get(key)
+            if pages is not None:
+                self._entries.move_to_end(key)
+            return pages
+
+    def put(self, key: str, pages: List[str]):
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._entries[key] = pages
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+class BackoffPolling(LROBasePolling):
+    """
+    Polls quickly at first and doubles the interval after every poll, up to max_delay, so short
+    analyses return soon after they finish without polling long ones every half second.
+    Only the public methods of LROBasePolling are used; its run() checks the final status
+    and fetches the final resource once the analysis has finished.
+    """
+    def __init__(self, initial_delay: float, max_delay: float, **kwargs):
+        super().__init__(timeout=initial_delay, **kwargs)
+        self.initial_delay = initial_delay
+        self.max_delay = max_delay
+
+    def run(self) -> None:
+        delay = self.initial_delay
+        try:
+            while not self.finished():
+                time.sleep(delay)
+                self.update_status()
+                delay = min(delay * 2, self.max_delay)
+        except (BadStatus, BadResponse) as err:
+            raise HttpResponseError(message=str(err), error=err) from err
+        super().run()
+
 class DocumentIntelligenceCracker(BaseCracker):
     def __init__(self):
-        self.client = DocumentIntelligenceClient(
-            endpoint=settings.docint_url, credential=AzureKeyCredential(settings.docint_key)
-        )
+        self.client = clients.get_docint_client()
+        self.range_cache = RangeCache(settings.docint_range_cache_size)
 
     def crack(self, file_content: bytes) -> str:
         try:
-            doc_request = AnalyzeDocumentRequest(bytes_source=file_content)
-            poller = self.client.begin_analyze_document("prebuilt-layout", doc_request)
-            logging.info("Document Intelligence processing started.")
-            result: AnalyzeResult = poller.result(timeout=10)
-            logging.info("Document Intelligence processing completed successfully.")
-            
-            lines = [line.content for page in result.pages for line in page.lines]
-            return "\n".join(lines)
+            ranges = self._split(file_content)
+            if len(ranges) == 1:
+                return self._join(self._analyze(ranges[0]))
+
+            # large PDFs are analyzed as concurrent page ranges and stitched back in page order;
+            # split files are not byte-identical between runs, so ranges are cached on the original file
+            logging.info(f"Document Intelligence processing started for {len(ranges)} page ranges.")
+            file_hash = hashlib.sha256(file_content).hexdigest()
+            with ThreadPoolExecutor(max_workers=min(settings.docint_max_concurrent_ranges, len(ranges)), thread_name_prefix="docint") as pool:
+                futures = [
+                    pool.submit(self._analyze_range, f"{file_hash}-{settings.docint_pages_per_range}-{index}", content)
+                    for index, content in enumerate(ranges)
+                ]
+
+            failed = [future.exception() for future in futures if future.exception() is not None]
+            if failed:
+                raise RuntimeError(f"{len(failed)} of {len(ranges)} page ranges failed: {str(failed[0])}")
+            return self._join([page for future in futures for page in future.result()])
         except Exception as e:
             logging.error(f"Could not extract text from document: {str(e)}")
-            raise
\ No newline at end of file
+            raise
+
+    def _join(self, pages: List[str]) -> str:
+        # pages are only told apart when page splitting is enabled; otherwise the text is the
+        # same as before ranges existed, so the extractor input and cached texts do not change
+        if settings.docint_pages_per_range <= 0:
+            return "\n".join(page for page in pages if page)
+        return PAGE_BREAK.join(pages)
+
+    def _split(self, file_content: bytes) -> List[bytes]:
+        if settings.docint_pages_per_range <= 0 or file_content[:5] != b"%PDF-":
+            return [file_content]
+        return clients.get_process_pool().submit(split_pages, file_content, settings.docint_pages_per_range).result()
+
+    def _analyze_range(self, key: str, content: bytes) -> List[str]:
+        pages = self.range_cache.get(key)
+        metrics.record_cache("docint_range", pages is not None)
+        if pages is None:
+            pages = self._analyze(content)
+            self.range_cache.put(key, pages)
+        return pages
+
+    def _analyze(self, content: bytes) -> List[str]:
+        polling = BackoffPolling(settings.docint_poll_initial_seconds, settings.docint_poll_max_seconds)
+        poller = self.client.begin_analyze_document("prebuilt-layout", AnalyzeDocumentRequest(bytes_source=content), polling=polling)
+        logging.info("Document Intelligence processing started.")
+        # result() would wait again without a timeout, so it is only called once the analysis is done
+        poller.wait(timeout=settings.docint_timeout_seconds)
+        if not poller.done():
+            raise TimeoutError(f"Document Intelligence did not finish within {settings.docint_timeout_seconds} seconds")
+        result: AnalyzeResult = poller.result()
+        logging.info("Document Intelligence processing completed successfully.")
+
+        metrics.PAGES.labels("document_intelligence").inc(len(result.pages))
+        # one text per page, so pages can be told apart after stitching
+        return ["\n".join(line.content for line in page.lines) for page in result.pages]
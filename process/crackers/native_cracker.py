@@ -0,0 +1,51 @@
+from .base_cracker import BaseCracker, PAGE_BREAK
+from .pdf_text import extract_pages, warm_up
+import logging
+import clients
+import metrics
+from config import settings
+
+class NativeCracker(BaseCracker):
+    """
+    Extracts the text layer of born-digital PDFs in-process, without a round trip to Tika
+    or Document Intelligence. Parsing runs on the shared process pool so it uses all cores.
+
+    Documents that are not PDFs, cannot be parsed or have a page with (almost) no text layer, like
+    scanned invoices, are handed to the NATIVE_FALLBACK_CRACKER.
+    """
+    def __init__(self, fallback: BaseCracker = None):
+        self.pool = clients.get_process_pool()
+        self.fallback = fallback
+        # start the workers now rather than on the first documents
+        for _ in range(settings.process_pool_workers):
+            self.pool.submit(warm_up)
+
+    def crack(self, file_content: bytes) -> str:
+        if not file_content.lstrip()[:5] == b"%PDF-":
+            logging.info("Document is not a PDF, using the fallback cracker.")
+            return self._fall_back(file_content, "not_pdf")
+
+        try:
+            pages = self.pool.submit(extract_pages, file_content).result()
+        except Exception as e:
+            logging.error(f"Could not extract the text layer, using the fallback cracker: {str(e)}")
+            return self._fall_back(file_content, "parse_error")
+
+        pages = [page.strip() for page in pages]
+        # a scanned page in an otherwise born-digital document, like a signed last page, would be lost,
+        # so every page needs a text layer
+        scanned = sum(1 for page in pages if len(page) < settings.native_min_chars_per_page)
+        if not pages or scanned:
+            logging.info(f"Document has pages without a text layer ({scanned} of {len(pages)} pages), using the fallback cracker.")
+            return self._fall_back(file_content, "no_text_layer")
+
+        text = PAGE_BREAK.join(pages)
+
+        metrics.PAGES.labels("native").inc(len(pages))
+        return text
+
+    def _fall_back(self, file_content: bytes, reason: str) -> str:
+        if self.fallback is None:
+            raise ValueError(f"Document cannot be cracked natively ({reason}) and no fallback cracker is configured")
+        metrics.CRACKER_FALLBACKS.labels("native", reason).inc()
+        return self.fallback.crack(file_content)
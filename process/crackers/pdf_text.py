@@ -0,0 +1,51 @@
+from typing import List
+
+# runs in the worker processes of clients.get_process_pool(); keep imports light, every
+# worker imports this module when it starts
+
+def warm_up():
+    import pypdfium2  # noqa: F401
+
+def extract_pages(file_content: bytes) -> List[str]:
+    """
+    Returns the text layer of every page of a PDF, an empty string for pages without text.
+    """
+    import pypdfium2 as pdfium
+
+    document = pdfium.PdfDocument(file_content)
+    try:
+        pages = []
+        for page in document:
+            text_page = page.get_textpage()
+            pages.append(text_page.get_text_bounded())
+            text_page.close()
+            page.close()
+        return pages
+    finally:
+        document.close()
+
+def split_pages(file_content: bytes, pages_per_range: int) -> List[bytes]:
+    """
+    Splits a PDF into documents of at most pages_per_range pages, in page order.
+    Returns the original file when it has no more pages than that.
+    """
+    import pypdfium2 as pdfium
+    from io import BytesIO
+
+    document = pdfium.PdfDocument(file_content)
+    try:
+        page_count = len(document)
+        if page_count <= pages_per_range:
+            return [file_content]
+
+        ranges = []
+        for start in range(0, page_count, pages_per_range):
+            part = pdfium.PdfDocument.new()
+            part.import_pages(document, pages=list(range(start, min(start + pages_per_range, page_count))))
+            buffer = BytesIO()
+            part.save(buffer)
+            part.close()
+            ranges.append(buffer.getvalue())
+        return ranges
+    finally:
+        document.close()
@@ -1,5 +1,6 @@
 from .base_cracker import BaseCracker
 from tika import parser
+import metrics
 
 class TikaCracker(BaseCracker):
     def crack(self, file_content: bytes) -> str:
@@ -8,4 +9,9 @@ class TikaCracker(BaseCracker):
         except Exception as e:
             return None
         
+        pages = (parsed.get("metadata") or {}).get("xmpTPg:NPages")
+        if isinstance(pages, list):
+            pages = pages[0]
+        if pages:
+            metrics.PAGES.labels("tika").inc(int(pages))
         return parsed["content"]
@@ -0,0 +1,82 @@
+import asyncio
+import hashlib
+import json
+import logging
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+from extractors.base_extractor import BaseExtractor
+
+class ExtractionBatch:
+    def __init__(self, extractor: BaseExtractor, template_content: Optional[Dict[str, Any]], template_name: str):
+        self.extractor = extractor
+        self.template_content = template_content
+        self.template_name = template_name
+        self.input_strings: List[str] = []
+        self.futures: List[asyncio.Future] = []
+        self.timer: Optional[asyncio.TimerHandle] = None
+
+class ExtractionBatcher:
+    """
+    Collects documents that share a template and extracts them with one extract_many call.
+
+    A batch is sent when it holds max_batch_size documents or when the oldest document
+    has waited max_wait_ms, whichever comes first. Every caller gets its own result back.
+    """
+    def __init__(self, run_blocking: Callable[..., Awaitable[Any]], max_batch_size: int, max_wait_ms: int):
+        self.run_blocking = run_blocking
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self._batches: Dict[Tuple[str, str, str], ExtractionBatch] = {}
+        self._tasks = set()
+
+    async def extract(self, extractor: BaseExtractor, template_content: Optional[Dict[str, Any]], input_string: str, template_name: str):
+        key = self._batch_key(extractor, template_content, template_name)
+        batch = self._batches.get(key)
+        if batch is None:
+            batch = ExtractionBatch(extractor, template_content, template_name)
+            batch.timer = asyncio.get_running_loop().call_later(self.max_wait_ms / 1000, self._flush, key)
+            self._batches[key] = batch
+
+        future = asyncio.get_running_loop().create_future()
+        batch.input_strings.append(input_string)
+        batch.futures.append(future)
+
+        if len(batch.input_strings) >= self.max_batch_size:
+            self._flush(key)
+
+        return await future
+
+    def _flush(self, key: Tuple[str, str, str]):
+        batch = self._batches.pop(key, None)
+        if batch is None:
+            return
+        batch.timer.cancel()
+        task = asyncio.create_task(self._run(batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, batch: ExtractionBatch):
+        logging.info(f"Extracting batch of {len(batch.input_strings)} documents for template {batch.template_name}")
+        try:
+            results = await self.run_blocking(batch.extractor.extract_many, batch.template_content, batch.input_strings, batch.template_name)
+        except Exception as e:
+            for future in batch.futures:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        if len(results) != len(batch.futures):
+            # never leave a caller waiting for a result that will not come
+            error = RuntimeError(f"Batch of {len(batch.futures)} documents for template {batch.template_name} returned {len(results)} results")
+            logging.error(str(error))
+            for future in batch.futures:
+                if not future.done():
+                    future.set_exception(error)
+            return
+
+        for future, result in zip(batch.futures, results):
+            if not future.done():
+                future.set_result(result)
+
+    def _batch_key(self, extractor: BaseExtractor, template_content: Optional[Dict[str, Any]], template_name: str) -> Tuple[str, str, str]:
+        template_hash = hashlib.sha256(json.dumps(template_content, sort_keys=True).encode("utf-8")).hexdigest()
+        return (type(extractor).__name__, template_name, template_hash)
@@ -1,7 +1,25 @@
 from abc import ABC, abstractmethod
-from typing import Dict, Any
+from typing import Callable, Dict, Any, List
 
 class BaseExtractor(ABC):
     @abstractmethod
     def extract(self, template_content: Dict[str, str], input_string: str, template_name: str = None) -> Dict[str, Any]:
-        pass
\ No newline at end of file
+        pass
+
+    def extract_many(self, template_content: Dict[str, str], input_strings: List[str], template_name: str = None) -> List[Dict[str, Any]]:
+        """
+        Extracts the details of several documents that share a template.
+        Returns one result per input, in the same order; None for documents that failed.
+        Extractors that can send several documents in one request override this.
+        """
+        return [self.extract(template_content, input_string, template_name) for input_string in input_strings]
+
+    def extract_stream(self, template_content: Dict[str, str], input_string: str, template_name: str = None,
+                       on_field: Callable[[str, Any], None] = None) -> Dict[str, Any]:
+        """
+        Extracts like extract, and calls on_field with the name and raw value of every top-level
+        field as soon as the response has it, before the result is complete and validated.
+        Extractors that can stream their response override this; by default no fields are
+        reported before the result.
+        """
+        return self.extract(template_content, input_string, template_name)
@@ -0,0 +1,13 @@
+from typing import List
+
+# instructions and document markup shared by the extractors that send several documents in one request
+
+BATCH_INSTRUCTIONS = (
+    "The user message contains several documents, each wrapped in a <document index=\"...\"> tag. "
+    "Return a JSON object with a \"documents\" list that holds one result per document, in the same order as the documents."
+)
+
+def render_documents(input_strings: List[str]) -> str:
+    return "\n".join(
+        f"<document index=\"{index}\">\n{input_string}\n</document>" for index, input_string in enumerate(input_strings)
+    )
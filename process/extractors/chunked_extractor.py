@@ -0,0 +1,125 @@
+from .base_extractor import BaseExtractor
+from .template_compiler import compile_template
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List
+from pydantic import BaseModel
+import json
+import logging
+from tokens import estimate_tokens
+
+class ChunkedExtractor(BaseExtractor):
+    """
+    Extracts long documents as overlapping chunks with the wrapped extractor and merges the results.
+
+    Documents of at most chunk_tokens estimated tokens are sent in one call. Longer documents are
+    split at line boundaries into chunks of chunk_tokens that repeat the last overlap_tokens of the
+    previous chunk, so a line cut off at a chunk boundary is complete in one of them. The chunks
+    are extracted concurrently and merged in document order:
+
+    - objects are merged field by field
+    - lists (like items) are concatenated; items at the start of a chunk that repeat the items at
+      the end of the previous chunk come from the overlap and are dropped
+    - other fields get the value most chunks agree on, ignoring empty values; on a tie the earliest
+      chunk wins, since invoices put most details on the first page
+
+    When any chunk fails, the document fails, rather than being output with missing items.
+    """
+    def __init__(self, extractor: BaseExtractor, chunk_tokens: int, overlap_tokens: int, max_concurrent_chunks: int):
+        self.extractor = extractor
+        self.chunk_tokens = chunk_tokens
+        self.overlap_tokens = overlap_tokens
+        self.max_concurrent_chunks = max_concurrent_chunks
+
+    def extract(self, template_content: Dict[str, str], input_string: str, template_name: str = None) -> Dict[str, Any]:
+        chunks = split_chunks(input_string, self.chunk_tokens, self.overlap_tokens)
+        if len(chunks) == 1:
+            return self.extractor.extract(template_content, input_string, template_name)
+
+        logging.info(f"Extracting document as {len(chunks)} chunks of up to {self.chunk_tokens} tokens.")
+        with ThreadPoolExecutor(max_workers=min(self.max_concurrent_chunks, len(chunks)), thread_name_prefix="chunk") as pool:
+            results = list(pool.map(lambda chunk: self.extractor.extract(template_content, chunk, template_name), chunks))
+
+        failed = sum(1 for result in results if not result)
+        if failed:
+            logging.error(f"{failed} of {len(chunks)} chunks could not be extracted.")
+            return None
+
+        merged = merge_results([result.model_dump(mode="json") if isinstance(result, BaseModel) else result for result in results])
+        if isinstance(results[0], BaseModel):
+            return compile_template(template_content, template_name).model.model_validate(merged)
+        return merged
+
+    def extract_stream(self, template_content: Dict[str, str], input_string: str, template_name: str = None,
+                       on_field: Callable[[str, Any], None] = None) -> Dict[str, Any]:
+        # fields of a chunk may still change when the chunks are merged, so only single chunks stream
+        if len(split_chunks(input_string, self.chunk_tokens, self.overlap_tokens)) == 1:
+            return self.extractor.extract_stream(template_content, input_string, template_name, on_field)
+        return self.extract(template_content, input_string, template_name)
+
+    def extract_many(self, template_content: Dict[str, str], input_strings: List[str], template_name: str = None) -> List[Dict[str, Any]]:
+        # only small documents are batched, so they fit in a single chunk
+        return self.extractor.extract_many(template_content, input_strings, template_name)
+
+def split_chunks(text: str, chunk_tokens: int, overlap_tokens: int) -> List[str]:
+    if chunk_tokens <= 0 or estimate_tokens(text) <= chunk_tokens:
+        return [text]
+
+    chunks = []
+    lines = text.split("\n")
+    start = 0
+    while start < len(lines):
+        end = start
+        tokens = 0
+        # a chunk holds at least one line, even when that line alone is over the limit
+        while end < len(lines) and (end == start or tokens + estimate_tokens(lines[end]) + 1 <= chunk_tokens):
+            tokens += estimate_tokens(lines[end]) + 1
+            end += 1
+        chunks.append("\n".join(lines[start:end]))
+        if end >= len(lines):
+            break
+
+        # the next chunk starts with the last lines of this one, but always moves forward
+        overlap_start = end
+        tokens = 0
+        while overlap_start - 1 > start and tokens + estimate_tokens(lines[overlap_start - 1]) + 1 <= overlap_tokens:
+            overlap_start -= 1
+            tokens += estimate_tokens(lines[overlap_start]) + 1
+        start = overlap_start
+    return chunks
+
+def merge_results(results: List[Any]) -> Any:
+    if all(isinstance(result, dict) for result in results):
+        keys = []
+        for result in results:
+            keys.extend(key for key in result if key not in keys)
+        return {key: merge_results([result[key] for result in results if key in result]) for key in keys}
+
+    if all(isinstance(result, list) for result in results):
+        merged: List[Any] = []
+        for result in results:
+            merged.extend(result[_overlap(merged, result):])
+        return merged
+
+    values = [result for result in results if not _is_empty(result)]
+    if not values:
+        return results[0] if results else None
+    counts = Counter(_canonical(value) for value in values)
+    # most_common keeps the order of first appearance for equal counts
+    winner = counts.most_common(1)[0][0]
+    return next(value for value in values if _canonical(value) == winner)
+
+def _overlap(merged: List[Any], items: List[Any]) -> int:
+    # longest run of items that ends the merged list and starts the next chunk's list
+    merged_keys = [_canonical(item) for item in merged]
+    item_keys = [_canonical(item) for item in items]
+    for size in range(min(len(merged_keys), len(item_keys)), 0, -1):
+        if merged_keys[-size:] == item_keys[:size]:
+            return size
+    return 0
+
+def _is_empty(value: Any) -> bool:
+    return value is None or value == "" or value == [] or value == {} or (not isinstance(value, bool) and value == 0)
+
+def _canonical(value: Any) -> str:
+    return json.dumps(value, sort_keys=True, default=str)
@@ -2,20 +2,61 @@ from .base_extractor import BaseExtractor
 from .openai_extractor import OpenAIExtractor
 from .groq_extractor import GroqExtractor
 from .ollama_extractor import OllamaExtractor  # Import the new extractor
+from .chunked_extractor import ChunkedExtractor
+from .rule_extractor import RuleExtractor
+from .router_extractor import RouterExtractor
+from config import settings
+from tokens import token_budget
 import os
 
 class ExtractorFactory:
+    # extractors are created once per type and reused for every document
+    _instances = {}
+
     @staticmethod
     def get_extractor(extractor_type: str = None) -> BaseExtractor:
         if extractor_type is None:
             extractor_type = os.getenv('EXTRACTOR_TYPE', 'openai')
 
-        if extractor_type.lower() == 'openai':
+        extractor_type = extractor_type.lower()
+        if extractor_type not in ExtractorFactory._instances:
+            extractor = ExtractorFactory._create_extractor(extractor_type)
+            if settings.extraction_chunk_tokens > 0 and extractor_type not in ('rules', 'router'):
+                # long documents are extracted as chunks that fit the token budget of the extractor
+                budget = token_budget(extractor_type)
+                chunk_tokens = min(settings.extraction_chunk_tokens, budget) if budget > 0 else settings.extraction_chunk_tokens
+                extractor = ChunkedExtractor(extractor, chunk_tokens, settings.extraction_chunk_overlap_tokens, settings.extraction_max_concurrent_chunks)
+            ExtractorFactory._instances[extractor_type] = extractor
+        return ExtractorFactory._instances[extractor_type]
+
+    @staticmethod
+    def _create_extractor(extractor_type: str) -> BaseExtractor:
+        if extractor_type == 'openai':
             return OpenAIExtractor()
-        elif extractor_type.lower() == 'groq':
+        elif extractor_type == 'groq':
             return GroqExtractor()
-        elif extractor_type.lower() == 'ollama':  # Add the new extractor type
+        elif extractor_type == 'ollama':  # Add the new extractor type
             return OllamaExtractor()
+        elif extractor_type == 'rules':
+            # documents the rules cannot extract yet go to an LLM extractor, which the rules learn from
+            fallback_type = settings.rules_fallback_extractor.lower()
+            if fallback_type == 'rules':
+                raise ValueError("The rules extractor cannot be its own fallback extractor")
+            return RuleExtractor(ExtractorFactory.get_extractor(fallback_type), settings.rules_dir, settings.rules_min_hits)
+        elif extractor_type == 'router':
+            # every document goes to the fastest healthy provider, and to the next one when it fails
+            providers = [name.strip().lower() for name in settings.router_extractors if name.strip()]
+            if not providers or any(name in ('rules', 'router') for name in providers):
+                raise ValueError(f"The router extractor needs LLM extractors to route to: {settings.router_extractors}")
+            return RouterExtractor(
+                {name: ExtractorFactory.get_extractor(name) for name in providers},
+                hedge=settings.router_hedge_enabled,
+                hedge_quantile=settings.router_hedge_quantile,
+                hedge_min_ms=settings.router_hedge_min_ms,
+                window=settings.router_window,
+                error_threshold=settings.router_error_threshold,
+                cooldown_seconds=settings.router_cooldown_seconds
+            )
         # Add more extractors here as needed
         else:
             raise ValueError(f"Unsupported extractor type: {extractor_type}")
\ No newline at end of file
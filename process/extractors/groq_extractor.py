@@ -1,45 +1,138 @@
 from .base_extractor import BaseExtractor
-from typing import Dict, Any
+from .batch_prompt import BATCH_INSTRUCTIONS, render_documents
+from .template_compiler import compile_template
+from .json_stream import JsonFieldStream
+from .rate_limiter import call_with_rate_limit, get_rate_limiter
+from typing import Callable, Dict, Any, List
 import logging
-from groq import Groq
-import os
 import json
+import clients
+import metrics
+from tokens import estimate_tokens
+
+GROQ_MODEL = "llama3-8b-8192"
+# output tokens reserved for the result of one document, and the context window of the model,
+# which the prompt, the documents and the results share
+TOKENS_PER_DOCUMENT = 2000
+CONTEXT_WINDOW = 8192
+
+def output_tokens(prompt: str, input_string: str) -> int:
+    """
+    Returns the output tokens left for the result of one document, at most TOKENS_PER_DOCUMENT.
+    """
+    room = CONTEXT_WINDOW - estimate_tokens(prompt) - estimate_tokens(input_string)
+    if room <= 0:
+        raise Exception(f"Document does not fit the context window of {GROQ_MODEL}")
+    if room < TOKENS_PER_DOCUMENT:
+        logging.warning(f"Only {room} output tokens are left in the context window of {GROQ_MODEL}; set a lower TOKEN_BUDGETS entry for groq.")
+    return min(TOKENS_PER_DOCUMENT, room)
+
+def split_to_context_window(prompt: str, input_strings: List[str]) -> List[List[str]]:
+    """
+    Splits documents into groups whose request, with TOKENS_PER_DOCUMENT output tokens per
+    document, fits the context window. A document that does not fit alone gets a group of its own.
+    """
+    groups = [[]]
+    tokens = estimate_tokens(prompt)
+    for input_string in input_strings:
+        needed = estimate_tokens(render_documents([input_string])) + TOKENS_PER_DOCUMENT
+        if groups[-1] and tokens + needed > CONTEXT_WINDOW:
+            groups.append([])
+            tokens = estimate_tokens(prompt)
+        groups[-1].append(input_string)
+        tokens += needed
+    return groups
 
 class GroqExtractor(BaseExtractor):
     def __init__(self):
-        self.client = Groq(api_key=os.getenv('GROQ_API_KEY'))
-        pass
+        self.client = clients.get_groq_client()
 
     def extract(self, template_content: Dict[str, str], input_string: str, template_name: str = None) -> Dict[str, Any]:
-        # template_content could be none if we are using a static model
-        if template_content is None:
-            raise ValueError("Template content is required for GROQ extraction.")
-        
-        # generate the prompt that includes the fields to extract
-        prompt = "Extract the following fields from a given invoice. Return the fields in JSON format:\n"
-        for field, field_type in template_content.items():
-            prompt += f"- {field} ({field_type})\n"
-        prompt = prompt.strip()
+        # the prompt that includes the fields to extract is rendered once per template
+        prompt = compile_template(template_content, template_name).field_prompt
+
+        try:
+            return self.complete(prompt, input_string, max_tokens=output_tokens(prompt, input_string))
+        except Exception as e:
+            logging.error(f"An error occurred during GROQ extraction: {str(e)}")
+            return None
+
+    def extract_stream(self, template_content: Dict[str, str], input_string: str, template_name: str = None,
+                       on_field: Callable[[str, Any], None] = None) -> Dict[str, Any]:
+        prompt = compile_template(template_content, template_name).field_prompt
 
         try:
-            completion = self.client.chat.completions.create(
-                model="llama3-8b-8192",
-                response_format={"type": "json_object"},
-                messages=[
-                    {"role": "system", "content": prompt},
-                    {"role": "user", "content": input_string},
-                ],
-                max_tokens=2000,
-                temperature=0,
-            )
-            message = completion.choices[0].message.content
-       
-            
-            try:
-                extracted_data = json.loads(message)
-                return extracted_data
-            except json.JSONDecodeError:
-                raise Exception("Failed to parse GROQ response as JSON")
+            return self.complete_stream(prompt, input_string, max_tokens=output_tokens(prompt, input_string), on_field=on_field)
         except Exception as e:
             logging.error(f"An error occurred during GROQ extraction: {str(e)}")
-            return None
\ No newline at end of file
+            return None
+
+    def extract_many(self, template_content: Dict[str, str], input_strings: List[str], template_name: str = None) -> List[Dict[str, Any]]:
+        if len(input_strings) == 1:
+            return [self.extract(template_content, input_strings[0], template_name)]
+        prompt = f"{compile_template(template_content, template_name).field_prompt}\n{BATCH_INSTRUCTIONS}"
+
+        # larger batches are split, so every request fits the context window with the results of all its documents
+        groups = split_to_context_window(prompt, input_strings)
+        if len(groups) > 1:
+            return [result for group in groups for result in self.extract_many(template_content, group, template_name)]
+
+        try:
+            extracted_data = self.complete(prompt, render_documents(input_strings), max_tokens=TOKENS_PER_DOCUMENT * len(input_strings))
+            documents = extracted_data.get("documents")
+            if isinstance(documents, list) and len(documents) == len(input_strings):
+                return documents
+            logging.error("Batched GROQ extraction did not return one result per document, extracting documents one by one.")
+        except Exception as e:
+            logging.error(f"An error occurred during batched GROQ extraction, extracting documents one by one: {str(e)}")
+
+        return super().extract_many(template_content, input_strings, template_name)
+
+    def complete(self, prompt: str, input_string: str, max_tokens: int) -> Dict[str, Any]:
+        # Groq counts the tokens that were used, so the estimate is corrected with the usage
+        completion = call_with_rate_limit("groq", GROQ_MODEL, estimate_tokens(prompt) + estimate_tokens(input_string) + max_tokens, lambda: self.client.chat.completions.create(
+            model=GROQ_MODEL,
+            response_format={"type": "json_object"},
+            messages=[
+                {"role": "system", "content": prompt},
+                {"role": "user", "content": input_string},
+            ],
+            max_tokens=max_tokens,
+            temperature=0,
+        ), used_tokens=lambda completion: completion.usage.total_tokens if completion.usage else 0)
+        if completion.usage:
+            metrics.record_tokens("groq", completion.usage.prompt_tokens, completion.usage.completion_tokens)
+        message = completion.choices[0].message.content
+
+        try:
+            return json.loads(message)
+        except json.JSONDecodeError:
+            raise Exception("Failed to parse GROQ response as JSON")
+
+    def complete_stream(self, prompt: str, input_string: str, max_tokens: int, on_field: Callable[[str, Any], None]) -> Dict[str, Any]:
+        # JSON mode does not stream, so the object is taken from the text the model streams
+        tokens = estimate_tokens(prompt) + estimate_tokens(input_string) + max_tokens
+        stream = call_with_rate_limit("groq", GROQ_MODEL, tokens, lambda: self.client.chat.completions.create(
+            model=GROQ_MODEL,
+            messages=[
+                {"role": "system", "content": prompt},
+                {"role": "user", "content": input_string},
+            ],
+            max_tokens=max_tokens,
+            temperature=0,
+            stream=True,
+        ))
+        fields = JsonFieldStream()
+        for chunk in stream:
+            # the last chunk has the usage in x_groq
+            usage = getattr(getattr(chunk, "x_groq", None), "usage", None)
+            if usage:
+                metrics.record_tokens("groq", usage.prompt_tokens, usage.completion_tokens)
+                get_rate_limiter("groq", GROQ_MODEL).settle(tokens, usage.total_tokens)
+            if chunk.choices and chunk.choices[0].delta.content:
+                for name, value in fields.feed(chunk.choices[0].delta.content):
+                    on_field(name, value)
+
+        if not fields.done:
+            raise Exception("Failed to parse GROQ response as JSON")
+        return json.loads(fields.json)
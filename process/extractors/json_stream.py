@@ -0,0 +1,76 @@
+import json
+import logging
+from typing import Any, List, Optional, Tuple
+
+class JsonFieldStream:
+    """
+    Parses the top-level fields of a JSON object while its text arrives in pieces.
+
+    feed() returns the fields that were completed by the new text: a field is complete when the
+    comma after it, or the closing brace of the object, has arrived. Nested objects and lists are
+    returned as a whole. Text before the opening brace, like a preamble of the model, is skipped.
+    """
+    def __init__(self):
+        self._text = ""
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._start: Optional[int] = None
+        self._member_start = 0
+        self._end: Optional[int] = None
+
+    @property
+    def done(self) -> bool:
+        return self._end is not None
+
+    @property
+    def text(self) -> str:
+        # everything received so far
+        return self._text
+
+    @property
+    def json(self) -> Optional[str]:
+        # the complete object, without the text around it
+        return self._text[self._start:self._end] if self.done else None
+
+    def feed(self, text: str) -> List[Tuple[str, Any]]:
+        self._text += text
+        fields: List[Tuple[str, Any]] = []
+        while self._pos < len(self._text) and not self.done:
+            c = self._text[self._pos]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif c == "\\":
+                    self._escape = True
+                elif c == '"':
+                    self._in_string = False
+            elif self._depth == 0:
+                if c == "{":
+                    self._depth = 1
+                    self._start = self._pos
+                    self._member_start = self._pos + 1
+            elif c == '"':
+                self._in_string = True
+            elif c in "{[":
+                self._depth += 1
+            elif c in "}]":
+                self._depth -= 1
+                if self._depth == 0:
+                    self._emit(fields, self._pos)
+                    self._end = self._pos + 1
+            elif c == "," and self._depth == 1:
+                self._emit(fields, self._pos)
+                self._member_start = self._pos + 1
+            self._pos += 1
+        return fields
+
+    def _emit(self, fields: List[Tuple[str, Any]], end: int):
+        member = self._text[self._member_start:end].strip()
+        if not member:
+            return
+        try:
+            fields.extend(json.loads("{" + member + "}").items())
+        except ValueError:
+            logging.debug(f"Skipping a field that is not valid JSON: {member[:100]}")
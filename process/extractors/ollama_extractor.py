@@ -1,36 +1,98 @@
 from .base_extractor import BaseExtractor
-import ollama
+from .batch_prompt import BATCH_INSTRUCTIONS, render_documents
+from .template_compiler import compile_template
+from .json_stream import JsonFieldStream
+from .rate_limiter import call_with_rate_limit, get_rate_limiter
 import logging
-from typing import Dict, Any
+from typing import Callable, Dict, Any, List
 import json
+import clients
+import metrics
 from config import settings
+from tokens import estimate_tokens
 
 class OllamaExtractor(BaseExtractor):
+    def __init__(self):
+        self.client = clients.get_ollama_client()
+
     def extract(self, template_content: Dict[str, str], input_string: str, template_name: str = None) -> Dict[str, Any]:
-        if template_content is None:
-            raise ValueError("template_content must not be None")
+        json_template_str = compile_template(template_content, template_name).json_template
 
+        try:
+            return self.complete(f"Extract document details in the following JSON format: {json_template_str}", input_string)
+        except Exception as e:
+            logging.error(f"An error occurred: {str(e)}")
+            return None
 
-        json_template = {key: f"a {value} value" for key, value in template_content.items()}
-        json_template_str = json.dumps(json_template)
+    def extract_stream(self, template_content: Dict[str, str], input_string: str, template_name: str = None,
+                       on_field: Callable[[str, Any], None] = None) -> Dict[str, Any]:
+        json_template_str = compile_template(template_content, template_name).json_template
 
         try:
-            completion = ollama.chat(
-                model=settings.ollama_model,
-                format="json",
-                messages=[
-                    {"role": "system", "content": f"Extract document details in the following JSON format: {json_template_str}"},
-                    {"role": "user", "content": input_string},
-                ]
-            )
-            message = completion['message']['content']
-
-            try:
-                parsed_message = json.loads(message)
-                return parsed_message
-            except json.JSONDecodeError:
-                logging.error("Failed to parse the message as JSON.")
-                raise ValueError("No invoice details extracted from the document.")
+            return self.complete_stream(f"Extract document details in the following JSON format: {json_template_str}", input_string, on_field)
         except Exception as e:
             logging.error(f"An error occurred: {str(e)}")
-            return None
\ No newline at end of file
+            return None
+
+    def extract_many(self, template_content: Dict[str, str], input_strings: List[str], template_name: str = None) -> List[Dict[str, Any]]:
+        if len(input_strings) == 1:
+            return [self.extract(template_content, input_strings[0], template_name)]
+
+        json_template_str = compile_template(template_content, template_name).json_template
+
+        try:
+            parsed_message = self.complete(
+                f"Extract document details in the following JSON format: {json_template_str}\n{BATCH_INSTRUCTIONS}",
+                render_documents(input_strings)
+            )
+            documents = parsed_message.get("documents")
+            if isinstance(documents, list) and len(documents) == len(input_strings):
+                return documents
+            logging.error("Batched extraction did not return one result per document, extracting documents one by one.")
+        except Exception as e:
+            logging.error(f"An error occurred during batched extraction, extracting documents one by one: {str(e)}")
+
+        return super().extract_many(template_content, input_strings, template_name)
+
+    def complete(self, system_prompt: str, input_string: str) -> Dict[str, Any]:
+        completion = call_with_rate_limit("ollama", settings.ollama_model, estimate_tokens(system_prompt) + estimate_tokens(input_string), lambda: self.client.chat(
+            model=settings.ollama_model,
+            format="json",
+            messages=[
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": input_string},
+            ]
+        ), used_tokens=lambda completion: (completion.get('prompt_eval_count') or 0) + (completion.get('eval_count') or 0))
+        metrics.record_tokens("ollama", completion.get('prompt_eval_count'), completion.get('eval_count'))
+        message = completion['message']['content']
+
+        try:
+            return json.loads(message)
+        except json.JSONDecodeError:
+            logging.error("Failed to parse the message as JSON.")
+            raise ValueError("No invoice details extracted from the document.")
+
+    def complete_stream(self, system_prompt: str, input_string: str, on_field: Callable[[str, Any], None]) -> Dict[str, Any]:
+        tokens = estimate_tokens(system_prompt) + estimate_tokens(input_string)
+        stream = call_with_rate_limit("ollama", settings.ollama_model, tokens, lambda: self.client.chat(
+            model=settings.ollama_model,
+            format="json",
+            messages=[
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": input_string},
+            ],
+            stream=True
+        ))
+        fields = JsonFieldStream()
+        for part in stream:
+            for name, value in fields.feed(part['message']['content']):
+                on_field(name, value)
+            if part.get('done'):
+                # the last part has the token counts
+                metrics.record_tokens("ollama", part.get('prompt_eval_count'), part.get('eval_count'))
+                get_rate_limiter("ollama", settings.ollama_model).settle(tokens, (part.get('prompt_eval_count') or 0) + (part.get('eval_count') or 0))
+
+        if not fields.done:
+            logging.error("Failed to parse the message as JSON.")
+            raise ValueError("No invoice details extracted from the document.")
+        return json.loads(fields.json)
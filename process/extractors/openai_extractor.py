@@ -1,60 +1,113 @@
 from .base_extractor import BaseExtractor
-from typing import Dict, Any, Type
-from openai import AzureOpenAI
-from pydantic import create_model, BaseModel
+from .batch_prompt import BATCH_INSTRUCTIONS, render_documents
+from .template_compiler import MODEL_REGISTRY, compile_template
+from .json_stream import JsonFieldStream
+from .rate_limiter import call_with_rate_limit
+from typing import Callable, Dict, Any, List
 import logging
-import os
-from .models.static_invoice import Model  # Updated import path
+import clients
+import metrics
+from config import settings
+from tokens import estimate_tokens
+
+# output tokens reserved for the result of one document, and the output limit of gpt-4o
+TOKENS_PER_DOCUMENT = 2000
+MAX_OUTPUT_TOKENS = 16384
 
 class OpenAIExtractor(BaseExtractor):
-    # Define MODEL_REGISTRY within the class
-    MODEL_REGISTRY = {
-        'static_invoice': Model,
-        # Add other models here as needed
-    }
+    # static models, shared with the template compiler
+    MODEL_REGISTRY = MODEL_REGISTRY
 
     def __init__(self):
-        self.client = AzureOpenAI(
-            azure_endpoint=os.getenv('AZURE_OPENAI_ENDPOINT', ''),
-            azure_deployment=os.getenv('AZURE_OPENAI_MODEL', ''),
-            api_version=os.getenv('AZURE_OPENAI_API_VERSION', ''),
-            api_key=os.getenv('AZURE_OPENAI_KEY', '')
-        )
+        self.client = clients.get_openai_client()
 
     def extract(self, template_content: Dict[str, str], input_string: str, template_name: str = None) -> Dict[str, Any]:
-        if template_name and template_name in self.MODEL_REGISTRY:
-            DynamicModel = self.MODEL_REGISTRY[template_name]
-        else:
-            type_mapping = {
-                'str': str,
-                'float': float,
-                'bool': bool
-            }
+        # the model and its JSON schema are compiled once per template
+        compiled = compile_template(template_content, template_name)
 
-            fields = {
-                key: (type_mapping[value], ...) for key, value in template_content.items()
-            }
+        try:
+            completion = self._create(compiled.response_format, "Extract invoice details", input_string, max_tokens=TOKENS_PER_DOCUMENT)
+            self._record_usage(completion)
+            message = completion.choices[0].message
+
+            if message.content and not message.refusal:
+                return compiled.model.model_validate_json(message.content)
+            else:
+                logging.error("No invoice details extracted from the document.")
+                return None
+        except Exception as e:
+            logging.error(f"An error occurred: {str(e)}")
+            return None
 
-            DynamicModel = create_model('DynamicModel', **fields)
+    def extract_stream(self, template_content: Dict[str, str], input_string: str, template_name: str = None,
+                       on_field: Callable[[str, Any], None] = None) -> Dict[str, Any]:
+        compiled = compile_template(template_content, template_name)
 
         try:
-            completion = self.client.beta.chat.completions.parse(
-                model="gpt-4o",
-                response_format=DynamicModel,
-                messages=[
-                    {"role": "system", "content": "Extract invoice details"},
-                    {"role": "user", "content": input_string},
-                ],
-                max_tokens=2000,
-                temperature=0,
-            )
-            message = completion.choices[0].message
+            stream = self._create(compiled.response_format, "Extract invoice details", input_string, max_tokens=TOKENS_PER_DOCUMENT,
+                                  stream=True, stream_options={"include_usage": True})
+            fields = JsonFieldStream()
+            refused = False
+            for chunk in stream:
+                # the last chunk has the usage and no choices
+                self._record_usage(chunk)
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta
+                refused = refused or bool(delta.refusal)
+                if delta.content:
+                    for name, value in fields.feed(delta.content):
+                        on_field(name, value)
 
-            if message.parsed:
-                return message.parsed
+            if fields.text and not refused:
+                return compiled.model.model_validate_json(fields.text)
             else:
                 logging.error("No invoice details extracted from the document.")
                 return None
         except Exception as e:
             logging.error(f"An error occurred: {str(e)}")
-            return None
\ No newline at end of file
+            return None
+
+    def extract_many(self, template_content: Dict[str, str], input_strings: List[str], template_name: str = None) -> List[Dict[str, Any]]:
+        if len(input_strings) == 1:
+            return [self.extract(template_content, input_strings[0], template_name)]
+        # larger batches are split, so every request can hold the results of all its documents
+        per_request = MAX_OUTPUT_TOKENS // TOKENS_PER_DOCUMENT
+        if len(input_strings) > per_request:
+            return [result for start in range(0, len(input_strings), per_request)
+                    for result in self.extract_many(template_content, input_strings[start:start + per_request], template_name)]
+
+        compiled = compile_template(template_content, template_name)
+
+        try:
+            completion = self._create(compiled.batch_response_format, f"Extract invoice details. {BATCH_INSTRUCTIONS}",
+                                      render_documents(input_strings), max_tokens=TOKENS_PER_DOCUMENT * len(input_strings))
+            self._record_usage(completion)
+            message = completion.choices[0].message
+            parsed = compiled.batch_model.model_validate_json(message.content) if message.content and not message.refusal else None
+
+            if parsed and len(parsed.documents) == len(input_strings):
+                return list(parsed.documents)
+            logging.error("Batched extraction did not return one result per document, extracting documents one by one.")
+        except Exception as e:
+            logging.error(f"An error occurred during batched extraction, extracting documents one by one: {str(e)}")
+
+        return super().extract_many(template_content, input_strings, template_name)
+
+    def _create(self, response_format: Dict[str, Any], system_prompt: str, user_content: str, max_tokens: int, **kwargs):
+        # Azure OpenAI counts the prompt and max_tokens against the quota when the request arrives
+        return call_with_rate_limit("openai", settings.azure_openai_model, estimate_tokens(user_content) + max_tokens, lambda: self.client.chat.completions.create(
+            model="gpt-4o",
+            response_format=response_format,
+            messages=[
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": user_content},
+            ],
+            max_tokens=max_tokens,
+            temperature=0,
+            **kwargs
+        ))
+
+    def _record_usage(self, completion):
+        if completion.usage:
+            metrics.record_tokens("openai", completion.usage.prompt_tokens, completion.usage.completion_tokens)
@@ -0,0 +1,166 @@
+from email.utils import parsedate_to_datetime
+from typing import Any, Callable, Dict, Optional, Tuple
+import logging
+import re
+import threading
+import time
+import metrics
+from config import settings
+
+# seconds to wait after a 429 response without a Retry-After header, doubled for every retry
+DEFAULT_RETRY_SECONDS = 1.0
+
+class RateLimiter:
+    """
+    Shared requests/min and tokens/min budget of one LLM provider and deployment.
+
+    Both budgets refill continuously at utilization times the quota, and hold at most ten
+    seconds of it, so requests are spread evenly just below the quota instead of bursting into
+    it and getting throttled. Callers wait in FIFO order until their request and its estimated
+    tokens fit; a quota of 0 is not limited. After a 429 response every caller waits until the
+    Retry-After time the provider asked for.
+    """
+    def __init__(self, name: str, requests_per_minute: int, tokens_per_minute: int, utilization: float = 0.95):
+        self.name = name
+        self.request_rate = requests_per_minute * utilization / 60
+        self.token_rate = tokens_per_minute * utilization / 60
+        self.request_capacity = max(self.request_rate * 10, 1.0)
+        self.token_capacity = max(self.token_rate * 10, 1.0)
+        self._requests = self.request_capacity
+        self._tokens = self.token_capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._next_ticket = 0
+        self._serving = 0
+        self._condition = threading.Condition()
+
+    def acquire(self, tokens: int) -> float:
+        """
+        Waits until a request with tokens estimated tokens fits the budget; returns the seconds waited.
+        """
+        start = time.monotonic()
+        # a request larger than the bucket would wait forever; it waits for a full bucket instead
+        tokens = min(tokens, self.token_capacity)
+        with self._condition:
+            ticket = self._next_ticket
+            self._next_ticket += 1
+            while True:
+                if ticket != self._serving:
+                    self._condition.wait()
+                    continue
+                now = time.monotonic()
+                self._refill(now)
+                delay = max(
+                    self._paused_until - now,
+                    (1 - self._requests) / self.request_rate if self.request_rate else 0.0,
+                    (tokens - self._tokens) / self.token_rate if self.token_rate else 0.0
+                )
+                if delay <= 0:
+                    self._requests -= 1
+                    self._tokens -= tokens
+                    self._serving += 1
+                    self._condition.notify_all()
+                    return now - start
+                self._condition.wait(delay)
+
+    def settle(self, estimated_tokens: int, used_tokens: int):
+        # corrects the token budget with the usage the provider reported
+        if self.token_rate and used_tokens:
+            with self._condition:
+                self._tokens -= used_tokens - min(estimated_tokens, self.token_capacity)
+
+    def pause(self, seconds: float):
+        with self._condition:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+            self._condition.notify_all()
+
+    def _refill(self, now: float):
+        elapsed = now - self._updated
+        self._updated = now
+        self._requests = min(self.request_capacity, self._requests + elapsed * self.request_rate)
+        self._tokens = min(self.token_capacity, self._tokens + elapsed * self.token_rate)
+
+_limiters: Dict[str, RateLimiter] = {}
+_lock = threading.Lock()
+
+def get_rate_limiter(provider: str, deployment: str) -> RateLimiter:
+    """
+    Returns the limiter of a provider and deployment, shared by all threads of the worker process.
+    RATE_LIMITS entries for provider:deployment take precedence over entries for the provider.
+    """
+    key = f"{provider}:{deployment}"
+    limiter = _limiters.get(key)
+    if limiter is None:
+        with _lock:
+            limiter = _limiters.get(key)
+            if limiter is None:
+                requests_per_minute, tokens_per_minute = settings.rate_limits.get(key.lower(), settings.rate_limits.get(provider, (0, 0)))
+                # every worker process (WORKERS) gets an equal share of the quota
+                requests_per_minute //= max(settings.workers, 1)
+                tokens_per_minute //= max(settings.workers, 1)
+                limiter = _limiters[key] = RateLimiter(key, requests_per_minute, tokens_per_minute, settings.rate_limit_utilization)
+                if requests_per_minute or tokens_per_minute:
+                    logging.info(f"Rate limit of {key}: {requests_per_minute} requests and {tokens_per_minute} tokens per minute")
+    return limiter
+
+def call_with_rate_limit(provider: str, deployment: str, tokens: int, func: Callable[[], Any],
+                         used_tokens: Optional[Callable[[Any], int]] = None) -> Any:
+    """
+    Calls func once the request fits the rate limit of the provider. Throttled (429) and
+    transient failures are retried up to RATE_LIMIT_MAX_RETRIES times, after the Retry-After
+    time or with exponential backoff, instead of failing the document.
+
+    used_tokens returns the tokens the provider counted for the response, for providers that
+    count actual usage rather than the tokens requested.
+    """
+    limiter = get_rate_limiter(provider, deployment)
+    for attempt in range(settings.rate_limit_max_retries + 1):
+        waited = limiter.acquire(tokens)
+        metrics.STAGE_SECONDS.labels(f"rate_limit_{provider}").observe(waited)
+        try:
+            result = func()
+        except Exception as e:
+            status, retry_after = _retry_info(e)
+            if status is None or attempt == settings.rate_limit_max_retries:
+                raise
+            delay = retry_after if retry_after is not None else DEFAULT_RETRY_SECONDS * 2 ** attempt
+            if status == 429:
+                # the quota is shared, so every request to this deployment waits
+                metrics.LLM_THROTTLED.labels(provider).inc()
+                limiter.pause(delay)
+                logging.warning(f"{provider} throttled the request, retrying in {delay:.1f} seconds (attempt {attempt + 1})")
+            else:
+                logging.warning(f"{provider} request failed ({status}), retrying in {delay:.1f} seconds (attempt {attempt + 1}): {str(e)}")
+                time.sleep(delay)
+            continue
+        if used_tokens is not None:
+            limiter.settle(tokens, used_tokens(result))
+        return result
+
+def _retry_info(error: Exception) -> Tuple[Optional[Any], Optional[float]]:
+    """
+    Returns the status of a retryable error (429, 408, 409, 5xx or "connection") and the
+    Retry-After seconds of its response, or None when the error is not retryable.
+    """
+    status = getattr(error, "status_code", None)
+    if status is None and ("Connection" in type(error).__name__ or "Timeout" in type(error).__name__):
+        return "connection", None
+    if not isinstance(status, int) or not (status in (408, 409, 429) or status >= 500):
+        return None, None
+
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    return status, _retry_after_seconds(headers)
+
+def _retry_after_seconds(headers) -> Optional[float]:
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        retry_after = headers.get("retry-after")
+        if retry_after:
+            if re.fullmatch(r"\d+(\.\d+)?", retry_after.strip()):
+                return float(retry_after)
+            return max(parsedate_to_datetime(retry_after).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+    return None
@@ -0,0 +1,172 @@
+from .base_extractor import BaseExtractor
+from .template_compiler import compile_template
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, Dict, List, Optional
+from pydantic import BaseModel
+import logging
+import threading
+import time
+import clients
+import metrics
+from config import settings
+from tokens import estimate_tokens, token_budget
+
+# requests a provider needs before its error rate can mark it unhealthy
+ROUTER_MIN_REQUESTS = 5
+
+class ProviderStats:
+    """
+    Rolling latency and error rate of one extractor over its last window requests.
+
+    A provider whose error rate reaches error_threshold (over at least min_requests requests)
+    is skipped for cooldown_seconds; after that it gets requests again, and is skipped again
+    right away when they keep failing.
+    """
+    def __init__(self, window: int, min_requests: int, error_threshold: float, cooldown_seconds: float):
+        self.min_requests = min_requests
+        self.error_threshold = error_threshold
+        self.cooldown_seconds = cooldown_seconds
+        self._samples = deque(maxlen=window)
+        self._unhealthy_until = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, latency: float, success: bool):
+        with self._lock:
+            self._samples.append((latency, success))
+            if len(self._samples) >= self.min_requests and _error_rate(self._samples) >= self.error_threshold:
+                self._unhealthy_until = time.monotonic() + self.cooldown_seconds
+                # start over after the cooldown, so old failures do not keep it out
+                self._samples.clear()
+
+    def healthy(self) -> bool:
+        return time.monotonic() >= self._unhealthy_until
+
+    def error_rate(self) -> float:
+        with self._lock:
+            samples = list(self._samples)
+        return _error_rate(samples)
+
+    def latency(self, quantile: float) -> Optional[float]:
+        # the samples are copied under the lock, as other threads record while routes are ranked
+        with self._lock:
+            samples = list(self._samples)
+        latencies = sorted(latency for latency, success in samples if success)
+        if not latencies:
+            return None
+        return latencies[min(int(quantile * len(latencies)), len(latencies) - 1)]
+
+def _error_rate(samples) -> float:
+    if not samples:
+        return 0.0
+    return sum(1 for _, success in samples if not success) / len(samples)
+
+class RouterExtractor(BaseExtractor):
+    """
+    Sends every document to the fastest healthy extractor, and to the next one when it fails.
+
+    Providers are ranked by their median latency over recent requests; providers without
+    recent requests come first so they get measured. With hedging, a second request goes to
+    the next provider when the first has not answered within its p95 latency (at least
+    hedge_min_ms), and the first valid result wins. A result is valid when it validates against
+    the template model, so all providers return the same model.
+    """
+    def __init__(self, extractors: Dict[str, BaseExtractor], hedge: bool, hedge_quantile: float, hedge_min_ms: int,
+                 window: int, error_threshold: float, cooldown_seconds: float):
+        self.extractors = extractors
+        self.hedge = hedge
+        self.hedge_quantile = hedge_quantile
+        self.hedge_min_ms = hedge_min_ms
+        self.stats = {name: ProviderStats(window, ROUTER_MIN_REQUESTS, error_threshold, cooldown_seconds) for name in extractors}
+        # requests keep running after a hedge was won, so they get their own threads; registered
+        # as a client, so the pool is shut down with the other clients
+        self.pool = clients.get_client("router_pool", lambda: ThreadPoolExecutor(
+            max_workers=settings.executor_workers * len(extractors), thread_name_prefix="router"
+        ))
+
+    def extract(self, template_content: Dict[str, str], input_string: str, template_name: str = None) -> Dict[str, Any]:
+        providers = self._rank(input_string)
+        pending: Dict[Future, str] = {}
+
+        while providers or pending:
+            if providers and (not pending or self.hedge):
+                name = providers.pop(0)
+                if pending:
+                    metrics.ROUTER_HEDGES.labels(name).inc()
+                    logging.info(f"Hedging extraction with {name}.")
+                pending[self.pool.submit(self._call, name, template_content, input_string, template_name)] = name
+
+            # without a hedge, wait for the request to finish; with one, only until the next hedge is due
+            timeout = self._hedge_delay(pending.values()) if self.hedge and providers else None
+            done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            for future in done:
+                pending.pop(future)
+                result = future.result()
+                if result is not None:
+                    return result
+
+        logging.error("No extractor returned a valid result.")
+        return None
+
+    def extract_many(self, template_content: Dict[str, str], input_strings: List[str], template_name: str = None) -> List[Dict[str, Any]]:
+        # batches are not hedged, as a batch takes long anyway; they go to the next provider when all documents fail
+        for name in self._rank(max(input_strings, key=len)):
+            start = time.perf_counter()
+            try:
+                results = self.extractors[name].extract_many(template_content, input_strings, template_name)
+                results = [self._validate(result, template_content, template_name) for result in results]
+            except Exception as e:
+                logging.error(f"Batched extraction with {name} failed: {str(e)}")
+                results = [None] * len(input_strings)
+            success = any(result is not None for result in results)
+            self._record(name, time.perf_counter() - start, success)
+            if success:
+                return results
+        return [None] * len(input_strings)
+
+    def _rank(self, input_string: str) -> List[str]:
+        names = list(self.extractors)
+        if settings.extraction_chunk_tokens <= 0:
+            # documents over the budget of a provider would fail there
+            tokens = estimate_tokens(input_string)
+            fitting = [name for name in names if token_budget(name) <= 0 or tokens <= token_budget(name)]
+            names = fitting or names
+
+        healthy = [name for name in names if self.stats[name].healthy()]
+        if not healthy:
+            logging.warning("All extractors are unhealthy, trying them anyway.")
+            healthy = names
+        # untried providers first, then by median latency; the configured order breaks ties
+        return sorted(healthy, key=lambda name: self.stats[name].latency(0.5) or 0.0)
+
+    def _hedge_delay(self, names) -> float:
+        latencies = [self.stats[name].latency(self.hedge_quantile) for name in names]
+        delay = max((latency for latency in latencies if latency is not None), default=0.0)
+        return max(delay, self.hedge_min_ms / 1000)
+
+    def _call(self, name: str, template_content: Dict[str, str], input_string: str, template_name: str) -> Any:
+        start = time.perf_counter()
+        try:
+            result = self._validate(self.extractors[name].extract(template_content, input_string, template_name), template_content, template_name)
+        except Exception as e:
+            logging.error(f"Extraction with {name} failed: {str(e)}")
+            result = None
+        self._record(name, time.perf_counter() - start, result is not None)
+        return result
+
+    def _record(self, name: str, latency: float, success: bool):
+        self.stats[name].record(latency, success)
+        metrics.ROUTER_REQUESTS.labels(name, "success" if success else "failure").inc()
+        metrics.STAGE_SECONDS.labels(f"extract_{name}").observe(latency)
+
+    @staticmethod
+    def _validate(result: Any, template_content: Dict[str, str], template_name: str) -> Optional[BaseModel]:
+        if not result:
+            return None
+        if isinstance(result, BaseModel):
+            return result
+        try:
+            return compile_template(template_content, template_name).model.model_validate(result)
+        except Exception as e:
+            logging.error(f"Extracted details do not match the template: {str(e)}")
+            return None
@@ -0,0 +1,473 @@
+from .base_extractor import BaseExtractor
+from .template_compiler import compile_template
+from calendar import month_abbr, month_name
+from datetime import datetime
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Tuple
+from pydantic import BaseModel, ValidationError
+import hashlib
+import json
+import logging
+import os
+import re
+import tempfile
+import threading
+import time
+import metrics
+
+DATE_FORMATS = ["%Y-%m-%d", "%d/%m/%Y", "%m/%d/%Y", "%d.%m.%Y", "%d-%m-%Y", "%d %B %Y", "%B %d, %Y", "%d %b %Y", "%b %d, %Y"]
+ISO_DATE = re.compile(r"^\d{4}-\d{2}-\d{2}$")
+NUMBER_PATTERN = r"-?\d(?:[\d.,']*\d)?"
+ROW_TEXT_PATTERN = r".+?"
+# a value must not be part of a longer word or number
+VALUE_START = r"(?<![\w])(?<!\d[.,])"
+VALUE_END = r"(?![\w])(?![.,]\d)"
+MAX_ANCHOR_WORDS = 3
+MAX_LABEL_CHARS = 40
+MAX_LINES_BELOW_LABEL = 2
+MAX_START_LINES = 8
+MAX_RULES_PER_FIELD = 64
+# lines at the top of a document, usually the supplier's name and address, that tell layouts apart
+LAYOUT_LINES = 3
+MONTH_NAMES = {name.lower() for name in list(month_name) + list(month_abbr) if name}
+
+class TemplateRules:
+    """
+    Rules learned for one template version, from documents the fallback extractor handled.
+
+    fields: candidate rules per field path (like invoice.invoiceNumber). A candidate finds the
+    value after a label on the same line (line), on a line below a label line (above) or on a
+    line counted from the start of the document (start), and matches it with a pattern; lead
+    matches what comes before the value on a line found by position, and trail what follows it.
+    rows: line patterns per list of objects (like invoice.items); every matching line is an item.
+
+    A candidate is learned from every document in which it finds the value the fallback
+    extractor returned; it is used once it was learned from min_hits documents, so labels and
+    positions that differ between documents never become rules.
+    """
+    def __init__(self, data: Dict[str, Any] = None):
+        data = data or {}
+        self.fields: Dict[str, Dict[str, Dict[str, Any]]] = {
+            path: {_rule_key(rule): rule for rule in rules} for path, rules in data.get("fields", {}).items()
+        }
+        self.rows: Dict[str, Dict[str, Dict[str, Any]]] = {
+            path: {rule["pattern"]: rule for rule in rules} for path, rules in data.get("rows", {}).items()
+        }
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "fields": {path: list(rules.values()) for path, rules in self.fields.items()},
+            "rows": {path: list(rules.values()) for path, rules in self.rows.items()},
+        }
+
+class RuleExtractor(BaseExtractor):
+    """
+    Extracts documents with learned regex and anchor rules, and hands them to the fallback
+    extractor when a required field is missing or the result does not validate against the
+    template model. Results of the fallback extractor are used to learn the rules, so documents
+    of suppliers with a stable layout stop needing an LLM call after min_hits of them.
+
+    Rules are kept per template version and layout, the words of the first lines of a document,
+    so the rules of one supplier are never applied to another one. They are saved as JSON in
+    rules_dir, where they can also be reviewed or written by hand. Matching and learning run
+    outside the lock, which only guards reading and updating the rules.
+    """
+    def __init__(self, fallback: BaseExtractor, rules_dir: str, min_hits: int = 2, save_seconds: float = 5):
+        self.fallback = fallback
+        self.rules_dir = rules_dir
+        self.min_hits = min_hits
+        self.save_seconds = save_seconds
+        self._rules: Dict[str, TemplateRules] = {}
+        self._saved_at: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def extract(self, template_content: Dict[str, str], input_string: str, template_name: str = None) -> Dict[str, Any]:
+        key = _rules_file_key(template_content, template_name, input_string)
+        result = self._apply(key, template_content, input_string, template_name)
+        if result is not None:
+            metrics.RULE_EXTRACTIONS.labels("rules").inc()
+            return result
+
+        metrics.RULE_EXTRACTIONS.labels("fallback").inc()
+        result = self.fallback.extract(template_content, input_string, template_name)
+        if result:
+            self._learn(key, input_string, result)
+        return result
+
+    def extract_many(self, template_content: Dict[str, str], input_strings: List[str], template_name: str = None) -> List[Dict[str, Any]]:
+        keys = [_rules_file_key(template_content, template_name, input_string) for input_string in input_strings]
+        results = [self._apply(key, template_content, input_string, template_name) for key, input_string in zip(keys, input_strings)]
+        missing = [index for index, result in enumerate(results) if result is None]
+        metrics.RULE_EXTRACTIONS.labels("rules").inc(len(results) - len(missing))
+        if not missing:
+            return results
+
+        metrics.RULE_EXTRACTIONS.labels("fallback").inc(len(missing))
+        fallback_results = self.fallback.extract_many(template_content, [input_strings[index] for index in missing], template_name)
+        for index, result in zip(missing, fallback_results):
+            results[index] = result
+            if result:
+                self._learn(keys[index], input_strings[index], result)
+        return results
+
+    def _apply(self, key: str, template_content: Optional[Dict[str, Any]], input_string: str, template_name: str) -> Optional[BaseModel]:
+        rules = self._get_rules(key)
+        if not input_string or (not rules.fields and not rules.rows):
+            return None
+
+        # the confirmed rules are copied under the lock and matched outside it
+        with self._lock:
+            fields = {path: _ranked(candidates.values(), self.min_hits) for path, candidates in rules.fields.items()}
+            rows = {path: _ranked(candidates.values(), self.min_hits) for path, candidates in rules.rows.items()}
+
+        lines = _lines(input_string)
+        values: Dict[str, Any] = {}
+        for path, ranked in fields.items():
+            for rule in ranked:
+                value = _find_value(rule, input_string, lines)
+                if value is not None:
+                    values[path] = value
+                    break
+        for path, ranked in rows.items():
+            items = _find_rows(ranked, lines)
+            if items:
+                values[path] = items
+
+        if not values:
+            return None
+        try:
+            return compile_template(template_content, template_name).model.model_validate(_unflatten(values))
+        except ValidationError as e:
+            logging.info(f"Rules found {len(values)} fields but the result is incomplete, using the fallback extractor: {e.error_count()} errors")
+            return None
+
+    def _learn(self, key: str, input_string: str, result: Any):
+        details = result.model_dump(mode="json") if isinstance(result, BaseModel) else result
+        if not isinstance(details, dict) or not input_string:
+            return
+
+        # the rules that find the values in this document are looked for outside the lock
+        lines = _lines(input_string)
+        found = [(path, isinstance(value, list), _row_rules(value, lines) if isinstance(value, list) else _field_rules(value, input_string, lines))
+                 for path, value in _flatten(details)]
+
+        rules = self._get_rules(key)
+        data = None
+        with self._lock:
+            confirmed = False
+            for path, is_rows, path_rules in found:
+                candidates = (rules.rows if is_rows else rules.fields).setdefault(path, {})
+                confirmed |= _count_hits(candidates, path_rules, self.min_hits)
+            if confirmed or time.monotonic() - self._saved_at.get(key, 0) >= self.save_seconds:
+                self._saved_at[key] = time.monotonic()
+                data = json.dumps(rules.to_dict(), indent=1)
+        if data is not None:
+            self._save(key, data)
+
+    def _get_rules(self, key: str) -> TemplateRules:
+        rules = self._rules.get(key)
+        if rules is None:
+            with self._lock:
+                rules = self._rules.get(key)
+                if rules is None:
+                    rules = self._rules[key] = TemplateRules(self._load(key))
+        return rules
+
+    def _load(self, key: str) -> Optional[Dict[str, Any]]:
+        path = os.path.join(self.rules_dir, f"{key}.json")
+        try:
+            with open(path, "r") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logging.error(f"An error occurred while loading rules from {path}: {str(e)}")
+            return None
+
+    def _save(self, key: str, data: str):
+        # written to a temporary file of its own first, so a crash or a concurrent save never
+        # leaves half a rules file
+        path = os.path.join(self.rules_dir, f"{key}.json")
+        try:
+            os.makedirs(self.rules_dir, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=self.rules_dir, suffix=".tmp")
+            try:
+                with os.fdopen(fd, "w") as f:
+                    f.write(data)
+                os.replace(tmp_path, path)
+            except BaseException:
+                os.remove(tmp_path)
+                raise
+        except Exception as e:
+            logging.error(f"An error occurred while saving rules to {path}: {str(e)}")
+
+def _rules_file_key(template_content: Optional[Dict[str, Any]], template_name: str, text: str) -> str:
+    # an edited template starts with new rules, as its fields may have changed
+    if template_content is None:
+        version = "static"
+    else:
+        version = hashlib.sha256(json.dumps(template_content, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+    return f"{re.sub(r'[^A-Za-z0-9_.-]', '_', template_name or 'template')}-{version}-{_layout(text)}"
+
+def _layout(text: str) -> str:
+    # the words of the first lines, without numbers and month names, which change between documents
+    words = []
+    for line in _lines(text or "")[:LAYOUT_LINES]:
+        words.extend(word for word in re.findall(r"[^\W\d_]+", line.lower()) if word not in MONTH_NAMES)
+    return hashlib.sha256(" ".join(words).encode("utf-8")).hexdigest()[:12]
+
+def _lines(text: str) -> List[str]:
+    return [line.strip() for line in text.split("\n") if line.strip()]
+
+def _ranked(rules, min_hits: int) -> List[Dict[str, Any]]:
+    # the rules learned from most documents first; more specific labels win ties
+    confirmed = [rule for rule in rules if rule["hits"] >= min_hits]
+    return sorted(confirmed, key=lambda rule: (-rule["hits"], -len(rule.get("anchor", rule.get("pattern", "")))))
+
+def _rule_key(rule: Dict[str, Any]) -> str:
+    return f"{rule['mode']}|{rule['anchor']}|{rule['offset']}|{rule.get('lead', '')}|{rule['kind']}|{rule['pattern']}|{rule.get('trail', '')}"
+
+def _flatten(details: Dict[str, Any], prefix: str = "") -> List[Tuple[str, Any]]:
+    # scalar fields and lists of objects, by dotted path
+    fields = []
+    for name, value in details.items():
+        path = f"{prefix}{name}"
+        if isinstance(value, dict):
+            fields.extend(_flatten(value, f"{path}."))
+        elif isinstance(value, list):
+            if value and all(isinstance(item, dict) for item in value):
+                fields.append((path, value))
+        elif value is not None and value != "" and not isinstance(value, bool):
+            fields.append((path, value))
+    return fields
+
+def _unflatten(values: Dict[str, Any]) -> Dict[str, Any]:
+    details: Dict[str, Any] = {}
+    for path, value in values.items():
+        target = details
+        *parents, name = path.split(".")
+        for parent in parents:
+            target = target.setdefault(parent, {})
+        target[name] = value
+    return details
+
+def _representations(value: Any) -> List[Tuple[str, str]]:
+    """
+    Returns the ways a value can be written in a document, with the kind that reads it back.
+    """
+    if isinstance(value, (int, float)):
+        texts = [f"{value:.2f}", f"{value:,.2f}", f"{value:.2f}".replace(".", ","), f"{value:,.2f}".replace(",", " ").replace(".", ",").replace(" ", ".")]
+        if float(value).is_integer():
+            texts.insert(0, str(int(value)))
+        kind = "int" if isinstance(value, int) else "number"
+        return [(text, kind) for text in dict.fromkeys(texts)]
+
+    text = str(value).strip()
+    representations = [(text, "text")]
+    if ISO_DATE.match(text):
+        try:
+            date = datetime.strptime(text, "%Y-%m-%d")
+            representations.extend((date.strftime(date_format), f"date:{date_format}") for date_format in DATE_FORMATS[1:])
+        except ValueError:
+            pass
+    return representations
+
+def _occurrences(line: str, text: str) -> List[int]:
+    return [match.start() for match in re.finditer(VALUE_START + re.escape(text) + VALUE_END, line)]
+
+def _value_pattern(text: str, kind: str, in_row: bool = False) -> str:
+    if kind in ("int", "number"):
+        return NUMBER_PATTERN
+    if kind.startswith("date:"):
+        return _date_pattern(kind[5:])
+    if in_row:
+        return ROW_TEXT_PATTERN
+    # the shape of the value: runs of letters, digits and spaces may differ in length
+    pattern = ""
+    for match in re.finditer(r"[^\W\d_]+|\d+|\s+|.", text):
+        token = match.group()
+        if token[0].isdigit():
+            pattern += r"\d+"
+        elif token[0].isspace():
+            pattern += r"\s+"
+        elif token[0].isalpha():
+            pattern += r"[^\W\d_]+"
+        else:
+            pattern += re.escape(token)
+    return pattern
+
+def _date_pattern(date_format: str) -> str:
+    pattern = re.escape(date_format)
+    for directive, replacement in (("%Y", r"\d{4}"), ("%m", r"\d{1,2}"), ("%d", r"\d{1,2}"), ("%B", r"[^\W\d_]+"), ("%b", r"[^\W\d_]+")):
+        pattern = pattern.replace(re.escape(directive), replacement).replace(directive, replacement)
+    return pattern
+
+def _convert(text: str, kind: str) -> Any:
+    if kind == "text":
+        return text
+    if kind.startswith("date:"):
+        return datetime.strptime(" ".join(text.split()), kind[5:]).date().isoformat()
+    number = _parse_number(text)
+    return int(number) if kind == "int" and number.is_integer() else number
+
+def _parse_number(text: str) -> float:
+    text = text.replace("'", "").replace(" ", "")
+    if "," in text and "." in text:
+        # the separator that comes last is the decimal separator
+        text = text.replace(".", "").replace(",", ".") if text.rfind(",") > text.rfind(".") else text.replace(",", "")
+    elif "," in text:
+        text = text.replace(",", ".") if re.search(r",\d{1,2}$", text) else text.replace(",", "")
+    elif re.fullmatch(r"-?\d{1,3}(\.\d{3})+", text):
+        text = text.replace(".", "")
+    return float(text)
+
+@lru_cache(maxsize=4096)
+def _compile(pattern: str) -> re.Pattern:
+    return re.compile(pattern)
+
+def _find_value(rule: Dict[str, Any], text: str, lines: List[str]) -> Any:
+    # the rest of the line must look like it did when the rule was learned
+    value_pattern = f"(?P<value>{rule['pattern']}){VALUE_END}{rule.get('trail', '')}$"
+    try:
+        if rule["mode"] == "line":
+            anchor = r"[ \t]+".join(re.escape(word) for word in rule["anchor"].split())
+            match = _compile(rf"(?m)(?:^|(?<=\s)){anchor}[ \t]*{value_pattern}").search(text)
+            return _convert(match.group("value"), rule["kind"]) if match else None
+
+        if rule["mode"] == "above":
+            targets = [index + rule["offset"] for index, line in enumerate(lines) if line == rule["anchor"]]
+        else:
+            targets = [rule["offset"]]
+        for target in targets:
+            if target < len(lines):
+                match = _compile(f"^{rule.get('lead', '')}{value_pattern}").match(lines[target])
+                if match:
+                    return _convert(match.group("value"), rule["kind"])
+    except (ValueError, re.error):
+        return None
+    return None
+
+def _count_hits(candidates: Dict[str, Dict[str, Any]], found: Dict[str, Dict[str, Any]], min_hits: int) -> bool:
+    """
+    Counts a hit for every rule found in a document. Returns whether a rule got confirmed.
+    """
+    confirmed = False
+    for key, rule in found.items():
+        existing = candidates.setdefault(key, rule)
+        existing["hits"] += 1
+        confirmed |= existing["hits"] == min_hits
+    _prune(candidates)
+    return confirmed
+
+def _field_rules(value: Any, text: str, lines: List[str]) -> Dict[str, Dict[str, Any]]:
+    """
+    Returns every rule that finds value in this document, by rule key.
+    """
+    found: Dict[str, Dict[str, Any]] = {}
+    for representation, kind in _representations(value):
+        pattern = _value_pattern(representation, kind)
+        for index, line in enumerate(lines):
+            for start in _occurrences(line, representation):
+                trail = _gap_pattern(line[start + len(representation):], r"[ \t]+")
+                rules = []
+                words = line[:start].split()
+                for count in range(1, min(MAX_ANCHOR_WORDS, len(words)) + 1):
+                    anchor = " ".join(words[-count:])
+                    if re.search(r"[^\W\d_]", anchor):
+                        rules.append({"mode": "line", "anchor": anchor, "offset": 0, "trail": trail})
+                # by position, the value may follow other text on its line, like a postal code
+                lead = _gap_pattern(line[:start])
+                for offset in range(1, min(MAX_LINES_BELOW_LABEL, index) + 1):
+                    label = lines[index - offset]
+                    if len(label) <= MAX_LABEL_CHARS and re.search(r"[^\W\d_]", label):
+                        rules.append({"mode": "above", "anchor": label, "offset": offset, "lead": lead, "trail": trail})
+                if index < MAX_START_LINES:
+                    rules.append({"mode": "start", "anchor": "", "offset": index, "lead": lead, "trail": trail})
+                for rule in rules:
+                    rule.update(kind=kind, pattern=pattern, hits=0)
+                    # only rules that read back exactly this value count
+                    if _find_value(rule, text, lines) == _convert(representation, kind):
+                        found[_rule_key(rule)] = rule
+    return found
+
+def _row_rules(items: List[Dict[str, Any]], lines: List[str]) -> Dict[str, Dict[str, Any]]:
+    """
+    Returns the line patterns, by pattern, learned from the lines that hold all fields of an
+    item. A pattern counts when it finds exactly the items of this document, in the same order.
+    """
+    expected = [_canonical({name: value for name, value in item.items() if not isinstance(value, (dict, list))}) for item in items]
+    patterns = {}
+    for item in items:
+        for line in lines:
+            rule = _row_rule(item, line)
+            if rule is not None:
+                patterns.setdefault(rule["pattern"], rule)
+                break
+
+    return {pattern: rule for pattern, rule in patterns.items() if [_canonical(found) for found in _find_rows([rule], lines)] == expected}
+
+def _row_rule(item: Dict[str, Any], line: str) -> Optional[Dict[str, Any]]:
+    fields = [(name, value) for name, value in item.items() if not isinstance(value, (dict, list)) and value is not None and not isinstance(value, bool)]
+    # long values first, so a short number is not taken from inside a description
+    fields.sort(key=lambda field: -len(str(field[1])))
+    picks = []
+    for name, value in fields:
+        pick = None
+        for representation, kind in _representations(value):
+            for start in _occurrences(line, representation):
+                end = start + len(representation)
+                if all(end <= other_start or start >= other_end for _, _, other_start, other_end in picks):
+                    pick = (name, kind, start, end)
+                    break
+            if pick:
+                break
+        if pick is None:
+            return None
+        picks.append(pick)
+
+    picks.sort(key=lambda pick: pick[2])
+    pattern = "^"
+    groups = {}
+    position = 0
+    for index, (name, kind, start, end) in enumerate(picks):
+        pattern += _gap_pattern(line[position:start])
+        pattern += f"(?P<g{index}>{_value_pattern(line[start:end], kind, in_row=True)})"
+        groups[f"g{index}"] = [name, kind]
+        position = end
+    pattern += _gap_pattern(line[position:]) + "$"
+    return {"pattern": pattern, "groups": groups, "hits": 0}
+
+def _gap_pattern(gap: str, space: str = r"\s+") -> str:
+    # text around the values: spacing and numbers may vary, words are kept
+    pattern = ""
+    for match in re.finditer(r"\s+|\d+|[^\s\d]+", gap):
+        token = match.group()
+        if token[0].isspace():
+            pattern += space
+        elif token[0].isdigit():
+            pattern += r"\d+"
+        else:
+            pattern += re.escape(token)
+    return pattern
+
+def _find_rows(rules: List[Dict[str, Any]], lines: List[str]) -> List[Dict[str, Any]]:
+    items = []
+    for line in lines:
+        for rule in rules:
+            match = _compile(rule["pattern"]).match(line)
+            if match:
+                try:
+                    items.append({name: _convert(match.group(group), kind) for group, (name, kind) in rule["groups"].items()})
+                except ValueError:
+                    continue
+                break
+    return items
+
+def _prune(candidates: Dict[str, Dict[str, Any]]):
+    # keeps the rules learned from most documents
+    if len(candidates) > MAX_RULES_PER_FIELD:
+        for key, _ in sorted(candidates.items(), key=lambda entry: entry[1]["hits"])[:len(candidates) - MAX_RULES_PER_FIELD]:
+            del candidates[key]
+
+def _canonical(value: Any) -> str:
+    return json.dumps(value, sort_keys=True, default=str)
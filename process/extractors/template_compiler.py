@@ -0,0 +1,175 @@
+import datetime
+import hashlib
+import json
+import re
+import threading
+from collections import OrderedDict
+from typing import Annotated, Any, Dict, List, Optional, Type
+from pydantic import BaseModel, WithJsonSchema, create_model
+from config import settings
+from .models.static_invoice import Model
+
+# static models that do not need a template in the KV store
+MODEL_REGISTRY = {
+    'static_invoice': Model,
+    # Add other models here as needed
+}
+
+# structured outputs do not accept the "format" keyword, so dates are described instead
+Date = Annotated[datetime.date, WithJsonSchema({"type": "string", "description": "date in YYYY-MM-DD format"})]
+DateTime = Annotated[datetime.datetime, WithJsonSchema({"type": "string", "description": "date and time in ISO 8601 format"})]
+
+TYPE_MAPPING = {
+    'str': str,
+    'string': str,
+    'float': float,
+    'number': float,
+    'int': int,
+    'integer': int,
+    'bool': bool,
+    'boolean': bool,
+    'date': Date,
+    'datetime': DateTime,
+}
+
+LIST_TYPE = re.compile(r'^list\[(.+)\]$', re.IGNORECASE)
+
+class CompiledTemplate:
+    """
+    Everything the extractors derive from a template, built once and shared by all documents.
+
+    model: Pydantic model used to validate results
+    response_format: strict JSON schema for OpenAI structured outputs
+    field_prompt: field list used in the Groq system prompt
+    json_template: JSON example used in the Ollama system prompt
+    """
+    def __init__(self, template_name: str, model: Type[BaseModel], template_content: Optional[Dict[str, Any]]):
+        self.template_name = template_name
+        self.model = model
+        self.response_format = _response_format(model)
+        self.json_schema = self.response_format["json_schema"]["schema"]
+
+        self.batch_model = create_model(f"{model.__name__}Batch", documents=(List[model], ...))
+        self.batch_response_format = _response_format(self.batch_model)
+
+        # static models have no template content; their prompts are rendered from the JSON schema
+        description = template_content if template_content is not None else _describe_schema(model.model_json_schema())
+        self.field_prompt = _render_field_prompt(description)
+        self.json_template = json.dumps(_render_json_template(description))
+
+_cache: OrderedDict = OrderedDict()
+_lock = threading.Lock()
+
+def compile_template(template_content: Optional[Dict[str, Any]], template_name: str = None) -> CompiledTemplate:
+    """
+    Returns the compiled template for a static model (see MODEL_REGISTRY) or for the content of a KV template.
+
+    Compiled templates are kept in a bounded LRU cache keyed by template name and content hash,
+    so an edited template gets a new entry.
+    """
+    static_model = MODEL_REGISTRY.get(template_name) if template_name else None
+    if static_model is None and template_content is None:
+        raise ValueError(f"Template content is required for template: {template_name}")
+
+    if static_model is not None:
+        content_hash = "static"
+    else:
+        content_hash = hashlib.sha256(json.dumps(template_content, sort_keys=True).encode("utf-8")).hexdigest()
+    key = (template_name, content_hash)
+
+    with _lock:
+        compiled = _cache.get(key)
+        if compiled is not None:
+            _cache.move_to_end(key)
+            return compiled
+
+    model = static_model if static_model is not None else build_model('DynamicModel', template_content)
+    compiled = CompiledTemplate(template_name, model, template_content if static_model is None else None)
+
+    with _lock:
+        _cache[key] = compiled
+        _cache.move_to_end(key)
+        while len(_cache) > settings.template_compile_cache_size:
+            _cache.popitem(last=False)
+    return compiled
+
+def build_model(model_name: str, template_content: Dict[str, Any]) -> Type[BaseModel]:
+    """
+    Builds a Pydantic model from template content.
+
+    Values are type names (str, float, int, bool, date, datetime), list[<type>],
+    a nested template (dict) or a list holding one nested template.
+    """
+    fields = {
+        key: (_resolve_type(f"{model_name}_{key}", value), ...) for key, value in template_content.items()
+    }
+    return create_model(model_name, **fields)
+
+def _resolve_type(model_name: str, value: Any):
+    if isinstance(value, dict):
+        return build_model(model_name, value)
+
+    if isinstance(value, list):
+        if len(value) != 1:
+            raise ValueError(f"List fields must hold exactly one item type: {model_name}")
+        return List[_resolve_type(model_name, value[0])]
+
+    if isinstance(value, str):
+        type_name = value.strip()
+        match = LIST_TYPE.match(type_name)
+        if match:
+            return List[_resolve_type(model_name, match.group(1).strip())]
+        if type_name.lower() in TYPE_MAPPING:
+            return TYPE_MAPPING[type_name.lower()]
+
+    raise ValueError(f"Unsupported template field type for {model_name}: {value!r}")
+
+def _response_format(model: Type[BaseModel]) -> Dict[str, Any]:
+    # structured outputs need a strict schema: every object closed and every property required
+    return {
+        "type": "json_schema",
+        "json_schema": {"name": model.__name__, "schema": _strict_schema(model.model_json_schema()), "strict": True}
+    }
+
+def _strict_schema(schema: Any) -> Any:
+    if isinstance(schema, list):
+        return [_strict_schema(item) for item in schema]
+    if not isinstance(schema, dict):
+        return schema
+    schema = {key: _strict_schema(value) if key not in ("properties", "$defs") else value for key, value in schema.items()}
+    for key in ("properties", "$defs"):
+        if key in schema:
+            schema[key] = {name: _strict_schema(value) for name, value in schema[key].items()}
+    # defaults are not accepted in strict mode; a field with a default is still required
+    schema.pop("default", None)
+    if schema.get("type") == "object":
+        schema["additionalProperties"] = False
+        schema["required"] = list(schema.get("properties", {}))
+    # a $ref with sibling keywords is not accepted, so the referenced definition is used as is
+    if "$ref" in schema and len(schema) > 1:
+        schema = {"$ref": schema["$ref"]}
+    return schema
+
+def _describe_schema(schema: Dict[str, Any], root: Dict[str, Any] = None) -> Any:
+    # turns a JSON schema back into template notation so static models share the prompt rendering
+    root = root or schema
+    if "$ref" in schema:
+        schema = root["$defs"][schema["$ref"].split("/")[-1]]
+    if schema.get("type") == "object":
+        return {key: _describe_schema(value, root) for key, value in schema.get("properties", {}).items()}
+    if schema.get("type") == "array":
+        return [_describe_schema(schema.get("items", {}), root)]
+    return {"number": "float", "integer": "int", "boolean": "bool"}.get(schema.get("type"), "str")
+
+def _render_field_prompt(description: Dict[str, Any]) -> str:
+    prompt = "Extract the following fields from a given invoice. Return the fields in JSON format:\n"
+    for field, field_type in description.items():
+        prompt += f"- {field} ({json.dumps(field_type) if not isinstance(field_type, str) else field_type})\n"
+    return prompt.strip()
+
+def _render_json_template(value: Any) -> Any:
+    if isinstance(value, dict):
+        return {key: _render_json_template(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_render_json_template(item) for item in value]
+    return f"a {value} value"
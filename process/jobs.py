@@ -0,0 +1,88 @@
+import asyncio
+import logging
+import time
+from typing import Any, Dict, Optional
+from common.jobs import JobStore
+
+class JobTracker:
+    """
+    Keeps the job record of one document up to date while it is processed.
+
+    start() marks the job as processing, stage() records when every pipeline stage starts and
+    finishes, and finish() marks the job as succeeded or failed. Stage updates are written in
+    the background; while a write is in progress, the next one waits and writes the latest
+    state, so a document never waits for the job store between its stages. Job store errors are
+    logged and never fail the document.
+    """
+    def __init__(self, store: JobStore, job_id: str):
+        self.store = store
+        self.job_id = job_id
+        self.record: Dict[str, Any] = {}
+        self._dirty = False
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self, template_name: str):
+        now = time.time()
+        try:
+            record = await self.store.get(self.job_id)
+        except Exception as e:
+            logging.error(f"An error occurred while reading job {self.job_id}: {str(e)}")
+            record = None
+        # documents queued without a job record get one when their processing starts
+        self.record = record or {"id": self.job_id, "template_name": template_name, "status": None, "created_at": now, "attempts": 0}
+        previous_status = self.record.get("status")
+        self.record.update({
+            "status": "processing",
+            "started_at": now,
+            "finished_at": None,
+            "attempts": self.record.get("attempts", 0) + 1,
+            "stage": None,
+            "stages": {},
+            "error": None,
+            "updated_at": now
+        })
+        # the first start ends the time the document waited in the queue; redeliveries keep it
+        self.record.setdefault("first_started_at", now)
+        await self._write(previous_status)
+
+    def stage(self, name: str, finished: bool):
+        now = time.time()
+        stage = self.record.setdefault("stages", {}).setdefault(name, {})
+        if finished:
+            stage["finished_at"] = now
+        else:
+            stage["started_at"] = now
+            self.record["stage"] = name
+        self.record["updated_at"] = now
+        self._dirty = True
+        if self._task is None:
+            self._task = asyncio.create_task(self._write_stages())
+
+    async def finish(self, error: Optional[str] = None):
+        if self._task is not None:
+            await self._task
+        now = time.time()
+        self.record.update({
+            "status": "failed" if error else "succeeded",
+            "stage": None,
+            "finished_at": now,
+            "error": error,
+            "updated_at": now
+        })
+        await self._write("processing")
+
+    async def _write_stages(self):
+        while self._dirty:
+            self._dirty = False
+            try:
+                await self.store.save(dict(self.record))
+            except Exception as e:
+                logging.error(f"An error occurred while updating job {self.job_id}: {str(e)}")
+        self._task = None
+
+    async def _write(self, previous_status: Optional[str]):
+        try:
+            await self.store.save(dict(self.record))
+            await self.store.move(self.job_id, previous_status, self.record["status"], self.record["updated_at"])
+        except Exception as e:
+            logging.error(f"An error occurred while updating job {self.job_id}: {str(e)}")
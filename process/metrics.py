@@ -0,0 +1,40 @@
+import os
+from fastapi import Response
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Histogram, generate_latest, multiprocess
+
+# Prometheus metrics of the process service, exposed at /metrics
+# stage durations are observed by timing.stage(), the counters where the work happens
+
+STAGE_SECONDS = Histogram(
+    "docproc_stage_duration_seconds", "Time spent in a pipeline stage", ["stage"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+)
+DOCUMENTS = Counter("docproc_documents_total", "Documents processed", ["status"])
+BYTES = Counter("docproc_bytes_total", "Bytes transferred to or from blob storage", ["direction"])
+PAGES = Counter("docproc_pages_total", "Pages cracked", ["cracker"])
+CRACKER_FALLBACKS = Counter("docproc_cracker_fallbacks_total", "Documents handed to a fallback cracker", ["cracker", "reason"])
+TOKENS = Counter("docproc_llm_tokens_total", "LLM tokens sent and received", ["extractor", "direction"])
+OUTPUT_ITEMS = Counter("docproc_output_items_total", "Items handed to output handlers", ["handler", "status"])
+PREPROCESS_TOKENS = Counter("docproc_preprocess_tokens_total", "Estimated prompt tokens before and after pre-processing", ["extractor", "stage"])
+PREPROCESS_TRUNCATIONS = Counter("docproc_preprocess_truncations_total", "Documents truncated to the token budget", ["extractor"])
+RULE_EXTRACTIONS = Counter("docproc_rule_extractions_total", "Documents extracted by learned rules or by the fallback extractor", ["method"])
+ROUTER_REQUESTS = Counter("docproc_router_requests_total", "Extraction requests sent by the router", ["extractor", "result"])
+ROUTER_HEDGES = Counter("docproc_router_hedges_total", "Hedged extraction requests sent by the router", ["extractor"])
+LLM_THROTTLED = Counter("docproc_llm_throttled_total", "LLM requests rejected with 429 and retried", ["extractor"])
+CACHE_REQUESTS = Counter("docproc_cache_requests_total", "Cache lookups", ["cache", "result"])
+CACHE_EVICTIONS = Counter("docproc_cache_evictions_total", "Cache entries evicted to stay within the size limit", ["cache"])
+
+def record_tokens(extractor: str, tokens_in: int, tokens_out: int):
+    TOKENS.labels(extractor, "in").inc(tokens_in or 0)
+    TOKENS.labels(extractor, "out").inc(tokens_out or 0)
+
+def record_cache(cache: str, hit: bool):
+    CACHE_REQUESTS.labels(cache, "hit" if hit else "miss").inc()
+
+def metrics_response() -> Response:
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        # with several uvicorn workers, report the sum of all workers instead of the one that answers
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return Response(content=generate_latest(registry), media_type=CONTENT_TYPE_LATEST)
+    return Response(content=generate_latest(), media_type=CONTENT_TYPE_LATEST)
@@ -1,8 +1,66 @@
 from abc import ABC, abstractmethod
-from typing import Dict, Any, Union
+from typing import Dict, Any, List, Union
+import hashlib
+import re
 from pydantic import BaseModel
 
+UNSAFE_PATH_CHARACTERS = re.compile(r"[^A-Za-z0-9._-]")
+
+def safe_path_component(value: str) -> str:
+    """
+    Returns a value, like a template name, that file output handlers can use as a directory or
+    file name: characters other than letters, digits, '.', '_' and '-' are replaced, and a hash of
+    the original is added when anything changed, so different names never share a path.
+    """
+    safe = UNSAFE_PATH_CHARACTERS.sub("_", value)
+    if safe == value and safe not in ("", ".", ".."):
+        return safe
+    return f"{safe.strip('.') or '_'}-{hashlib.sha256(value.encode('utf-8')).hexdigest()[:8]}"
+
+class OutputItem:
+    """
+    The extracted details of one document, as handed to output handlers by the dispatcher.
+    """
+    def __init__(self, blob_name: str, template_name: str, invoice_details: Union[Dict[str, Any], BaseModel]):
+        self.blob_name = blob_name
+        self.template_name = template_name
+        self.invoice_details = invoice_details
+
+    def details_dict(self) -> Dict[str, Any]:
+        if isinstance(self.invoice_details, BaseModel):
+            return self.invoice_details.model_dump(mode="json")
+        return self.invoice_details
+
 class BaseOutputHandler(ABC):
+    # handlers that send over the network set batched, so the dispatcher queues their items
+    # and hands them over with handle_batch in groups of at most max_batch_size
+    batched = False
+    max_batch_size = 100
+    # handlers that show documents while they are extracted set partials, so they get the
+    # fields of streamed extractions through handle_partial before the result
+    partials = False
+
     @abstractmethod
     def handle_output(self, blob_name: str, invoice_details: Union[Dict[str, Any], BaseModel]):
-        pass
\ No newline at end of file
+        pass
+
+    def handle_batch(self, items: List[OutputItem]):
+        """
+        Handles many items at once; raises when the items could not be handled, so the
+        dispatcher can retry them. By default every item goes through handle_output.
+        """
+        for item in items:
+            self.handle_output(item.blob_name, item.invoice_details)
+
+    def handle_partial(self, blob_name: str, template_name: str, fields: Dict[str, Any]):
+        """
+        Handles top-level fields of a document that is still being extracted; the values are
+        not validated yet. Partial fields are best-effort: they are not retried.
+        """
+        pass
+
+    def close(self):
+        """
+        Releases what the handler holds, like buffered writers; called on shutdown.
+        """
+        pass
@@ -0,0 +1,153 @@
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from contextlib import contextmanager
+from typing import List, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows; only a single worker can safely share a file there
+    fcntl = None
+
+class BufferedFileWriter:
+    """
+    Appends lines to a file through a single writer thread with group commit.
+
+    Lines from all callers are collected until flush_records lines are waiting or the oldest
+    has waited flush_ms, then appended with one write. write() returns once its lines are on
+    disk (after fsync when enabled) and raises when the write failed.
+
+    Every commit holds an exclusive lock on <path>.lock, so uvicorn workers that share the
+    file never interleave their lines. The file is rotated to <name>-<UTC timestamp><ext>
+    when it reaches rotate_bytes, or when its last write was in an earlier rotate_seconds
+    window; 0 disables either check. header is written at the start of every new file.
+    """
+    def __init__(self, path: str, header: str = None, flush_records: int = 100, flush_ms: int = 50,
+                 fsync: bool = False, rotate_bytes: int = 0, rotate_seconds: int = 0):
+        self.path = path
+        self.header = header
+        self.flush_records = flush_records
+        self.flush_ms = flush_ms
+        self.fsync = fsync
+        self.rotate_bytes = rotate_bytes
+        self.rotate_seconds = rotate_seconds
+        self._queue: queue.Queue = queue.Queue()
+        self._lock_fd: Optional[int] = None
+        # write() and close() hold this lock, so no lines are queued behind the stop marker
+        self._closed = False
+        self._close_lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name=f"writer-{os.path.basename(path)}", daemon=True)
+        self._thread.start()
+
+    def write(self, lines: List[str]):
+        future = Future()
+        with self._close_lock:
+            if self._closed:
+                raise RuntimeError(f"The writer of {self.path} is closed")
+            self._queue.put((lines, future))
+        future.result()
+
+    def close(self):
+        """
+        Commits the lines that are still waiting and stops the writer thread; later writes raise.
+        """
+        with self._close_lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._queue.put(None)
+        self._thread.join()
+        if self._lock_fd is not None:
+            os.close(self._lock_fd)
+            self._lock_fd = None
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            entry = self._queue.get()
+            if entry is None:
+                return
+
+            group = [entry]
+            records = len(entry[0])
+            deadline = time.monotonic() + self.flush_ms / 1000
+            while records < self.flush_records:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    entry = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if entry is None:
+                    stopping = True
+                    break
+                group.append(entry)
+                records += len(entry[0])
+
+            try:
+                self._commit([line for lines, _ in group for line in lines])
+                for _, future in group:
+                    future.set_result(None)
+            except Exception as e:
+                logging.error(f"An error occurred while writing to {self.path}: {str(e)}")
+                for _, future in group:
+                    future.set_exception(e)
+
+    def _commit(self, lines: List[str]):
+        data = "".join(lines).encode("utf-8")
+        with self._file_lock():
+            self._rotate_if_needed()
+            fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                if self.header and os.fstat(fd).st_size == 0:
+                    data = self.header.encode("utf-8") + data
+                view = memoryview(data)
+                while view:
+                    written = os.write(fd, view)
+                    view = view[written:]
+                if self.fsync:
+                    os.fsync(fd)
+            finally:
+                os.close(fd)
+
+    @contextmanager
+    def _file_lock(self):
+        if fcntl is None:
+            yield
+            return
+        if self._lock_fd is None:
+            self._lock_fd = os.open(f"{self.path}.lock", os.O_RDWR | os.O_CREAT, 0o644)
+        fcntl.flock(self._lock_fd, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(self._lock_fd, fcntl.LOCK_UN)
+
+    def _rotate_if_needed(self):
+        # called with the file lock held, so only one worker rotates
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return
+        if stat.st_size == 0:
+            return
+
+        now = time.time()
+        too_large = self.rotate_bytes > 0 and stat.st_size >= self.rotate_bytes
+        too_old = self.rotate_seconds > 0 and int(stat.st_mtime // self.rotate_seconds) < int(now // self.rotate_seconds)
+        if not (too_large or too_old):
+            return
+
+        root, ext = os.path.splitext(self.path)
+        stamp = time.strftime("%Y%m%d-%H%M%S", time.gmtime(now))
+        target = f"{root}-{stamp}{ext}"
+        counter = 1
+        while os.path.exists(target):
+            target = f"{root}-{stamp}-{counter}{ext}"
+            counter += 1
+        os.rename(self.path, target)
+        logging.info(f"Output file rotated: {target}")
@@ -1,30 +1,54 @@
-import os
 import csv
+import io
 import logging
-from .base_handler import BaseOutputHandler
-from typing import Dict, Any, Union
+from .base_handler import BaseOutputHandler, OutputItem
+from .buffered_writer import BufferedFileWriter
+from config import settings
+from typing import Dict, Any, List, Union
 from pydantic import BaseModel
 
 class CSVOutputHandler(BaseOutputHandler):
     def __init__(self, filename='invoice_details.csv'):
         self.filename = filename
+        # rows of concurrent documents are appended together by a single writer; the header
+        # is written at the start of every new (or rotated) file
+        self.writer = BufferedFileWriter(
+            filename,
+            header=self.format_row(['Blob Name', 'Invoice Details']),
+            flush_records=settings.output_file_flush_records,
+            flush_ms=settings.output_file_flush_ms,
+            fsync=settings.output_file_fsync,
+            rotate_bytes=settings.output_file_rotate_bytes,
+            rotate_seconds=settings.output_file_rotate_seconds
+        )
 
     def handle_output(self, blob_name: str, invoice_details: Union[Dict[str, Any], BaseModel]):
+        self.handle_batch([OutputItem(blob_name, None, invoice_details)])
+
+    def handle_batch(self, items: List[OutputItem]):
         try:
-            # Convert Pydantic model to dict if necessary
-            if isinstance(invoice_details, BaseModel):
-                invoice_details = invoice_details.model_dump()
+            rows = []
+            for item in items:
+                # Convert Pydantic model to dict if necessary
+                invoice_details = item.invoice_details
+                if isinstance(invoice_details, BaseModel):
+                    invoice_details = invoice_details.model_dump()
 
-            # Format invoice details as a single string
-            details_str = ' '.join([f"{k}={v!r}" for k, v in invoice_details.items()])
+                # Format invoice details as a single string
+                details_str = ' '.join([f"{k}={v!r}" for k, v in invoice_details.items()])
+                rows.append(self.format_row([item.blob_name, details_str]))
 
-            file_exists = os.path.isfile(self.filename)
-            with open(self.filename, 'a', newline='') as f:
-                writer = csv.writer(f, quoting=csv.QUOTE_ALL)
-                if not file_exists:
-                    writer.writerow(['Blob Name', 'Invoice Details'])
-                
-                writer.writerow([blob_name, details_str])
+            self.writer.write(rows)
             logging.info(f"Invoice details written to CSV: {self.filename}")
         except Exception as e:
-            logging.error(f"An error occurred while writing to CSV: {str(e)}")
\ No newline at end of file
+            logging.error(f"An error occurred while writing to CSV: {str(e)}")
+            raise
+
+    def close(self):
+        self.writer.close()
+
+    @staticmethod
+    def format_row(values: List[str]) -> str:
+        buffer = io.StringIO()
+        csv.writer(buffer, quoting=csv.QUOTE_ALL).writerow(values)
+        return buffer.getvalue()
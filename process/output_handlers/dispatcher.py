@@ -0,0 +1,223 @@
+import asyncio
+import json
+import logging
+import threading
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+from .base_handler import BaseOutputHandler, OutputItem
+import metrics
+import timing
+
+class OutputDispatcher:
+    """
+    Hands the extracted details of a document to every output handler concurrently.
+
+    Handlers that write locally run on the executor and are awaited. Batched handlers (network
+    sinks) get a bounded queue each: dispatch() returns once the item is queued, and a worker
+    sends the queue in batches of up to batch_size items, or what arrived within flush_ms.
+    A full queue makes dispatch() wait, which holds back the documents that feed it.
+
+    Failed deliveries are retried with exponential backoff; a batch that still fails after
+    max_attempts is retried item by item, and items that fail again are appended to the
+    dead-letter file instead of being dropped.
+    """
+    def __init__(self, run_blocking: Callable[..., Awaitable[Any]], queue_size: int, batch_size: int, flush_ms: int,
+                 max_attempts: int, retry_backoff_seconds: float, dead_letter_file: str):
+        self.run_blocking = run_blocking
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        self.flush_ms = flush_ms
+        self.max_attempts = max_attempts
+        self.retry_backoff_seconds = retry_backoff_seconds
+        self.dead_letter_file = dead_letter_file
+        self._handlers: List[BaseOutputHandler] = []
+        self._direct: List[Tuple[str, BaseOutputHandler]] = []
+        self._partial: List[Tuple[str, BaseOutputHandler]] = []
+        self._partial_tasks: Set[asyncio.Task] = set()
+        self._queues: Dict[str, asyncio.Queue] = {}
+        self._workers: List[asyncio.Task] = []
+        self._dead_letter_lock = threading.Lock()
+
+    def start(self, handler_types: List[str], handlers: List[BaseOutputHandler]):
+        for handler_type, handler in zip(handler_types, handlers):
+            self._handlers.append(handler)
+            if handler.partials:
+                self._partial.append((handler_type, handler))
+            if not handler.batched:
+                self._direct.append((handler_type, handler))
+                continue
+            queue = asyncio.Queue(maxsize=self.queue_size)
+            self._queues[handler_type] = queue
+            self._workers.append(asyncio.create_task(self._run_worker(handler_type, handler, queue)))
+            logging.info(f"Output handler {handler_type} runs behind a queue of {self.queue_size} items")
+
+    async def stop(self, timeout: float = 30):
+        """
+        Waits up to timeout seconds for the queues to drain, then stops the workers and
+        closes the handlers.
+        """
+        try:
+            await asyncio.wait_for(asyncio.gather(*[queue.join() for queue in self._queues.values()]), timeout)
+        except asyncio.TimeoutError:
+            logging.error(f"Output queues did not drain within {timeout} seconds, {self.pending()} items are lost")
+        await asyncio.gather(*self._partial_tasks, return_exceptions=True)
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        for handler in self._handlers:
+            try:
+                await self.run_blocking(handler.close)
+            except Exception as e:
+                logging.error(f"An error occurred while closing output handler {type(handler).__name__}: {str(e)}")
+
+    def pending(self) -> int:
+        return sum(queue.qsize() for queue in self._queues.values())
+
+    async def dispatch(self, item: OutputItem):
+        async def deliver_direct(handler_type: str, handler: BaseOutputHandler):
+            with timing.stage(f"output_{handler_type}"):
+                await self._deliver(handler_type, handler, [item])
+
+        async def enqueue(handler_type: str, queue: asyncio.Queue):
+            with timing.stage(f"output_{handler_type}"):
+                await queue.put(item)
+
+        await asyncio.gather(
+            *[deliver_direct(handler_type, handler) for handler_type, handler in self._direct],
+            *[enqueue(handler_type, queue) for handler_type, queue in self._queues.items()]
+        )
+
+    def partial_sender(self, blob_name: str, template_name: str) -> Optional["PartialSender"]:
+        """
+        Returns the callback that hands the fields of a streamed extraction to the handlers that
+        show partial results, or None when no handler does.
+        """
+        if not self._partial:
+            return None
+        return PartialSender(self, asyncio.get_running_loop(), blob_name, template_name)
+
+    async def _deliver_partial(self, blob_name: str, template_name: str, fields: Dict[str, Any]):
+        async def deliver(handler_type: str, handler: BaseOutputHandler):
+            try:
+                await self.run_blocking(handler.handle_partial, blob_name, template_name, fields)
+                metrics.OUTPUT_ITEMS.labels(handler_type, "partial").inc()
+            except Exception as e:
+                metrics.OUTPUT_ITEMS.labels(handler_type, "partial_failed").inc()
+                logging.warning(f"Output handler {handler_type} failed for partial fields of {blob_name}: {str(e)}")
+
+        await asyncio.gather(*[deliver(handler_type, handler) for handler_type, handler in self._partial])
+
+    async def _run_worker(self, handler_type: str, handler: BaseOutputHandler, queue: asyncio.Queue):
+        loop = asyncio.get_running_loop()
+        max_batch_size = min(self.batch_size, handler.max_batch_size)
+        while True:
+            batch = [await queue.get()]
+            deadline = loop.time() + self.flush_ms / 1000
+            while len(batch) < max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            try:
+                await self._deliver(handler_type, handler, batch)
+            except Exception as e:
+                logging.error(f"An error occurred in the {handler_type} output worker: {str(e)}")
+            finally:
+                for _ in batch:
+                    queue.task_done()
+
+    async def _deliver(self, handler_type: str, handler: BaseOutputHandler, items: List[OutputItem]):
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                await self.run_blocking(handler.handle_batch, items)
+                metrics.OUTPUT_ITEMS.labels(handler_type, "delivered").inc(len(items))
+                return
+            except Exception as e:
+                error = str(e)
+                if attempt < self.max_attempts:
+                    metrics.OUTPUT_ITEMS.labels(handler_type, "retried").inc(len(items))
+                    logging.warning(f"Output handler {handler_type} failed for {len(items)} items (attempt {attempt}), retrying: {error}")
+                    await asyncio.sleep(self.retry_backoff_seconds * 2 ** (attempt - 1))
+
+        if len(items) > 1:
+            # one bad item should not take the rest of its batch down with it
+            logging.warning(f"Output handler {handler_type} failed for a batch of {len(items)} items, delivering them one by one")
+            for item in items:
+                try:
+                    await self.run_blocking(handler.handle_batch, [item])
+                    metrics.OUTPUT_ITEMS.labels(handler_type, "delivered").inc()
+                except Exception as e:
+                    await self._give_up(handler_type, [item], str(e))
+            return
+
+        await self._give_up(handler_type, items, error)
+
+    async def _give_up(self, handler_type: str, items: List[OutputItem], error: str):
+        metrics.OUTPUT_ITEMS.labels(handler_type, "dead_lettered").inc(len(items))
+        logging.error(f"Output handler {handler_type} failed for {len(items)} items after {self.max_attempts} attempts, dead-lettering them: {error}")
+        await self.run_blocking(self._dead_letter, handler_type, items, error)
+
+    def _dead_letter(self, handler_type: str, items: List[OutputItem], error: str):
+        # one JSON line per item, so the items can be replayed to the handler later
+        lines = [
+            json.dumps({
+                "handler": handler_type,
+                "blob_name": item.blob_name,
+                "template_name": item.template_name,
+                "invoice_details": item.details_dict(),
+                "error": error,
+                "time": time.time()
+            }, default=str) + "\n"
+            for item in items
+        ]
+        try:
+            with self._dead_letter_lock:
+                with open(self.dead_letter_file, "a") as f:
+                    f.writelines(lines)
+        except Exception as e:
+            logging.error(f"An error occurred while writing to the dead-letter file, {len(items)} items are lost: {str(e)}")
+
+class PartialSender:
+    """
+    Called by the extractor, on an executor thread, with every top-level field of the response as
+    soon as it is complete. Fields are sent from the event loop; fields that arrive while a send
+    is in progress are sent together next, so a slow handler gets fewer, larger updates instead
+    of falling behind. drain() waits for the last send, so the fields arrive before the result.
+    """
+    def __init__(self, dispatcher: OutputDispatcher, loop: asyncio.AbstractEventLoop, blob_name: str, template_name: str):
+        self.dispatcher = dispatcher
+        self.loop = loop
+        self.blob_name = blob_name
+        self.template_name = template_name
+        self._start = time.perf_counter()
+        self._first = True
+        self._pending: Dict[str, Any] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def __call__(self, name: str, value: Any):
+        self.loop.call_soon_threadsafe(self._add, name, value)
+
+    def _add(self, name: str, value: Any):
+        if self._first:
+            # what the dashboard waits for before it shows anything of the document
+            metrics.STAGE_SECONDS.labels("extract_first_field").observe(time.perf_counter() - self._start)
+            self._first = False
+        self._pending[name] = value
+        if self._task is None:
+            self._task = asyncio.create_task(self._send())
+            self.dispatcher._partial_tasks.add(self._task)
+            self._task.add_done_callback(self.dispatcher._partial_tasks.discard)
+
+    async def _send(self):
+        while self._pending:
+            fields, self._pending = self._pending, {}
+            await self.dispatcher._deliver_partial(self.blob_name, self.template_name, fields)
+        self._task = None
+
+    async def drain(self):
+        if self._task is not None:
+            await self._task
@@ -1,13 +1,16 @@
 import os
 import logging
-from azure.eventgrid import EventGridPublisherClient
 from azure.core.messaging import CloudEvent
-from azure.core.credentials import AzureKeyCredential
-from .base_handler import BaseOutputHandler
-from typing import Dict, Any, Union
+import clients
+from .base_handler import BaseOutputHandler, OutputItem
+from typing import Dict, Any, List, Union
 from pydantic import BaseModel
 
 class EventGridOutputHandler(BaseOutputHandler):
+    # events are sent in batches by the output dispatcher; a publish request is limited to 1 MB
+    batched = True
+    max_batch_size = 100
+
     def __init__(self):
         self.topic_endpoint = os.getenv('EVENT_GRID_TOPIC_ENDPOINT')
         self.topic_key = os.getenv('EVENT_GRID_TOPIC_KEY')
@@ -15,14 +18,13 @@ class EventGridOutputHandler(BaseOutputHandler):
         if not self.topic_endpoint or not self.topic_key or not self.topic_name:
             raise ValueError("EVENT_GRID_TOPIC_ENDPOINT, EVENT_GRID_TOPIC_KEY and EVENT_GRID_TOPIC_NAME must be set")
         
-        self.client = EventGridPublisherClient(endpoint=self.topic_endpoint, credential=AzureKeyCredential(self.topic_key), 
-                                               namespace_topic=self.topic_name)
+        self.client = clients.get_event_grid_client(self.topic_endpoint, self.topic_key, self.topic_name)
 
     def handle_output(self, blob_name: str, invoice_details: Union[Dict[str, Any], BaseModel]):
         try:
             # Convert Pydantic model to dict if necessary
             if isinstance(invoice_details, BaseModel):
-                invoice_details = invoice_details.model_dump()
+                invoice_details = invoice_details.model_dump(mode="json")
 
             # Send the event to Event Grid
             self.send_event(
@@ -34,6 +36,15 @@ class EventGridOutputHandler(BaseOutputHandler):
             logging.info(f"Invoice details sent to Event Grid for blob: {blob_name}")
         except Exception as e:
             logging.error(f"An error occurred while sending to Event Grid: {str(e)}")
+            raise
+
+    def handle_batch(self, items: List[OutputItem]):
+        try:
+            self.client.send([self.create_event("Invoice.Processed", f"Invoice/{item.blob_name}", item.details_dict()) for item in items])
+            logging.info(f"Invoice details of {len(items)} blobs sent to Event Grid")
+        except Exception as e:
+            logging.error(f"An error occurred while sending a batch to Event Grid: {str(e)}")
+            raise
 
     def send_event(self, event_type: str, subject: str, data_version: str, data: dict = None):
         """
@@ -48,11 +59,12 @@ class EventGridOutputHandler(BaseOutputHandler):
         Returns:
             None
         """
-        event = CloudEvent(
+        self.client.send(self.create_event(event_type, subject, data))
+
+    def create_event(self, event_type: str, subject: str, data: dict = None) -> CloudEvent:
+        return CloudEvent(
             type=event_type,
             subject=subject,
             source="process",  # source is required
             data=data
-        )
-        
-        self.client.send(event)
\ No newline at end of file
+        )
\ No newline at end of file
@@ -4,18 +4,31 @@ from .event_grid_handler import EventGridOutputHandler
 from .pusher_handler import PusherOutputHandler
 
 class OutputHandlerFactory:
+    # handlers are created once per type and reused for every document
+    _instances = {}
+
     @staticmethod
     def get_handlers(handler_types):
         handlers = []
         for handler_type in handler_types:
-            if handler_type == 'csv':
-                handlers.append(CSVOutputHandler())
-            elif handler_type == 'json':
-                handlers.append(JSONOutputHandler())
-            elif handler_type == 'event_grid':
-                handlers.append(EventGridOutputHandler())
-            elif handler_type == 'pusher':
-                handlers.append(PusherOutputHandler())
-            else:
-                raise ValueError(f"Unsupported output handler type: {handler_type}")
-        return handlers
\ No newline at end of file
+            if handler_type not in OutputHandlerFactory._instances:
+                OutputHandlerFactory._instances[handler_type] = OutputHandlerFactory._create_handler(handler_type)
+            handlers.append(OutputHandlerFactory._instances[handler_type])
+        return handlers
+
+    @staticmethod
+    def _create_handler(handler_type):
+        if handler_type == 'csv':
+            return CSVOutputHandler()
+        elif handler_type == 'json':
+            return JSONOutputHandler()
+        elif handler_type == 'event_grid':
+            return EventGridOutputHandler()
+        elif handler_type == 'pusher':
+            return PusherOutputHandler()
+        elif handler_type == 'parquet':
+            # pyarrow is only needed when the handler is used
+            from .parquet_handler import ParquetOutputHandler
+            return ParquetOutputHandler()
+        else:
+            raise ValueError(f"Unsupported output handler type: {handler_type}")
\ No newline at end of file
@@ -1,29 +1,39 @@
 import json
 import logging
-from .base_handler import BaseOutputHandler
-from typing import Dict, Any, Union
+from .base_handler import BaseOutputHandler, OutputItem
+from .buffered_writer import BufferedFileWriter
+from config import settings
+from typing import Dict, Any, List, Union
 from pydantic import BaseModel
 
 class JSONOutputHandler(BaseOutputHandler):
     def __init__(self, filename='invoice_details.jsonl'):
         self.filename = filename
+        # lines of concurrent documents are appended together by a single writer
+        self.writer = BufferedFileWriter(
+            filename,
+            flush_records=settings.output_file_flush_records,
+            flush_ms=settings.output_file_flush_ms,
+            fsync=settings.output_file_fsync,
+            rotate_bytes=settings.output_file_rotate_bytes,
+            rotate_seconds=settings.output_file_rotate_seconds
+        )
 
     def handle_output(self, blob_name: str, invoice_details: Union[Dict[str, Any], BaseModel]):
-        try:
-            # Convert Pydantic model to dict if necessary
-            if isinstance(invoice_details, BaseModel):
-                invoice_details = invoice_details.dict()
-
-            # Create a dictionary with blob_name and invoice_details
-            output_data = {
-                "blob_name": blob_name,
-                "invoice_details": invoice_details
-            }
+        self.handle_batch([OutputItem(blob_name, None, invoice_details)])
 
-            # Append new data as a single line JSON
-            with open(self.filename, 'a') as f:
-                f.write(json.dumps(output_data) + '\n')
+    def handle_batch(self, items: List[OutputItem]):
+        try:
+            # Append new data as a single line JSON per invoice
+            self.writer.write([
+                json.dumps({"blob_name": item.blob_name, "invoice_details": item.details_dict()}) + '\n'
+                for item in items
+            ])
 
             logging.info(f"Invoice details appended to JSONL: {self.filename}")
         except Exception as e:
-            logging.error(f"An error occurred while writing to JSONL: {str(e)}")
\ No newline at end of file
+            logging.error(f"An error occurred while writing to JSONL: {str(e)}")
+            raise
+
+    def close(self):
+        self.writer.close()
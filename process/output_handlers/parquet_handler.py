@@ -0,0 +1,266 @@
+import datetime
+import logging
+import os
+import threading
+import time
+import types
+import uuid
+from typing import Any, Dict, List, Optional, Tuple, Type, Union, get_args, get_origin
+import pyarrow as pa
+import pyarrow.parquet as pq
+from pydantic import BaseModel, ValidationError
+from .base_handler import BaseOutputHandler, OutputItem, safe_path_component
+from extractors.template_compiler import MODEL_REGISTRY
+from config import settings
+
+PRIMITIVE_TYPES = {
+    str: pa.string(),
+    float: pa.float64(),
+    int: pa.int64(),
+    bool: pa.bool_(),
+    datetime.date: pa.date32(),
+    datetime.datetime: pa.timestamp("us"),
+}
+
+# columns written next to the extracted fields
+METADATA_FIELDS = [pa.field("blob_name", pa.string()), pa.field("processed_at", pa.timestamp("us"))]
+
+def model_schema(model: Type[BaseModel]) -> pa.Schema:
+    """
+    Returns the Arrow schema of a flattened model: nested models become prefix_field columns,
+    lists stay list columns (of structs for lists of models) so they keep their typed fields.
+    """
+    return pa.schema(METADATA_FIELDS + _model_fields(model, ""))
+
+def _model_fields(model: Type[BaseModel], prefix: str) -> List[pa.Field]:
+    fields = []
+    for name, field in model.model_fields.items():
+        annotation = _unwrap_optional(field.annotation)
+        if isinstance(annotation, type) and issubclass(annotation, BaseModel):
+            fields.extend(_model_fields(annotation, f"{prefix}{name}_"))
+        else:
+            fields.append(pa.field(f"{prefix}{name}", _arrow_type(annotation)))
+    return fields
+
+def _arrow_type(annotation: Any) -> pa.DataType:
+    annotation = _unwrap_optional(annotation)
+    if get_origin(annotation) in (list, List):
+        args = get_args(annotation)
+        return pa.list_(_arrow_type(args[0]) if args else pa.string())
+    if isinstance(annotation, type) and issubclass(annotation, BaseModel):
+        return pa.struct([pa.field(name, _arrow_type(field.annotation)) for name, field in annotation.model_fields.items()])
+    return PRIMITIVE_TYPES.get(annotation, pa.string())
+
+def _unwrap_optional(annotation: Any) -> Any:
+    if get_origin(annotation) in (Union, types.UnionType):
+        args = [arg for arg in get_args(annotation) if arg is not type(None)]
+        if len(args) == 1:
+            return args[0]
+    return annotation
+
+def _row_schema(row: Dict[str, Any]) -> pa.Schema:
+    return pa.Table.from_pylist([row]).schema
+
+def flatten(details: Dict[str, Any], prefix: str = "") -> Dict[str, Any]:
+    row = {}
+    for key, value in details.items():
+        if isinstance(value, dict):
+            row.update(flatten(value, f"{prefix}{key}_"))
+        else:
+            row[f"{prefix}{key}"] = value
+    return row
+
+class PartitionWriter:
+    """
+    Open Parquet file of one template and date. Rows are buffered into row groups; the file is
+    written under a .tmp name and renamed when closed, so readers only see complete files.
+    """
+    def __init__(self, directory: str, schema: Optional[pa.Schema]):
+        self.directory = directory
+        self.schema = schema
+        # without a model, the columns come from the rows and widen until the first row group is written
+        self.inferred = schema is None
+        self.rows: List[Dict[str, Any]] = []
+        self.rows_written = 0
+        self.opened_at = time.monotonic()
+        self.buffered_at: Optional[float] = None
+        self.path = os.path.join(directory, f"part-{os.getpid()}-{uuid.uuid4().hex}.parquet")
+        self.writer: Optional[pq.ParquetWriter] = None
+
+    def accepts(self, row: Dict[str, Any], schema: Optional[pa.Schema]) -> bool:
+        if self.schema is None:
+            return True
+        if schema is not None:
+            return self.schema.equals(schema)
+        try:
+            if self.inferred and self.writer is None:
+                # a value where the buffered rows only had nulls, or a new column, widens the columns
+                pa.unify_schemas([self.schema, _row_schema(row)], promote_options="default")
+                return True
+            # rows without a model (such as cached results) are checked against the file's columns
+            if not set(row).issubset(self.schema.names):
+                return False
+            pa.Table.from_pylist([row], schema=self.schema)
+            return True
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            return False
+
+    def add(self, row: Dict[str, Any]):
+        # rows are only buffered once accepts() checked them against the columns, so they cannot fail a flush
+        if self.schema is None:
+            self.schema = _row_schema(row)
+        elif self.inferred and self.writer is None:
+            self.schema = pa.unify_schemas([self.schema, _row_schema(row)], promote_options="default")
+        self.rows.append(row)
+        if self.buffered_at is None:
+            self.buffered_at = time.monotonic()
+
+    def flush(self):
+        """
+        Writes the buffered rows as a row group. They stay buffered until the write succeeded, so
+        a failed flush is retried by the next one.
+        """
+        if not self.rows:
+            return
+        try:
+            table = pa.Table.from_pylist(self.rows, schema=self.schema)
+        except (pa.ArrowInvalid, pa.ArrowTypeError) as e:
+            # a row that does not fit would fail every later flush of the file, so it is dropped
+            logging.error(f"A Parquet row group of {self.path} does not fit its columns: {str(e)}")
+            table = self._drop_invalid_rows()
+        if self.writer is None:
+            os.makedirs(self.directory, exist_ok=True)
+            self.schema = table.schema
+            self.writer = pq.ParquetWriter(f"{self.path}.tmp", self.schema, compression=settings.parquet_compression)
+        self.writer.write_table(table)
+        self.rows_written += table.num_rows
+        self.rows = []
+        self.buffered_at = None
+
+    def _drop_invalid_rows(self) -> pa.Table:
+        valid = []
+        for row in self.rows:
+            try:
+                pa.Table.from_pylist([row], schema=self.schema)
+                valid.append(row)
+            except (pa.ArrowInvalid, pa.ArrowTypeError) as e:
+                logging.error(f"Dropping the Parquet row of {row.get('blob_name')}, it does not fit the columns of {self.path}: {str(e)}")
+        self.rows = valid
+        return pa.Table.from_pylist(valid, schema=self.schema)
+
+    def close(self):
+        self.flush()
+        if self.writer is not None:
+            self.writer.close()
+            os.replace(f"{self.path}.tmp", self.path)
+            logging.info(f"Parquet file written: {self.path} ({self.rows_written} rows)")
+
+class ParquetOutputHandler(BaseOutputHandler):
+    """
+    Writes extracted details as Parquet files partitioned by template and date:
+    <PARQUET_OUTPUT_DIR>/template=<name>/date=<YYYY-MM-DD>/part-<pid>-<id>.parquet
+
+    Columns are typed from the model of the template. Details that arrive as plain dicts are
+    validated with the model last seen for their template (or its static model) first, so they
+    land in the same file; only details that do not match it get columns inferred from the values.
+    A row group is written every PARQUET_ROW_GROUP_SIZE rows or PARQUET_FLUSH_SECONDS, and a
+    file is completed after PARQUET_FILE_MAX_ROWS rows or PARQUET_FILE_MAX_SECONDS.
+    """
+    # rows are handed over in batches by the output dispatcher
+    batched = True
+    max_batch_size = 1000
+
+    def __init__(self, output_dir: str = None):
+        self.output_dir = output_dir or settings.parquet_output_dir
+        self._partitions: Dict[Tuple[str, str], PartitionWriter] = {}
+        self._schemas: Dict[Type[BaseModel], pa.Schema] = {}
+        self._models: Dict[str, Type[BaseModel]] = {}
+        self._lock = threading.Lock()
+        self._closed = threading.Event()
+        self._flusher = threading.Thread(target=self._flush_periodically, name="parquet-flusher", daemon=True)
+        self._flusher.start()
+
+    def handle_output(self, blob_name: str, invoice_details: Union[Dict[str, Any], BaseModel]):
+        self.handle_batch([OutputItem(blob_name, None, invoice_details)])
+
+    def handle_batch(self, items: List[OutputItem]):
+        processed_at = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+        with self._lock:
+            added: List[Tuple[PartitionWriter, Dict[str, Any]]] = []
+            try:
+                for item in items:
+                    template_name = item.template_name or "unknown"
+                    details = self._validate(template_name, item.invoice_details)
+                    schema = None
+                    if isinstance(details, BaseModel):
+                        self._models[template_name] = type(details)
+                        schema = self._schema(type(details))
+                        details = details.model_dump()
+                    row = {"blob_name": item.blob_name, "processed_at": processed_at, **flatten(details)}
+                    added.append((self._append(template_name, processed_at.date().isoformat(), schema, row), row))
+            except Exception as e:
+                # the dispatcher retries the batch, so its rows that are still buffered are taken back
+                for partition, row in added:
+                    partition.rows = [buffered for buffered in partition.rows if buffered is not row]
+                logging.error(f"An error occurred while writing to Parquet: {str(e)}")
+                raise
+        logging.info(f"Invoice details of {len(items)} blobs buffered for Parquet: {self.output_dir}")
+
+    def close(self):
+        self._closed.set()
+        with self._lock:
+            for partition in self._partitions.values():
+                partition.close()
+            self._partitions.clear()
+
+    def _validate(self, template_name: str, details: Union[Dict[str, Any], BaseModel]) -> Union[Dict[str, Any], BaseModel]:
+        # a dict would get its columns from the Python values, like strings for dates, and a file of its own
+        if isinstance(details, BaseModel):
+            return details
+        model = self._models.get(template_name) or MODEL_REGISTRY.get(template_name)
+        if model is None:
+            return details
+        try:
+            return model.model_validate(details)
+        except ValidationError as e:
+            logging.warning(f"Invoice details do not match the model of template {template_name}, inferring their Parquet columns: {str(e)}")
+            return details
+
+    def _schema(self, model: Type[BaseModel]) -> pa.Schema:
+        schema = self._schemas.get(model)
+        if schema is None:
+            schema = self._schemas[model] = model_schema(model)
+        return schema
+
+    def _append(self, template_name: str, date: str, schema: Optional[pa.Schema], row: Dict[str, Any]) -> PartitionWriter:
+        key = (template_name, date)
+        partition = self._partitions.get(key)
+        # a changed template, or a row that does not fit the open file, starts a new file
+        if partition is not None and not partition.accepts(row, schema):
+            partition.close()
+            partition = None
+        if partition is None:
+            directory = os.path.join(self.output_dir, f"template={safe_path_component(template_name)}", f"date={date}")
+            partition = self._partitions[key] = PartitionWriter(directory, schema)
+
+        partition.add(row)
+        if len(partition.rows) >= settings.parquet_row_group_size:
+            partition.flush()
+        if partition.rows_written >= settings.parquet_file_max_rows:
+            partition.close()
+            del self._partitions[key]
+        return partition
+
+    def _flush_periodically(self):
+        while not self._closed.wait(1):
+            now = time.monotonic()
+            with self._lock:
+                for key, partition in list(self._partitions.items()):
+                    try:
+                        if now - partition.opened_at >= settings.parquet_file_max_seconds:
+                            partition.close()
+                            del self._partitions[key]
+                        elif partition.buffered_at is not None and now - partition.buffered_at >= settings.parquet_flush_seconds:
+                            partition.flush()
+                    except Exception as e:
+                        logging.error(f"An error occurred while flushing Parquet partition {key}: {str(e)}")
@@ -1,11 +1,17 @@
 import os
 import logging
-from pusher import Pusher
-from .base_handler import BaseOutputHandler
-from typing import Dict, Any, Union
+import clients
+from .base_handler import BaseOutputHandler, OutputItem
+from typing import Dict, Any, List, Union
 from pydantic import BaseModel
 
 class PusherOutputHandler(BaseOutputHandler):
+    # events are sent in batches by the output dispatcher; trigger_batch takes at most 10 events
+    batched = True
+    max_batch_size = 10
+    # fields of streamed extractions are pushed as invoice-partial events before invoice-processed
+    partials = True
+
     def __init__(self):
         self.app_id = os.getenv('PUSHER_APP_ID')
         self.key = os.getenv('PUSHER_KEY')
@@ -16,19 +22,13 @@ class PusherOutputHandler(BaseOutputHandler):
         if not all([self.app_id, self.key, self.secret, self.cluster]):
             raise ValueError("PUSHER_APP_ID, PUSHER_KEY, PUSHER_SECRET, and PUSHER_CLUSTER must be set")
         
-        self.pusher = Pusher(
-            app_id=self.app_id,
-            key=self.key,
-            secret=self.secret,
-            cluster=self.cluster,
-            ssl=True
-        )
+        self.pusher = clients.get_pusher_client(self.app_id, self.key, self.secret, self.cluster)
 
     def handle_output(self, blob_name: str, invoice_details: Union[Dict[str, Any], BaseModel]):
         try:
             # Convert Pydantic model to dict if necessary
             if isinstance(invoice_details, BaseModel):
-                invoice_details = invoice_details.model_dump()
+                invoice_details = invoice_details.model_dump(mode="json")
 
             # Create a dictionary with blob_name and invoice_details
             output_data = {
@@ -41,4 +41,23 @@ class PusherOutputHandler(BaseOutputHandler):
 
             logging.info(f"Invoice details pushed to Pusher channel: {self.channel}")
         except Exception as e:
-            logging.error(f"An error occurred while pushing to Pusher: {str(e)}")
\ No newline at end of file
+            logging.error(f"An error occurred while pushing to Pusher: {str(e)}")
+            raise
+
+    def handle_batch(self, items: List[OutputItem]):
+        try:
+            self.pusher.trigger_batch([
+                {
+                    "channel": self.channel,
+                    "name": "invoice-processed",
+                    "data": {"blob_name": item.blob_name, "invoice_details": item.details_dict()}
+                }
+                for item in items
+            ])
+            logging.info(f"Invoice details of {len(items)} blobs pushed to Pusher channel: {self.channel}")
+        except Exception as e:
+            logging.error(f"An error occurred while pushing a batch to Pusher: {str(e)}")
+            raise
+
+    def handle_partial(self, blob_name: str, template_name: str, fields: Dict[str, Any]):
+        self.pusher.trigger(self.channel, 'invoice-partial', {"blob_name": blob_name, "fields": fields})
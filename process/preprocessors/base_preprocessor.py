@@ -0,0 +1,12 @@
+from abc import ABC, abstractmethod
+from typing import Any, Dict, List, Optional
+
+class BasePreprocessor(ABC):
+    """
+    Rewrites the cracked text of a document before it is sent to the extractor.
+    The text is handed over as a list of pages; crackers that know the page boundaries
+    separate pages with PAGE_BREAK, others produce a single page.
+    """
+    @abstractmethod
+    def process(self, pages: List[str], template_content: Optional[Dict[str, Any]], template_name: str = None) -> List[str]:
+        pass
@@ -0,0 +1,50 @@
+import math
+import re
+from collections import Counter
+from typing import Any, Dict, List, Optional
+from .base_preprocessor import BasePreprocessor
+
+DIGITS = re.compile(r"\d+")
+BLANK_LINES = re.compile(r"\n{3,}")
+
+class HeaderFooterPreprocessor(BasePreprocessor):
+    """
+    Drops page headers and footers that repeat on most pages. A line counts as a header or
+    footer when it is among the first or last max_lines lines of at least min_share of the
+    pages; numbers are ignored in the comparison, so "Page 2 of 5" matches on every page.
+    The first page keeps its header, which often holds the name and address of the sender.
+    Needs at least two pages, so it has no effect on crackers that do not report pages.
+    """
+    def __init__(self, max_lines: int = 3, min_share: float = 0.5):
+        self.max_lines = max_lines
+        self.min_share = min_share
+
+    def process(self, pages: List[str], template_content: Optional[Dict[str, Any]], template_name: str = None) -> List[str]:
+        if len(pages) < 2:
+            return pages
+
+        page_lines = [page.split("\n") for page in pages]
+        counts = Counter()
+        for lines in page_lines:
+            counts.update({self._normalize(lines[index]) for index in self._edge_indexes(lines)})
+
+        min_pages = max(2, math.ceil(self.min_share * len(pages)))
+        repeated = {line for line, count in counts.items() if line and count >= min_pages}
+        if not repeated:
+            return pages
+
+        result = [pages[0]]
+        for lines in page_lines[1:]:
+            dropped = {index for index in self._edge_indexes(lines) if self._normalize(lines[index]) in repeated}
+            page = "\n".join(line for index, line in enumerate(lines) if index not in dropped)
+            result.append(BLANK_LINES.sub("\n\n", page).strip())
+        return result
+
+    def _edge_indexes(self, lines: List[str]) -> List[int]:
+        # positions of the first and last non-blank lines of a page
+        filled = [index for index, line in enumerate(lines) if line.strip()]
+        return sorted(set(filled[:self.max_lines] + filled[-self.max_lines:]))
+
+    @staticmethod
+    def _normalize(line: str) -> str:
+        return DIGITS.sub("#", " ".join(line.lower().split()))
@@ -0,0 +1,39 @@
+import logging
+from typing import Any, Dict, Optional
+from crackers.base_cracker import PAGE_BREAK
+from config import settings
+from tokens import estimate_tokens, token_budget, truncate_to_budget
+from .preprocessor_factory import PreprocessorFactory
+import metrics
+
+def preprocess(text: str, template_content: Optional[Dict[str, Any]], template_name: str, extractor_type: str) -> str:
+    """
+    Runs the cracked text through the PREPROCESSORS and fits it into the token budget of the
+    extractor. Over budget, the regions preprocessor is applied when it did not run yet, and
+    what is still too long is truncated, unless chunked extraction is enabled.
+    """
+    if not text:
+        return text
+
+    pages = text.split(PAGE_BREAK)
+    for preprocessor in PreprocessorFactory.get_preprocessors(settings.preprocessors):
+        pages = preprocessor.process(pages, template_content, template_name)
+    result = "\n\n".join(pages)
+
+    # with chunked extraction, long documents are split to fit the budget instead
+    budget = token_budget(extractor_type) if settings.extraction_chunk_tokens <= 0 else 0
+    if budget > 0 and estimate_tokens(result) > budget:
+        if 'regions' not in settings.preprocessors:
+            result = "\n\n".join(PreprocessorFactory.get_preprocessors(['regions'])[0].process(pages, template_content, template_name))
+        if estimate_tokens(result) > budget:
+            logging.warning(f"Document exceeds the token budget of {budget} for {extractor_type} and is truncated.")
+            metrics.PREPROCESS_TRUNCATIONS.labels(extractor_type).inc()
+            result = truncate_to_budget(result, budget)
+
+    tokens_before = estimate_tokens(text)
+    tokens_after = estimate_tokens(result)
+    metrics.PREPROCESS_TOKENS.labels(extractor_type, "before").inc(tokens_before)
+    metrics.PREPROCESS_TOKENS.labels(extractor_type, "after").inc(tokens_after)
+    if tokens_before:
+        logging.info(f"Pre-processing reduced the input from {tokens_before} to {tokens_after} estimated tokens ({100 * (tokens_before - tokens_after) / tokens_before:.0f}% less).")
+    return result
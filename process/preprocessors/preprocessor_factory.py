@@ -0,0 +1,32 @@
+from typing import List
+from .base_preprocessor import BasePreprocessor
+from .whitespace_preprocessor import WhitespacePreprocessor
+from .header_footer_preprocessor import HeaderFooterPreprocessor
+from .region_preprocessor import RegionPreprocessor
+from config import settings
+
+class PreprocessorFactory:
+    # preprocessors are created once per type and reused for every document
+    _instances = {}
+
+    @staticmethod
+    def get_preprocessors(preprocessor_types: List[str]) -> List[BasePreprocessor]:
+        preprocessors = []
+        for preprocessor_type in preprocessor_types:
+            preprocessor_type = preprocessor_type.lower()
+            if preprocessor_type not in PreprocessorFactory._instances:
+                PreprocessorFactory._instances[preprocessor_type] = PreprocessorFactory._create_preprocessor(preprocessor_type)
+            preprocessors.append(PreprocessorFactory._instances[preprocessor_type])
+        return preprocessors
+
+    @staticmethod
+    def _create_preprocessor(preprocessor_type: str) -> BasePreprocessor:
+        if preprocessor_type == 'whitespace':
+            return WhitespacePreprocessor()
+        elif preprocessor_type == 'headers_footers':
+            return HeaderFooterPreprocessor(settings.preprocess_header_lines)
+        elif preprocessor_type == 'regions':
+            return RegionPreprocessor(settings.preprocess_region_max_line_chars)
+        # Add more preprocessors here as needed
+        else:
+            raise ValueError(f"Unsupported preprocessor type: {preprocessor_type}")
@@ -0,0 +1,61 @@
+import re
+from typing import Any, Dict, List, Optional, Set
+from extractors.template_compiler import compile_template
+from .base_preprocessor import BasePreprocessor
+
+WORDS = re.compile(r"[a-z]{3,}")
+CAMEL_CASE = re.compile(r"(?<=[a-z])(?=[A-Z])")
+STOP_WORDS = {"the", "and", "for", "with", "from", "this", "that", "date", "format", "string", "number", "list", "each"}
+
+class RegionPreprocessor(BasePreprocessor):
+    """
+    Keeps only the paragraphs that can hold the fields of the template: paragraphs that mention
+    a field (by name or by a word of its description), and short-lined paragraphs with numbers,
+    such as addresses, item tables and totals. Long prose without field names, like terms and
+    conditions, is dropped. When nothing would be left, the pages are returned unchanged.
+    """
+    def __init__(self, max_line_chars: int = 80):
+        self.max_line_chars = max_line_chars
+
+    def process(self, pages: List[str], template_content: Optional[Dict[str, Any]], template_name: str = None) -> List[str]:
+        keywords = template_keywords(template_content, template_name)
+        result = []
+        for page in pages:
+            paragraphs = [paragraph for paragraph in page.split("\n\n") if self._is_relevant(paragraph, keywords)]
+            if paragraphs:
+                result.append("\n\n".join(paragraphs))
+        return result or pages
+
+    def _is_relevant(self, paragraph: str, keywords: Set[str]) -> bool:
+        if keywords.intersection(WORDS.findall(paragraph.lower())):
+            return True
+        lines = [line for line in paragraph.split("\n") if line.strip()]
+        if not lines or not any(char.isdigit() for char in paragraph):
+            return False
+        return sum(len(line) for line in lines) / len(lines) <= self.max_line_chars
+
+def template_keywords(template_content: Optional[Dict[str, Any]], template_name: str = None) -> Set[str]:
+    """
+    Returns the words of the field names and descriptions of a template, from its JSON schema.
+    """
+    keywords = set()
+    _collect_keywords(compile_template(template_content, template_name).json_schema, keywords)
+    return keywords - STOP_WORDS
+
+def _collect_keywords(schema: Any, keywords: Set[str]):
+    if isinstance(schema, list):
+        for item in schema:
+            _collect_keywords(item, keywords)
+        return
+    if not isinstance(schema, dict):
+        return
+    for name, value in schema.get("properties", {}).items():
+        keywords.update(WORDS.findall(CAMEL_CASE.sub(" ", name).replace("_", " ").lower()))
+        _collect_keywords(value, keywords)
+    if isinstance(schema.get("description"), str):
+        keywords.update(WORDS.findall(schema["description"].lower()))
+    if "items" in schema:
+        _collect_keywords(schema["items"], keywords)
+    for definition in schema.get("$defs", {}).values():
+        _collect_keywords(definition, keywords)
+    _collect_keywords(schema.get("anyOf", []), keywords)
@@ -0,0 +1,20 @@
+import re
+from typing import Any, Dict, List, Optional
+from .base_preprocessor import BasePreprocessor
+
+HORIZONTAL_WHITESPACE = re.compile(r"[ \t\u00a0\u2000-\u200b\u3000]+")
+BLANK_LINES = re.compile(r"\n{3,}")
+
+class WhitespacePreprocessor(BasePreprocessor):
+    """
+    Collapses runs of spaces and tabs, strips lines and keeps at most one blank line between
+    paragraphs. Blank pages are dropped.
+    """
+    def process(self, pages: List[str], template_content: Optional[Dict[str, Any]], template_name: str = None) -> List[str]:
+        result = []
+        for page in pages:
+            lines = [HORIZONTAL_WHITESPACE.sub(" ", line).strip() for line in page.replace("\r\n", "\n").replace("\r", "\n").split("\n")]
+            page = BLANK_LINES.sub("\n\n", "\n".join(lines)).strip()
+            if page:
+                result.append(page)
+        return result
@@ -0,0 +1,29 @@
+import hashlib
+import json
+from abc import ABC, abstractmethod
+from typing import Any, Dict, Optional
+
+class BaseResultCache(ABC):
+    """
+    Stores cracked text and extracted invoice details for documents that were processed before.
+    """
+    @abstractmethod
+    async def get(self, key: str) -> Optional[Dict[str, Any]]:
+        pass
+
+    @abstractmethod
+    async def set(self, key: str, value: Dict[str, Any]):
+        pass
+
+def make_cache_key(file_hash: str, template_name: str, template_content: Optional[Dict[str, Any]], cracker_type: str, extractor_type: str) -> str:
+    """
+    Builds a content-addressed key from the SHA-256 of the file and everything that changes the extraction result.
+
+    Static templates have no content; their version is tied to the code, so they use a fixed version.
+    """
+    return f"result-{file_hash}-{template_name}-{template_version(template_content)}-{cracker_type}-{extractor_type}"
+
+def template_version(template_content: Optional[Dict[str, Any]]) -> str:
+    if template_content is None:
+        return "static"
+    return hashlib.sha256(json.dumps(template_content, sort_keys=True).encode("utf-8")).hexdigest()[:16]
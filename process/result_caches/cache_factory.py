@@ -0,0 +1,20 @@
+from .base_cache import BaseResultCache
+from .memory_cache import MemoryResultCache
+from .disk_cache import DiskResultCache
+from .dapr_cache import DaprResultCache
+from config import settings
+
+class ResultCacheFactory:
+    @staticmethod
+    def get_cache(cache_type: str) -> BaseResultCache:
+        if cache_type.lower() == 'none':
+            return None
+        elif cache_type.lower() == 'memory':
+            return MemoryResultCache(settings.result_cache_size)
+        elif cache_type.lower() == 'disk':
+            return DiskResultCache(settings.result_cache_dir, settings.result_cache_size, settings.result_cache_ttl_seconds)
+        elif cache_type.lower() == 'dapr':
+            return DaprResultCache(settings.result_cache_store, settings.result_cache_ttl_seconds)
+        # Add more caches here as needed
+        else:
+            raise ValueError(f"Unsupported result cache type: {cache_type}")
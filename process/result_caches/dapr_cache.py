@@ -0,0 +1,39 @@
+import logging
+from typing import Any, Dict, Optional
+import aiohttp
+import clients
+from .base_cache import BaseResultCache
+
+class DaprResultCache(BaseResultCache):
+    """
+    Keeps results in a Dapr state store so every replica of the process app shares them.
+    """
+    def __init__(self, store_name: str, ttl_seconds: int = 0):
+        self.store_name = store_name
+        self.ttl_seconds = ttl_seconds
+
+    async def get(self, key: str) -> Optional[Dict[str, Any]]:
+        async with clients.get_aiohttp_session().get(
+            url=clients.dapr_url(f"/v1.0/state/{self.store_name}/{key}"),
+            headers=clients.dapr_headers(),
+            timeout=aiohttp.ClientTimeout(total=10)
+        ) as result:
+            if result.status == 200:
+                return await result.json()
+            if result.status != 204:
+                logging.error(f"Dapr state store returned status {result.status} for key {key}")
+            return None
+
+    async def set(self, key: str, value: Dict[str, Any]):
+        item = {"key": key, "value": value}
+        if self.ttl_seconds > 0:
+            item["metadata"] = {"ttlInSeconds": str(self.ttl_seconds)}
+
+        async with clients.get_aiohttp_session().post(
+            url=clients.dapr_url(f"/v1.0/state/{self.store_name}"),
+            headers=clients.dapr_headers(),
+            json=[item],
+            timeout=aiohttp.ClientTimeout(total=10)
+        ) as result:
+            if not result.ok:
+                logging.error(f"Dapr state store returned status {result.status} while saving key {key}")
@@ -0,0 +1,98 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+import metrics
+from .base_cache import BaseResultCache
+
+class DiskResultCache(BaseResultCache):
+    """
+    Keeps results as JSON files, named after the SHA-256 of the key, so keys never leave the directory.
+
+    At most max_size files are kept, the least recently used are removed first, and files older
+    than ttl_seconds are misses. With several workers sharing the directory, every worker only
+    evicts the files it knows of (those found at startup and those it wrote), so the bound is
+    approximate.
+    """
+    def __init__(self, directory: str = '.result_cache', max_size: int = 1024, ttl_seconds: int = 0):
+        self.directory = directory
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        os.makedirs(self.directory, exist_ok=True)
+        self._lock = threading.Lock()
+        # file names, least recently used first
+        self._files: OrderedDict[str, None] = OrderedDict()
+        existing = [entry for entry in os.scandir(self.directory) if entry.name.endswith('.json')]
+        for entry in sorted(existing, key=lambda entry: entry.stat().st_mtime):
+            self._files[entry.name] = None
+        self._evict()
+
+    async def get(self, key: str) -> Optional[Dict[str, Any]]:
+        return await asyncio.to_thread(self._read, key)
+
+    async def set(self, key: str, value: Dict[str, Any]):
+        await asyncio.to_thread(self._write, key, value)
+
+    def _name(self, key: str) -> str:
+        return f"{hashlib.sha256(key.encode('utf-8')).hexdigest()}.json"
+
+    def _read(self, key: str) -> Optional[Dict[str, Any]]:
+        name = self._name(key)
+        path = os.path.join(self.directory, name)
+        try:
+            if self.ttl_seconds > 0 and time.time() - os.path.getmtime(path) > self.ttl_seconds:
+                self._remove(name)
+                return None
+            with open(path, 'r') as f:
+                value = json.load(f)
+            # the modification time is the last use, for the TTL and the eviction order of other workers
+            os.utime(path)
+            with self._lock:
+                self._files[name] = None
+                self._files.move_to_end(name)
+            return value
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logging.error(f"An error occurred while reading from the result cache: {str(e)}")
+            return None
+
+    def _write(self, key: str, value: Dict[str, Any]):
+        name = self._name(key)
+        # a temporary file of its own per write, so readers never see a partial entry and
+        # concurrent writes of the same key do not mix
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(value, f)
+            os.replace(tmp_path, os.path.join(self.directory, name))
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+        with self._lock:
+            self._files[name] = None
+            self._files.move_to_end(name)
+        self._evict()
+
+    def _evict(self):
+        while True:
+            with self._lock:
+                if len(self._files) <= self.max_size:
+                    return
+                name, _ = self._files.popitem(last=False)
+            self._remove(name)
+            metrics.CACHE_EVICTIONS.labels("result_disk").inc()
+
+    def _remove(self, name: str):
+        with self._lock:
+            self._files.pop(name, None)
+        try:
+            os.remove(os.path.join(self.directory, name))
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,20 @@
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+from .base_cache import BaseResultCache
+
+class MemoryResultCache(BaseResultCache):
+    def __init__(self, max_size: int = 1024):
+        self.max_size = max_size
+        self._entries: OrderedDict[str, Dict[str, Any]] = OrderedDict()
+
+    async def get(self, key: str) -> Optional[Dict[str, Any]]:
+        value = self._entries.get(key)
+        if value is not None:
+            self._entries.move_to_end(key)
+        return value
+
+    async def set(self, key: str, value: Dict[str, Any]):
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
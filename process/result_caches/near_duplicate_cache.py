@@ -0,0 +1,137 @@
+import random
+import re
+import threading
+import unicodedata
+import zlib
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Set, Tuple
+import numpy as np
+import metrics
+
+# modulus of the MinHash permutations; small enough that a * hash + b of 31-bit values fits in 64 bits
+MERSENNE_PRIME = (1 << 31) - 1
+# shingles hashed at once, which bounds the memory of a sketch of a long document
+SHINGLE_CHUNK = 4096
+
+@dataclass(frozen=True)
+class Sketch:
+    # MinHash signature of the word shingles of a text, and the numbers it contains
+    signature: Tuple[int, ...]
+    numbers: int
+
+@dataclass
+class _Entry:
+    scope: str
+    sketch: Sketch
+    value: Any
+    buckets: List[Tuple[str, int, Tuple[int, ...]]]
+
+class NearDuplicateCache:
+    """
+    Finds results of documents whose cracked text is nearly the same as a document seen before,
+    like a re-scan or a re-export of the same invoice, which have other bytes than the original.
+
+    Texts are normalized (Unicode, case, punctuation and whitespace) and split into shingles of
+    shingle_words words. The MinHash signature of the shingles estimates the Jaccard similarity
+    of two texts; signatures are split into bands, and texts that share a band in the same scope
+    (template and extractor) are compared. A cached result is returned when the most similar text
+    reaches threshold. With match_numbers, the texts must also contain the same numbers, so an
+    invoice that only differs in its number or amounts from another one is never a hit.
+
+    At most max_size entries are kept; the least recently used entry is evicted first.
+    """
+    def __init__(self, max_size: int, threshold: float, permutations: int = 64, bands: int = 16,
+                 shingle_words: int = 5, match_numbers: bool = True):
+        if permutations % bands:
+            raise ValueError(f"The number of permutations ({permutations}) must be a multiple of the number of bands ({bands})")
+        self.max_size = max_size
+        self.threshold = threshold
+        self.bands = bands
+        self.rows = permutations // bands
+        self.shingle_words = shingle_words
+        self.match_numbers = match_numbers
+        # fixed seed, so signatures do not depend on the process
+        rng = random.Random(1)
+        permutation_values = [(rng.randrange(1, MERSENNE_PRIME), rng.randrange(MERSENNE_PRIME)) for _ in range(permutations)]
+        self._a = np.array([a for a, _ in permutation_values], dtype=np.uint64)[:, None]
+        self._b = np.array([b for _, b in permutation_values], dtype=np.uint64)[:, None]
+        self._entries: OrderedDict[int, _Entry] = OrderedDict()
+        self._buckets: Dict[Tuple[str, int, Tuple[int, ...]], Set[int]] = {}
+        self._next_id = 0
+        self._lock = threading.Lock()
+
+    def sketch(self, text: str) -> Optional[Sketch]:
+        """
+        Returns the sketch of a text, or None when it has no words; CPU-bound, so run it on the executor.
+        """
+        words = re.findall(r"\w+", unicodedata.normalize("NFKC", text).lower())
+        if not words:
+            return None
+
+        size = min(self.shingle_words, len(words))
+        hashes = {zlib.crc32(" ".join(words[i:i + size]).encode("utf-8")) % MERSENNE_PRIME for i in range(len(words) - size + 1)}
+        # all permutations of a chunk of shingles at once, instead of one Python multiplication per pair
+        hashes = np.fromiter(hashes, dtype=np.uint64, count=len(hashes))
+        signature = np.full(self._a.shape[0], MERSENNE_PRIME, dtype=np.uint64)
+        for start in range(0, len(hashes), SHINGLE_CHUNK):
+            values = (self._a * hashes[None, start:start + SHINGLE_CHUNK] + self._b) % MERSENNE_PRIME
+            signature = np.minimum(signature, values.min(axis=1))
+        signature = tuple(signature.tolist())
+        # the order of the numbers changes with the layout, their values do not; words with a digit
+        # count as numbers too, so alphanumeric invoice numbers like INV2024A17 tell invoices apart
+        numbers = zlib.crc32(" ".join(sorted(word for word in words if any(c.isdigit() for c in word))).encode("utf-8"))
+        return Sketch(signature, numbers)
+
+    def get(self, scope: str, sketch: Optional[Sketch]) -> Optional[Tuple[Any, float]]:
+        """
+        Returns the cached value of the most similar text in scope and its similarity, or None.
+        """
+        if sketch is None:
+            return None
+        with self._lock:
+            candidates = set()
+            for key in self._bucket_keys(scope, sketch):
+                candidates.update(self._buckets.get(key, ()))
+
+            best_id, best_similarity = None, 0.0
+            for entry_id in candidates:
+                entry = self._entries[entry_id]
+                if self.match_numbers and entry.sketch.numbers != sketch.numbers:
+                    continue
+                similarity = self.similarity(entry.sketch, sketch)
+                if similarity > best_similarity:
+                    best_id, best_similarity = entry_id, similarity
+
+            if best_id is None or best_similarity < self.threshold:
+                return None
+            self._entries.move_to_end(best_id)
+            return self._entries[best_id].value, best_similarity
+
+    def set(self, scope: str, sketch: Optional[Sketch], value: Any):
+        if sketch is None:
+            return
+        with self._lock:
+            entry_id = self._next_id
+            self._next_id += 1
+            buckets = self._bucket_keys(scope, sketch)
+            self._entries[entry_id] = _Entry(scope, sketch, value, buckets)
+            for key in buckets:
+                self._buckets.setdefault(key, set()).add(entry_id)
+
+            while len(self._entries) > self.max_size:
+                evicted_id, evicted = self._entries.popitem(last=False)
+                for key in evicted.buckets:
+                    bucket = self._buckets[key]
+                    bucket.discard(evicted_id)
+                    if not bucket:
+                        del self._buckets[key]
+                metrics.CACHE_EVICTIONS.labels("near_duplicate").inc()
+
+    @staticmethod
+    def similarity(first: Sketch, second: Sketch) -> float:
+        # share of equal MinHash values, an estimate of the Jaccard similarity of the shingles
+        return sum(1 for a, b in zip(first.signature, second.signature) if a == b) / len(first.signature)
+
+    def _bucket_keys(self, scope: str, sketch: Sketch) -> List[Tuple[str, int, Tuple[int, ...]]]:
+        return [(scope, band, sketch.signature[band * self.rows:(band + 1) * self.rows]) for band in range(self.bands)]
@@ -0,0 +1,48 @@
+import glob
+import logging
+import os
+import tempfile
+import uvicorn
+from config import settings
+
+# production launcher of the process service: python server.py
+# with WORKERS > 1, uvicorn starts that many worker processes that each import app.py and
+# create their own clients, caches, executor and process pool (nothing is shared between
+# them), so CPU-bound work such as validating and serializing large LLM outputs uses
+# every core; Dapr spreads pub/sub deliveries over the workers through the shared port
+
+logging.basicConfig(level=logging.INFO)
+
+def prepare_metrics_dir():
+    """
+    Every worker keeps its own Prometheus counters; in multiprocess mode they are written to
+    PROMETHEUS_MULTIPROC_DIR and /metrics adds up the files of all workers. The directory
+    must be emptied before the workers start, or counters of a previous run are included.
+    """
+    metrics_dir = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+    if not metrics_dir:
+        if settings.workers <= 1:
+            return
+        metrics_dir = tempfile.mkdtemp(prefix="docproc-metrics-")
+        # inherited by the workers, which import prometheus_client after this is set
+        os.environ["PROMETHEUS_MULTIPROC_DIR"] = metrics_dir
+    os.makedirs(metrics_dir, exist_ok=True)
+    for path in glob.glob(os.path.join(metrics_dir, "*.db")):
+        os.remove(path)
+    logging.info(f"Prometheus multiprocess directory: {metrics_dir}")
+
+def main():
+    prepare_metrics_dir()
+    logging.info(f"Starting the process service with {settings.workers} workers on port {settings.port}")
+    uvicorn.run(
+        "app:app",
+        host=settings.host,
+        port=settings.port,
+        workers=settings.workers,
+        # on SIGTERM, stop accepting connections and let documents in progress finish;
+        # the lifespan then drains the output queues before the clients are closed
+        timeout_graceful_shutdown=settings.graceful_shutdown_seconds
+    )
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,48 @@
+import time
+import logging
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+class TemplateCache:
+    """
+    In-memory LRU cache for templates retrieved from the KV store.
+
+    Entries expire after ttl_seconds, so an edited template is picked up within that window
+    even when the invalidation event does not reach this worker.
+    """
+    def __init__(self, max_size: int, ttl_seconds: float):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._entries: OrderedDict[str, tuple[float, Dict[str, Any]]] = OrderedDict()
+
+    def get(self, template_name: str) -> Optional[Dict[str, Any]]:
+        entry = self._entries.get(template_name)
+        if entry is None:
+            return None
+
+        expires_at, template = entry
+        if time.monotonic() >= expires_at:
+            del self._entries[template_name]
+            return None
+
+        self._entries.move_to_end(template_name)
+        return template
+
+    def put(self, template_name: str, template: Dict[str, Any]):
+        if self.max_size <= 0:
+            return
+
+        self._entries[template_name] = (time.monotonic() + self.ttl_seconds, template)
+        self._entries.move_to_end(template_name)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, template_name: str = None):
+        """
+        Removes a single template, or every template when template_name is None.
+        """
+        if template_name is None:
+            self._entries.clear()
+        else:
+            self._entries.pop(template_name, None)
+        logging.info(f"Template cache invalidated: {template_name or 'all templates'}")
@@ -0,0 +1,10 @@
+from common.timing import StageTimer
+from config import settings
+import metrics
+
+# per-document stage timings and trace context of this service, see common/timing.py
+_timer = StageTimer(metrics.STAGE_SECONDS, metrics.DOCUMENTS, settings.stage_timings_file, settings.trace_propagation_enabled)
+
+document = _timer.document
+stage = _timer.stage
+trace_headers = _timer.trace_headers
@@ -0,0 +1,42 @@
+import math
+from config import settings
+
+# rough token counts of text sent to an LLM, used for budgets and statistics
+# English invoice text averages about four characters per token with the tokenizers of the
+# supported models; the usage reported by the APIs is counted in docproc_llm_tokens_total
+
+CHARS_PER_TOKEN = 4
+TRUNCATION_MARKER = "\n[...]\n"
+
+def estimate_tokens(text: str) -> int:
+    if not text:
+        return 0
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+def token_budget(extractor_type: str) -> int:
+    """
+    Returns the maximum number of input tokens of a document for an extractor (TOKEN_BUDGETS),
+    or 0 when there is no limit.
+    """
+    extractor_type = extractor_type.lower()
+    if extractor_type == 'rules':
+        # the text only reaches an LLM through the fallback extractor
+        return token_budget(settings.rules_fallback_extractor)
+    if extractor_type == 'router':
+        # the router sends documents over a provider's budget to the others
+        budgets = [token_budget(name) for name in settings.router_extractors if name.strip()]
+        return 0 if not budgets or 0 in budgets else max(budgets)
+    return settings.token_budgets.get(extractor_type, 0)
+
+def truncate_to_budget(text: str, budget: int) -> str:
+    """
+    Cuts text down to budget tokens at line boundaries. The start and the end of the document
+    are kept, since invoices put parties and numbers at the top and totals at the bottom.
+    """
+    if budget <= 0 or estimate_tokens(text) <= budget:
+        return text
+    max_chars = max(budget * CHARS_PER_TOKEN - len(TRUNCATION_MARKER), 0)
+    head = text[:max_chars * 2 // 3].rsplit("\n", 1)[0]
+    tail_chars = max_chars - len(head)
+    tail = text[-tail_chars:].split("\n", 1)[-1] if tail_chars > 0 else ""
+    return f"{head}{TRUNCATION_MARKER}{tail}"
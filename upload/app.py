@@ -1,14 +1,25 @@
 import os
+import asyncio
+import base64
 import logging
-from fastapi import FastAPI, File, Form, HTTPException, UploadFile
+import zipfile
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, File, Form, HTTPException, Request, UploadFile
 from fastapi.responses import JSONResponse
 from dapr.clients import DaprClient
+from dapr.conf import settings as dapr_settings
 import grpc
+import aiohttp
 from pydantic import BaseModel
-from azure.storage.blob import BlobServiceClient
+from azure.core.pipeline.transport import AioHttpTransport
+from azure.storage.blob.aio import BlobServiceClient
 import uuid
 import json
-from typing import Dict, Any, Tuple, Optional
+import metrics
+import timing
+from common.jobs import JOB_STATUSES, JobStore
+from jobs import job_summary, log_job_error, new_job
+from typing import Dict, Any, Awaitable, Callable, List, Tuple, Optional
 
 # Set up required inputs for http client to perform service invocation
 pubsub_name = os.getenv('PUBSUB_NAME', 'pubsub-azure')
@@ -16,7 +27,23 @@ topic_name = os.getenv('TOPIC_NAME', 'invoices')
 storage_account_name = os.getenv('STORAGE_ACCOUNT_NAME', 'diagrid')
 storage_account_key = os.getenv('STORAGE_ACCOUNT_KEY', '')
 container_name = os.getenv('CONTAINER_NAME', 'files')
+blob_account_url = os.getenv('BLOB_ACCOUNT_URL', f"https://{storage_account_name}.blob.core.windows.net")
 kvstore_name = os.getenv('KVSTORE_NAME', 'kvstore')
+template_topic_name = os.getenv('TEMPLATE_TOPIC_NAME', 'templates')
+upload_concurrency = int(os.getenv('UPLOAD_CONCURRENCY', '16'))
+bulk_publish_max_entries = int(os.getenv('BULK_PUBLISH_MAX_ENTRIES', '100'))
+upload_block_size = int(float(os.getenv('UPLOAD_BLOCK_SIZE_MB', '4')) * 1024 * 1024)
+upload_max_concurrent_blocks = int(os.getenv('UPLOAD_MAX_CONCURRENT_BLOCKS', '4'))
+max_upload_size = int(float(os.getenv('MAX_UPLOAD_SIZE_MB', '100')) * 1024 * 1024)
+job_tracking_enabled = os.getenv('JOB_TRACKING_ENABLED', 'false').lower() == 'true'
+job_store_name = os.getenv('JOB_STORE_NAME', kvstore_name)
+job_ttl_seconds = int(os.getenv('JOB_TTL_SECONDS', '604800'))
+job_index_shards = int(os.getenv('JOB_INDEX_SHARDS', '16'))
+job_index_max_entries = int(os.getenv('JOB_INDEX_MAX_ENTRIES', '10000'))
+
+# raised while streaming a file that is larger than MAX_UPLOAD_SIZE_MB
+class FileTooLargeError(ValueError):
+    pass
 
 # model for pubsub message about an invoice
 #  path: the path to the file in the blob storage
@@ -25,51 +52,139 @@ class Invoice(BaseModel):
     path: str
     template_name: str  # Added template_name field
 
-app = FastAPI()
+# model for the per-file result of a batch upload
+#  status: queued, upload_failed or publish_failed
+class BatchUploadResult(BaseModel):
+    file_name: str
+    blob_name: Optional[str] = None
+    status: str
+    error: Optional[str] = None
+
+# shared clients, created once in the lifespan so uploads reuse pooled connections
+http_session: Optional[aiohttp.ClientSession] = None
+blob_service_client: Optional[BlobServiceClient] = None
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global http_session, blob_service_client
+    http_session = aiohttp.ClientSession()
+    blob_service_client = BlobServiceClient(
+        blob_account_url,
+        credential=storage_account_key,
+        transport=AioHttpTransport(session=http_session, session_owner=False)
+    )
+    yield
+    await blob_service_client.close()
+    await http_session.close()
+
+app = FastAPI(lifespan=lifespan)
+
+def dapr_url(path: str) -> str:
+    if dapr_settings.DAPR_HTTP_ENDPOINT:
+        return f"{dapr_settings.DAPR_HTTP_ENDPOINT}{path}"
+    return f"http://{dapr_settings.DAPR_RUNTIME_HOST}:{dapr_settings.DAPR_HTTP_PORT}{path}"
+
+def dapr_headers() -> Dict[str, str]:
+    # calls to the sidecar's HTTP API join the trace of the request (TRACE_PROPAGATION_ENABLED)
+    headers = {'content-type': 'application/json'}
+    if dapr_settings.DAPR_API_TOKEN:
+        headers['dapr-api-token'] = dapr_settings.DAPR_API_TOKEN
+    headers.update(timing.trace_headers())
+    return headers
+
+# a job record for every queued document, updated by the process service while it processes it
+job_store = None
+if job_tracking_enabled:
+    job_store = JobStore(lambda: http_session, dapr_url, dapr_headers, job_store_name, job_ttl_seconds, job_index_shards, job_index_max_entries)
+
+async def create_jobs(jobs: List[Dict[str, Any]]):
+    if job_store is None:
+        return
+    try:
+        await job_store.create(jobs)
+    except Exception as e:
+        log_job_error("creating jobs", e)
+
+async def set_job_status(job: Dict[str, Any], status: str, error: str):
+    if job_store is None:
+        return
+    try:
+        await job_store.set_status(job, status, error)
+    except Exception as e:
+        log_job_error(f"updating job {job['id']}", e)
 
 logging.basicConfig(level=logging.INFO)
 
-async def upload_to_azure(storage_account_name: str, container_name: str, storage_account_key: str, file: UploadFile):
+async def upload_to_azure(container_name: str, file_name: str, read: Callable[[int], Awaitable[bytes]]):
     """
-    Uploads a file to Azure Blob Storage.
+    Streams a file to Azure Blob Storage.
 
     Args:
-        storage_account_name (str): The name of the Azure Storage account.
         container_name (str): The name of the container in the Azure Storage account.
-        storage_account_key (str): The access key for the Azure Storage account.
-        file (UploadFile): The file to be uploaded.
+        file_name (str): The original name of the file; its extension is kept for the blob.
+        read (Callable[[int], Awaitable[bytes]]): Reads up to the given number of bytes from the file,
+                                                  returns an empty result at the end of the file.
 
     Returns:
         str: The unique blob name of the uploaded file if successful, None otherwise.
 
     Raises:
-        Exception: If an error occurs during the upload process.
+        FileTooLargeError: If the file is larger than MAX_UPLOAD_SIZE_MB.
+
+    Files that fit in one block are uploaded with a single call. Larger files are staged
+    block by block, with at most UPLOAD_MAX_CONCURRENT_BLOCKS blocks in flight, so memory
+    use depends on the block size and not on the file size.
     """
+    in_flight = set()
     try:
-        # Create the BlobServiceClient object
-        blob_service_client = BlobServiceClient(
-            f"https://{storage_account_name}.blob.core.windows.net",
-            credential=storage_account_key
-        )
-
-        # Create a blob client using the local file name as the name for the blob
-        file_extension = os.path.splitext(file.filename)[1]
+        # Create a blob client using a unique name with the extension of the local file
+        file_extension = os.path.splitext(file_name)[1]
         unique_blob_name = f"{uuid.uuid4()}{file_extension}"
         blob_client = blob_service_client.get_blob_client(container=container_name, blob=unique_blob_name)
 
-        # Upload the file to Azure Blob Storage
-        content = await file.read()
-        blob_client.upload_blob(content, overwrite=True)
-
-        logging.info(f"File {file.filename} uploaded to Azure Blob Storage successfully.")
+        block = await read(upload_block_size)
+        if len(block) < upload_block_size:
+            if len(block) > max_upload_size:
+                raise FileTooLargeError(f"File {file_name} exceeds the maximum upload size of {max_upload_size} bytes")
+            await blob_client.upload_blob(block, overwrite=True)
+            total_size = len(block)
+        else:
+            block_ids = []
+            total_size = 0
+            while block:
+                total_size += len(block)
+                if total_size > max_upload_size:
+                    raise FileTooLargeError(f"File {file_name} exceeds the maximum upload size of {max_upload_size} bytes")
+
+                if len(in_flight) >= upload_max_concurrent_blocks:
+                    done, in_flight = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+                    for task in done:
+                        task.result()
+
+                block_id = base64.b64encode(f"{len(block_ids):08d}".encode()).decode()
+                block_ids.append(block_id)
+                in_flight.add(asyncio.create_task(blob_client.stage_block(block_id, block)))
+                block = await read(upload_block_size)
+
+            if in_flight:
+                await asyncio.gather(*in_flight)
+            await blob_client.commit_block_list(block_ids)
+
+        metrics.BYTES.labels("upload").inc(total_size)
+        logging.info(f"File {file_name} uploaded to Azure Blob Storage successfully.")
         return unique_blob_name
+    except FileTooLargeError:
+        raise
     except Exception as e:
         logging.error(f"An error occurred while uploading to Azure Blob Storage: {str(e)}")
         return None
-
+    finally:
+        # uncommitted blocks are discarded by the storage service
+        for task in in_flight:
+            task.cancel()
 
 # Function to publish an invoice via Dapr pub/sub
-def publish_invoice(invoice: Invoice):
+async def publish_invoice(invoice: Invoice):
     """
     Publishes an invoice using Dapr pub/sub.
 
@@ -79,32 +194,106 @@ def publish_invoice(invoice: Invoice):
     Returns:
         bool: True if the publish was successful, False otherwise.
 
-    This function uses the Dapr Client to publish an event to the 'invoices' topic
-    in the specified pub/sub component. The invoice data is serialized to JSON
-    before publishing.
+    This function calls the sidecar's HTTP publish API to publish an event to the 'invoices'
+    topic in the specified pub/sub component, on the shared session so the event loop is not
+    blocked. The invoice data is serialized to JSON before publishing.
+
+    If successful, it logs an info message. If the request fails, it returns False.
+    """
+    url = dapr_url(f"/v1.0/publish/{pubsub_name}/{topic_name}")
+    try:
+        # the trace context of the upload request is sent in the headers
+        async with http_session.post(url, data=invoice.model_dump_json(), headers=dapr_headers()) as response:
+            if response.status != 204:
+                logging.error(f"Failed to publish invoice: status {response.status}: {await response.text()}")
+                return False
+        logging.info('Publish Successful. Invoice published: %s' %
+                        invoice.path)
+        logging.debug(f"Invoice model: {invoice.model_dump()}")
+        return True
+    except Exception as e:
+        logging.error(f"Failed to publish invoice: {str(e)}")
+        return False
+
+# Function to publish many invoices in one call via the Dapr bulk publish API
+async def publish_invoices(invoices: List[Invoice]) -> Dict[str, str]:
+    """
+    Publishes invoices using the Dapr bulk publish API.
+
+    Args:
+        invoices (List[Invoice]): The invoices to publish.
+
+    Returns:
+        Dict[str, str]: The error message for every invoice path that failed to publish.
+
+    The Python SDK has no bulk publish method, so this calls the sidecar's HTTP API.
+    The blob name is used as entry id, so failed entries map back to their invoice.
+    """
+    url = dapr_url(f"/v1.0-alpha1/publish/bulk/{pubsub_name}/{topic_name}")
+    headers = dapr_headers()
+
+    failed = {}
+    for start in range(0, len(invoices), bulk_publish_max_entries):
+        chunk = invoices[start:start + bulk_publish_max_entries]
+        entries = [
+            {'entryId': invoice.path, 'event': invoice.model_dump(), 'contentType': 'application/json'}
+            for invoice in chunk
+        ]
+        try:
+            async with http_session.post(url, json=entries, headers=headers) as response:
+                if response.status == 204:
+                    continue
+                body = await response.json(content_type=None) or {}
+                failed_entries = body.get('failedEntries')
+                if failed_entries is None:
+                    # the whole request failed
+                    failed_entries = [{'entryId': entry['entryId'], 'error': body.get('message', f"status {response.status}")} for entry in entries]
+                for entry in failed_entries:
+                    failed[entry['entryId']] = entry.get('error', 'unknown error')
+        except Exception as e:
+            logging.error(f"Failed to bulk publish invoices: {str(e)}")
+            for invoice in chunk:
+                failed[invoice.path] = str(e)
+
+    logging.info(f"Bulk publish completed: {len(invoices) - len(failed)} published, {len(failed)} failed")
+    return failed
+
+# Function to tell the process app that a template changed so it can drop its cached copy
+def publish_template_changed(template_name: str):
+    """
+    Publishes a template-changed event using Dapr pub/sub.
+
+    Args:
+        template_name (str): The name of the template that was saved.
+
+    Returns:
+        bool: True if the publish was successful, False otherwise.
 
-    If successful, it logs an info message. If an RPC error occurs, it returns False.
+    The process app caches templates with a TTL, so a failed publish only delays
+    the moment the new template is used.
     """
     with DaprClient() as d:
         try:
-            result = d.publish_event(
+            d.publish_event(
                 pubsub_name=pubsub_name,
-                topic_name=topic_name,
-                data=invoice.model_dump_json(),
+                topic_name=template_topic_name,
+                data=json.dumps({'template_name': template_name}),
                 data_content_type='application/json',
             )
-            logging.info('Publish Successful. Invoice published: %s' %
-                            invoice.path)
-            logging.info(f"Invoice model: {invoice.model_dump()}")
+            logging.info(f"Template change published: {template_name}")
             return True
         except grpc.RpcError as err:
-            logging.error(f"Failed to publish invoice: {err}")
+            logging.error(f"Failed to publish template change: {err}")
             return False
 
 @app.get("/")
 async def root_status():
     return JSONResponse(content={"status": "ok"}, status_code=200)
 
+@app.get("/metrics")
+async def get_metrics():
+    return metrics.metrics_response()
+
 
 @app.post("/template/")
 async def submit_template(invoice_input: Dict[str, Any]):
@@ -126,7 +315,7 @@ async def submit_template(invoice_input: Dict[str, Any]):
         HTTPException: If there's an error saving to the key/value store.
     """
     try:
-        logging.info(f"Invoice input: {invoice_input}")
+        logging.debug(f"Invoice input: {invoice_input}")
         
         # extract template name from input
         template_name = invoice_input.get('template_name')
@@ -149,6 +338,8 @@ async def submit_template(invoice_input: Dict[str, Any]):
                 logging.error(f"Dapr state store error: {err.details()}")
                 raise HTTPException(status_code=500, detail="Failed to save template")
 
+        publish_template_changed(template_name)
+
         return JSONResponse(content={"message": "Invoice template saved successfully"}, status_code=200)
     except ValueError as ve:
         logging.error(f"Validation error: {str(ve)}")
@@ -189,9 +380,9 @@ def check_template_exists(template_name: str) -> Tuple[Optional[Dict[str, Any]],
         with DaprClient() as d:
             response = d.get_state(store_name=kvstore_name, key=template_name)
             if response.data:
-                logging.info(f"Template data: {response.data}")
+                logging.debug(f"Template data: {response.data}")
                 template_data = json.loads(response.data.decode("utf-8").replace("'", '"'))
-                logging.info(f"Extracted template data: {template_data}")
+                logging.debug(f"Extracted template data: {template_data}")
                 return template_data, None
             else:
                 return None, "Template not found"
@@ -201,30 +392,177 @@ def check_template_exists(template_name: str) -> Tuple[Optional[Dict[str, Any]],
         return None, error_message
 
 @app.post("/upload/")
-async def upload_file(file: UploadFile = File(...), template_name: str = Form(...)):
+async def upload_file(request: Request, file: UploadFile = File(...), template_name: str = Form(...)):
     try:
         # we do not check here if the template exists because template might
         # be pointing to a static model
-
-        # upload to azure
-        blob_name = await upload_to_azure(storage_account_name, container_name, storage_account_key, file)
-        if not blob_name:
-            raise ValueError("File received but not saved to blob storage nor queued")
-
-        # construct invoice object
-        invoice = Invoice(path=blob_name, template_name=template_name)
-
-        # publish invoice
-        if not publish_invoice(invoice):
-            raise ValueError("File uploaded but failed to publish to queue")
-        else:
-            return JSONResponse(content={"message": "File uploaded and queued successfully"}, status_code=200)
+        with timing.document(file.filename, request.headers.get('traceparent')):
+            # upload to azure
+            with timing.stage("upload"):
+                blob_name = await upload_to_azure(container_name, file.filename, file.read)
+            if not blob_name:
+                metrics.DOCUMENTS.labels("upload_failed").inc()
+                raise ValueError("File received but not saved to blob storage nor queued")
+
+            # construct invoice object
+            invoice = Invoice(path=blob_name, template_name=template_name)
+
+            # the job exists before the invoice is published, so the process service finds it
+            job = new_job(blob_name, file.filename, template_name)
+            await create_jobs([job])
+
+            # publish invoice
+            with timing.stage("publish"):
+                published = await publish_invoice(invoice)
+            if not published:
+                metrics.DOCUMENTS.labels("publish_failed").inc()
+                await set_job_status(job, "publish_failed", "Failed to publish to queue")
+                raise ValueError("File uploaded but failed to publish to queue")
+            metrics.DOCUMENTS.labels("queued").inc()
+
+        return JSONResponse(content={"message": "File uploaded and queued successfully", "job_id": blob_name}, status_code=200)
+    except FileTooLargeError as e:
+        logging.error(str(e))
+        return JSONResponse(content={"message": str(e)}, status_code=413)
     except Exception as e:
         logging.error(f"An error occurred: {str(e)}")
         return JSONResponse(content={
             "message": f"An error occurred: {str(e)}"
         }, status_code=500)
 
+def zip_member_reader(archive: zipfile.ZipFile, member: zipfile.ZipInfo) -> Callable[[int], Awaitable[bytes]]:
+    """
+    Returns a read function that decompresses a zip member on demand.
+    """
+    member_file = None
+
+    async def read(size: int) -> bytes:
+        nonlocal member_file
+        if member_file is None:
+            member_file = archive.open(member)
+        data = await asyncio.to_thread(member_file.read, size)
+        if not data:
+            member_file.close()
+        return data
+    return read
+
+def open_batch_files(files: List[UploadFile]) -> List[Tuple[str, Callable[[int], Awaitable[bytes]]]]:
+    """
+    Returns a read function for every uploaded file; zip archives are expanded into their member files.
+    Nothing is read yet, the files are streamed when they are uploaded.
+    """
+    documents = []
+    for file in files:
+        if not file.filename.lower().endswith('.zip'):
+            documents.append((file.filename, file.read))
+            continue
+
+        archive = zipfile.ZipFile(file.file)
+        for member in archive.infolist():
+            if member.is_dir() or member.filename.startswith('__MACOSX/'):
+                continue
+            documents.append((os.path.basename(member.filename), zip_member_reader(archive, member)))
+    return documents
+
+@app.post("/upload/batch")
+async def upload_batch(request: Request, files: List[UploadFile] = File(...), template_name: str = Form(...)):
+    """
+    Endpoint to upload many files, or zip archives of files, in one request.
+
+    Files are uploaded to blob storage concurrently (at most UPLOAD_CONCURRENCY at a time)
+    and the resulting invoices are published with a single bulk publish call.
+    Returns the status of every file; 207 is used when some files failed.
+    """
+    try:
+        documents = open_batch_files(files)
+    except zipfile.BadZipFile as e:
+        logging.error(f"Invalid zip archive: {str(e)}")
+        return JSONResponse(content={"message": f"Invalid zip archive: {str(e)}"}, status_code=400)
+
+    semaphore = asyncio.Semaphore(upload_concurrency)
+
+    async def upload_document(file_name: str, read: Callable[[int], Awaitable[bytes]]):
+        async with semaphore:
+            try:
+                return await upload_to_azure(container_name, file_name, read), None
+            except FileTooLargeError as e:
+                return None, str(e)
+
+    with timing.document(f"batch-{len(documents)}", request.headers.get('traceparent')):
+        with timing.stage("upload"):
+            uploads = await asyncio.gather(*[upload_document(file_name, read) for file_name, read in documents])
+
+        results = []
+        invoices = []
+        jobs = {}
+        for (file_name, _), (blob_name, error) in zip(documents, uploads):
+            if blob_name is None:
+                results.append(BatchUploadResult(file_name=file_name, status="upload_failed", error=error or "File not saved to blob storage"))
+                continue
+            invoices.append(Invoice(path=blob_name, template_name=template_name))
+            jobs[blob_name] = new_job(blob_name, file_name, template_name)
+            results.append(BatchUploadResult(file_name=file_name, blob_name=blob_name, status="queued"))
+
+        await create_jobs(list(jobs.values()))
+        with timing.stage("publish"):
+            failed = await publish_invoices(invoices) if invoices else {}
+
+    for result in results:
+        if result.blob_name in failed:
+            result.status = "publish_failed"
+            result.error = failed[result.blob_name]
+            await set_job_status(jobs[result.blob_name], "publish_failed", result.error)
+
+    for result in results:
+        metrics.DOCUMENTS.labels(result.status).inc()
+
+    queued = sum(1 for result in results if result.status == "queued")
+    return JSONResponse(content={
+        "message": f"{queued} of {len(results)} files uploaded and queued",
+        "files": [result.model_dump() for result in results]
+    }, status_code=200 if queued == len(results) else 207)
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    """
+    Endpoint to retrieve the job of a document by its blob name.
+
+    The job has the status of the document (queued, publish_failed, processing, succeeded or
+    failed), when every pipeline stage started and finished, and the time the document waited
+    in the queue (queue_seconds) and took to process (processing_seconds).
+    """
+    if job_store is None:
+        return JSONResponse(content={"message": "Job tracking is disabled"}, status_code=404)
+    try:
+        job = await job_store.get(job_id)
+    except Exception as e:
+        log_job_error(f"reading job {job_id}", e)
+        raise HTTPException(status_code=500, detail="Failed to retrieve job")
+    if job is None:
+        return JSONResponse(content={"message": "Job not found"}, status_code=404)
+    return JSONResponse(content=job_summary(job), status_code=200)
+
+@app.get("/jobs")
+async def list_jobs(status: str, limit: int = 100, cursor: Optional[str] = None):
+    """
+    Endpoint to list the jobs in a status, the longest in that status first, so stuck and
+    slow documents come first. Pass the returned next_cursor to get the next page.
+    """
+    if job_store is None:
+        return JSONResponse(content={"message": "Job tracking is disabled"}, status_code=404)
+    if status not in JOB_STATUSES:
+        return JSONResponse(content={"message": f"status must be one of {', '.join(JOB_STATUSES)}"}, status_code=400)
+    if not 1 <= limit <= 1000:
+        return JSONResponse(content={"message": "limit must be between 1 and 1000"}, status_code=400)
+    try:
+        jobs, next_cursor = await job_store.list(status, limit, cursor)
+    except ValueError:
+        return JSONResponse(content={"message": "Invalid cursor"}, status_code=400)
+    except Exception as e:
+        log_job_error(f"listing {status} jobs", e)
+        raise HTTPException(status_code=500, detail="Failed to list jobs")
+    return JSONResponse(content={"jobs": [job_summary(job) for job in jobs], "next_cursor": next_cursor}, status_code=200)
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
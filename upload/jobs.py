@@ -0,0 +1,38 @@
+import logging
+import time
+from typing import Any, Dict
+
+# the job store is shared with the process service, see common/jobs.py; these helpers are only
+# used by the endpoints of this service
+
+def job_summary(record: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Adds the time a job waited in the queue and the time its processing took, so far for jobs
+    that are still waiting or being processed.
+    """
+    now = time.time()
+    queued_at = record.get("queued_at") or record.get("created_at")
+    first_started_at = record.get("first_started_at")
+    started_at = record.get("started_at")
+    summary = dict(record)
+    summary["queue_seconds"] = ((first_started_at or now) - queued_at) if queued_at and record["status"] != "publish_failed" else None
+    summary["processing_seconds"] = ((record.get("finished_at") or now) - started_at) if started_at else None
+    return summary
+
+def new_job(blob_name: str, file_name: str, template_name: str) -> Dict[str, Any]:
+    now = time.time()
+    return {
+        "id": blob_name,
+        "file_name": file_name,
+        "template_name": template_name,
+        "status": "queued",
+        "created_at": now,
+        "queued_at": now,
+        "attempts": 0,
+        "error": None,
+        "updated_at": now
+    }
+
+def log_job_error(action: str, error: Exception):
+    # the job store only reports progress; uploads go on without it
+    logging.error(f"An error occurred while {action} in the job store: {str(error)}")
@@ -0,0 +1,16 @@
+from fastapi import Response
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Histogram, generate_latest
+
+# Prometheus metrics of the upload service, exposed at /metrics
+# stage durations are observed by timing.stage(), the counters where the work happens
+
+STAGE_SECONDS = Histogram(
+    "docproc_stage_duration_seconds", "Time spent in a request stage", ["stage"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+)
+REQUESTS = Counter("docproc_upload_requests_total", "Upload requests handled", ["status"])
+DOCUMENTS = Counter("docproc_documents_total", "Documents uploaded", ["status"])
+BYTES = Counter("docproc_bytes_total", "Bytes transferred to or from blob storage", ["direction"])
+
+def metrics_response() -> Response:
+    return Response(content=generate_latest(), media_type=CONTENT_TYPE_LATEST)
@@ -0,0 +1,13 @@
+import os
+from common.timing import StageTimer
+import metrics
+
+stage_timings_file = os.getenv('STAGE_TIMINGS_FILE', '')
+trace_propagation_enabled = os.getenv('TRACE_PROPAGATION_ENABLED', 'false').lower() == 'true'
+
+# per-request stage timings and trace context of this service, see common/timing.py
+_timer = StageTimer(metrics.STAGE_SECONDS, metrics.REQUESTS, stage_timings_file, trace_propagation_enabled)
+
+document = _timer.document
+stage = _timer.stage
+trace_headers = _timer.trace_headers